@@ -1,9 +1,12 @@
 from .base import BaseDetDataset
 from .coco import CocoDataset
-from .samplers import (AspectRatioBatchSampler, BaseBatchSampler,
-                       PadBatchSampler)
-from .transforms import (LoadAnnotations, LoadImageFromFile, PackDetInputs,
-                         RandomChoiceResize, RandomFlip, RandomResize, Resize)
+from .samplers import (AspectRatioBatchSampler, AspectRatioBucketBatchSampler,
+                       BaseBatchSampler, PadBatchSampler,
+                       ShapeBucketBatchSampler, ShardBatchSampler)
+from .transforms import (LoadAnnotations, LoadImageFromFile,
+                         LoadImageFromShard, LoadWaveletFeatures,
+                         PackDetInputs, RandomChoiceResize, RandomFlip,
+                         RandomResize, Resize)
 from .voc import VocDataset
 from .wrappers import ConcatDataset
 from .sardet100k import Sardet100k
@@ -12,5 +15,7 @@ __all__ = [
     'BaseDetDataset', 'CocoDataset', 'VocDataset', 'BaseBatchSampler',
     'PadBatchSampler', 'AspectRatioBatchSampler', 'PackDetInputs', 'Resize',
     'LoadAnnotations', 'LoadImageFromFile', 'RandomResize', 'RandomFlip',
-    'RandomChoiceResize', 'ConcatDataset', 'Sardet100k'
+    'RandomChoiceResize', 'ConcatDataset', 'Sardet100k', 'ShardBatchSampler',
+    'LoadImageFromShard', 'LoadWaveletFeatures', 'ShapeBucketBatchSampler',
+    'AspectRatioBucketBatchSampler'
 ]
@@ -1,5 +1,6 @@
 import copy
 import os.path as osp
+from collections import deque
 
 import jittor as jt
 import numpy as np
@@ -7,6 +8,7 @@ from jittor.dataset import Dataset
 
 from jittordet.engine import BATCH_SAMPLERS, TRANSFORMS
 from jittordet.structures import DetDataSample, InstanceData
+from .data_list import ColumnarDataList, PackedDataList
 
 
 class Compose:
@@ -39,6 +41,11 @@ class Compose:
                     f'transform must be a callable object or dict, '
                     f'but got {type(transform)}')
 
+        # some transforms adapt themselves to the following transforms
+        for i, transform in enumerate(self.transforms):
+            if hasattr(transform, 'look_ahead'):
+                transform.look_ahead(self.transforms[i + 1:])
+
     def __call__(self, data):
         for t in self.transforms:
             data = t(data)
@@ -48,6 +55,19 @@ class Compose:
 
 
 class BaseDetDataset(Dataset):
+    """Base dataset for detection.
+
+    Args:
+        serialize_data (bool): Whether to pack ``data_list`` into a
+            :class:`PackedDataList` after loading and filtering. Packed data
+            list is shared by data loader workers without copy-on-write.
+            Defaults to True.
+        pack_inputs (bool): Whether to pack the images of a batch into one
+            flattened buffer in :meth:`collate_batch`, so that they are sent
+            by workers and moved to the device as a single array, and kept
+            in their original dtype (usually uint8) until the preprocessor.
+            Defaults to True.
+    """
 
     METAINFO = dict()
 
@@ -62,10 +82,13 @@ class BaseDetDataset(Dataset):
                  transforms=None,
                  batch_sampler=None,
                  max_refetch=100,
+                 serialize_data=True,
+                 pack_inputs=True,
                  **kwargs):
         super().__init__(
             batch_size=batch_size, num_workers=num_workers, **kwargs)
         self.data_root = data_root
+        self.pack_inputs = pack_inputs
         self.filter_cfg = copy.deepcopy(filter_cfg)
         self.test_mode = test_mode
         self.max_refetch = max_refetch
@@ -78,6 +101,9 @@ class BaseDetDataset(Dataset):
         self.data_list = self.load_data_list()
         # fliter illegal data
         self.data_list = self.filter_data()
+        # pack data list to avoid copy-on-write in workers
+        if serialize_data:
+            self.data_list = self.serialize_data_list(self.data_list)
 
         # set total length for jittor.utils.dataset
         self.total_len = len(self.data_list)
@@ -90,6 +116,7 @@ class BaseDetDataset(Dataset):
                 batch_sampler, dataset=self)
         else:
             self.batch_sampler = None
+        self._reset_sampler_state()
 
     @property
     def metainfo(self):
@@ -142,8 +169,20 @@ class BaseDetDataset(Dataset):
     def filter_data(self):
         return self.data_list
 
+    @staticmethod
+    def serialize_data_list(data_list):
+        if isinstance(data_list, (PackedDataList, ColumnarDataList)):
+            return data_list
+        return PackedDataList(data_list)
+
+    def get_data_info(self, idx):
+        # items of compact data lists are decoded into new objects
+        if isinstance(self.data_list, (PackedDataList, ColumnarDataList)):
+            return self.data_list[idx]
+        return copy.deepcopy(self.data_list[idx])
+
     def prepare_data(self, idx):
-        data_info = copy.deepcopy(self.data_list[idx])
+        data_info = self.get_data_info(idx)
         if idx >= 0:
             data_info['sample_idx'] = idx
         else:
@@ -185,15 +224,127 @@ class BaseDetDataset(Dataset):
             return super().__batch_len__()
 
     def _get_index_list(self):
+        if self._discard_next_index:
+            # the list got at the start of ``__iter__`` is not used if the
+            # workers exist, workers get lists generated inside the loop
+            self._discard_next_index = False
+            return self._last_index
+
+        rng_state = copy.deepcopy(self._shuffle_rng.bit_generator.state)
         if self.batch_sampler is not None:
             index = self.batch_sampler.get_index_list(rng=self._shuffle_rng)
             self.real_len = len(index)
             self.batch_len = len(self.batch_sampler)
             world_size = 1 if not jt.in_mpi else jt.world_size
             self.real_batch_size = int(self.batch_size // world_size)
-            return index
         else:
-            return super()._get_index_list()
+            index = super()._get_index_list()
+        num_batches = self.batch_len
+
+        if self._skip_batches > 0:
+            # only the remaining samples are read, so the last batch is not
+            # filled with consumed ones whether or not workers exist
+            skip = self._skip_batches * self.real_batch_size
+            index = index[skip:]
+            self.real_len = len(index)
+            self.batch_len = num_batches - self._skip_batches
+            self._cursor = self._skip_batches
+            self._skip_batches = 0
+            if self.num_workers > 0:
+                self._shared_len = self.real_len
+        elif self._shared_len is not None:
+            # the list prefetched by the workers of a resumed epoch is never
+            # read, but it is copied into the index list shared with them
+            index = np.resize(index, self._shared_len)
+            self.real_len = self._shared_len
+
+        self._index_records.append((rng_state, num_batches))
+        self._last_index = index
+        return index
+
+    def __iter__(self):
+        # workers are forked with the number of batches of the epoch, so the
+        # epoch resumed in the middle runs alone with its own workers.
+        resumed = self._skip_batches > 0 and self.num_workers > 0
+        endless = self.endless
+        self.endless = endless and not resumed
+        self._discard_next_index = self.num_workers > 0 and \
+            hasattr(self, 'workers')
+        for batch in super().__iter__():
+            self._consume_batch()
+            yield batch
+
+        if resumed:
+            self.reset()
+            self._shared_len = None
+            # the lists prefetched by the terminated workers are generated
+            # again for new workers
+            if len(self._index_records) > 0:
+                self._shuffle_rng.bit_generator.state = \
+                    self._index_records[0][0]
+                self._index_records.clear()
+            self.endless = endless
+            if endless:
+                yield from self.__iter__()
+
+    def _reset_sampler_state(self):
+        # (rng state, number of batches) of the index lists which have been
+        # generated but not fully consumed
+        self._index_records = deque()
+        self._cursor = 0
+        self._last_index = None
+        self._discard_next_index = False
+        self._skip_batches = 0
+        # length of the index list shared with the workers of a resumed epoch
+        self._shared_len = None
+
+    def reset(self):
+        # ``Dataset.reset`` of jittor refers to ``gid_obj`` and ``idmap``,
+        # which are not created by ``_init_workers``
+        if hasattr(self, 'workers'):
+            self.gid_obj = self.gid.get_obj()
+            self.idmap = None
+            super().reset()
+            del self.gid_obj
+
+    def _consume_batch(self):
+        if len(self._index_records) == 0:
+            return
+        self._cursor += 1
+        if self._cursor >= self._index_records[0][1]:
+            self._index_records.popleft()
+            self._cursor = 0
+
+    def sampler_state_dict(self):
+        """Get the state to resume sampling from the next batch.
+
+        The state consists of the state of the shuffle rng before the index
+        list of the current epoch is generated, and the number of batches of
+        the epoch which have been consumed. Index lists prefetched by workers
+        are not counted.
+
+        Returns:
+            dict: The sampler state.
+        """
+        if len(self._index_records) > 0:
+            rng_state, cursor = self._index_records[0][0], self._cursor
+        else:
+            rng_state, cursor = self._shuffle_rng.bit_generator.state, 0
+        return dict(rng_state=copy.deepcopy(rng_state), cursor=cursor)
+
+    def load_sampler_state_dict(self, state):
+        """Load the state got by :meth:`sampler_state_dict`, it should be
+        called before iterating the dataset.
+
+        The index list of the epoch is regenerated by the batch sampler (or
+        the default sampler) with the saved rng state, and the consumed
+        batches are skipped on every rank.
+        """
+        assert not hasattr(self, 'workers'), \
+            'sampler state should be loaded before iterating the dataset'
+        self._shuffle_rng.bit_generator.state = state['rng_state']
+        self._reset_sampler_state()
+        self._skip_batches = state['cursor']
 
     def collate_batch(self, batch):
         """Override original `collate_batch` to disable stack."""
@@ -201,7 +352,10 @@ class BaseDetDataset(Dataset):
             new_batch = dict()
             for key in batch[0].keys():
                 value = [data[key] for data in batch]
-                value = self.collate_batch(value)
+                if key == 'inputs' and self.pack_inputs:
+                    value = self.pack_batch_inputs(value)
+                else:
+                    value = self.collate_batch(value)
                 new_batch[key] = value
         elif isinstance(batch[0], list):
             new_batch = list()
@@ -220,6 +374,25 @@ class BaseDetDataset(Dataset):
             new_batch = batch
         return new_batch
 
+    @staticmethod
+    def pack_batch_inputs(inputs):
+        """Pack (C, H, W) images into a dict of a flattened ``img_buffer``
+        and their ``img_shapes``. Inputs in other formats are kept."""
+        if not all(
+                isinstance(img, np.ndarray) and img.ndim == 3
+                for img in inputs):
+            return inputs
+        dtype = np.result_type(*inputs)
+        img_buffer = np.empty(sum(img.size for img in inputs), dtype=dtype)
+        offset = 0
+        for img in inputs:
+            # non-contiguous (e.g. transposed) images are copied only once
+            img_buffer[offset:offset + img.size].reshape(img.shape)[...] = img
+            offset += img.size
+        return dict(
+            img_buffer=img_buffer,
+            img_shapes=[tuple(img.shape) for img in inputs])
+
     def to_jittor(self, batch):
         """Override to_jittor function in jittor.utils.dataset."""
         if self.keep_numpy_array:
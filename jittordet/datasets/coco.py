@@ -1,16 +1,26 @@
 # Modified from mmdetection.dataset.coco
 import copy
+import os
 import os.path as osp
 
 from pycocotools.coco import COCO
 
 from ..engine import DATASETS
 from .base import BaseDetDataset
+from .data_list import ColumnarDataList, file_stat, get_cache_path
 
 
 @DATASETS.register_module()
 class CocoDataset(BaseDetDataset):
-    """Dataset for COCO."""
+    """Dataset for COCO.
+
+    Args:
+        cache_dir (str, optional): If set, the parsed and filtered data list
+            is cached in this directory as memory-mapped columnar arrays. The
+            cache is keyed by the annotation file's path, mtime and size,
+            ``img_path``, ``filter_cfg``, ``test_mode`` and metainfo classes.
+            Defaults to None.
+    """
 
     METAINFO = {
         'classes':
@@ -51,7 +61,26 @@ class CocoDataset(BaseDetDataset):
          (246, 0, 122), (191, 162, 208)]
     }
 
+    def __init__(self, *args, cache_dir=None, **kwargs):
+        self.cache_dir = cache_dir
+        self._cache_path = None
+        self._data_from_cache = False
+        super().__init__(*args, **kwargs)
+
     def load_data_list(self):
+        if self.cache_dir is not None:
+            self._cache_path = get_cache_path(
+                self.cache_dir,
+                self.__class__.__name__,
+                ann_file=file_stat(self.ann_file),
+                img_path=self.img_path,
+                filter_cfg=self.filter_cfg,
+                test_mode=self.test_mode,
+                classes=self.metainfo['classes'])
+            if osp.isdir(self._cache_path):
+                self._data_from_cache = True
+                return ColumnarDataList.load(self._cache_path)
+
         self.coco = COCO(self.ann_file)
         # The order of returned `cat_ids` will not
         # change with the order of the `classes`
@@ -116,6 +145,17 @@ class CocoDataset(BaseDetDataset):
         return data_info
 
     def filter_data(self):
+        if self._data_from_cache:
+            return self.data_list
+
+        data_list = self._filter_data()
+        if self._cache_path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data_list = ColumnarDataList.from_data_infos(data_list)
+            data_list.dump(self._cache_path)
+        return data_list
+
+    def _filter_data(self):
         if self.test_mode:
             return self.data_list
 
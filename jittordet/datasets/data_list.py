@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+import shutil
+import uuid
+
+import numpy as np
+
+# bump it when the layout of the dumped columns changes, so that caches
+# written by older versions are rebuilt instead of loaded
+CACHE_VERSION = 2
+
+
+class PackedDataList:
+    """A read-only list of data infos packed into one byte buffer.
+
+    Each data info is pickled and all of them are concatenated into a single
+    ``np.uint8`` buffer with an ``int64`` offsets array. Compared with a list
+    of nested dicts, reading items never touches python object refcounts of
+    the whole list, so forked data loader workers can share the pages instead
+    of copying them on write.
+
+    Args:
+        data_infos (Iterable[dict]): Data infos to be packed.
+    """
+
+    def __init__(self, data_infos):
+        buffers = [
+            np.frombuffer(
+                pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL),
+                dtype=np.uint8) for info in data_infos
+        ]
+        self.offsets = np.zeros(len(buffers) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(b) for b in buffers])
+        self.buffer = np.concatenate(buffers) if len(buffers) > 0 \
+            else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('data list index out of range')
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return pickle.loads(memoryview(self.buffer[start:end]))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class ColumnarDataList:
+    """A read-only list of data infos stored as struct-of-arrays.
+
+    Image level fields (``img_id``, ``img_path``, ``height`` ...) are stored
+    as one array per key, and instance level fields (``bbox``,
+    ``bbox_label``, ``ignore_flag`` ...) are flattened over all images and
+    indexed by ``inst_offsets``. Items are decoded into fresh dicts on access,
+    so the returned data info can be modified freely.
+
+    Only fields that can be represented as fixed-shape arrays are supported,
+    e.g., polygon ``mask`` of instances will not be kept.
+
+    Args:
+        img_columns (dict): Image level arrays with length ``N``.
+        inst_columns (dict): Instance level arrays with length ``M``.
+        inst_offsets (np.ndarray): Int64 array with length ``N + 1``, the
+            instances of i-th image are ``inst_offsets[i]:inst_offsets[i+1]``.
+    """
+
+    def __init__(self, img_columns, inst_columns, inst_offsets):
+        self.img_columns = img_columns
+        self.inst_columns = inst_columns
+        self.inst_offsets = inst_offsets
+
+    @staticmethod
+    def _to_array(values):
+        array = np.array(values)
+        if array.dtype.kind == 'U':
+            array = np.char.encode(array, 'utf-8')
+        return array
+
+    @staticmethod
+    def _to_python(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value.item()
+
+    @classmethod
+    def from_data_infos(cls, data_infos, inst_keys=None):
+        """Build from a list of data info dicts.
+
+        Args:
+            data_infos (list[dict]): Data infos with an ``instances`` key.
+            inst_keys (list[str], optional): Instance keys to be kept.
+                Defaults to ``('bbox', 'bbox_label', 'ignore_flag')``.
+        """
+        if inst_keys is None:
+            inst_keys = ('bbox', 'bbox_label', 'ignore_flag')
+
+        img_keys = []
+        if len(data_infos) > 0:
+            img_keys = [k for k in data_infos[0] if k != 'instances']
+        img_columns = {
+            key: cls._to_array([info[key] for info in data_infos])
+            for key in img_keys
+        }
+
+        num_insts = [len(info.get('instances', [])) for info in data_infos]
+        inst_offsets = np.zeros(len(data_infos) + 1, dtype=np.int64)
+        inst_offsets[1:] = np.cumsum(num_insts)
+
+        inst_columns = {}
+        if inst_offsets[-1] > 0:
+            for key in inst_keys:
+                inst_columns[key] = cls._to_array([
+                    ins[key] for info in data_infos
+                    for ins in info['instances']
+                ])
+        return cls(img_columns, inst_columns, inst_offsets)
+
+    def __len__(self):
+        return len(self.inst_offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('data list index out of range')
+
+        data_info = {
+            key: self._to_python(column[idx])
+            for key, column in self.img_columns.items()
+        }
+        start = int(self.inst_offsets[idx])
+        end = int(self.inst_offsets[idx + 1])
+        inst_values = {
+            key: column[start:end].tolist()
+            for key, column in self.inst_columns.items()
+        }
+        data_info['instances'] = [{
+            key: values[i]
+            for key, values in inst_values.items()
+        } for i in range(end - start)]
+        return data_info
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def subset(self, indices):
+        """Select the data infos at ``indices`` without decoding them."""
+        indices = np.asarray(indices, dtype=np.int64)
+        img_columns = {
+            key: column[indices]
+            for key, column in self.img_columns.items()
+        }
+        starts = self.inst_offsets[indices]
+        num_insts = self.inst_offsets[indices + 1] - starts
+        inst_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        inst_offsets[1:] = np.cumsum(num_insts)
+        # positions of the selected instances in the instance columns
+        inst_inds = np.repeat(starts - inst_offsets[:-1], num_insts) + \
+            np.arange(inst_offsets[-1])
+        inst_columns = {
+            key: column[inst_inds]
+            for key, column in self.inst_columns.items()
+        }
+        return ColumnarDataList(img_columns, inst_columns, inst_offsets)
+
+    def dump(self, path):
+        """Dump columns to ``path`` as ``.npy`` files.
+
+        Files are firstly written into a temporary directory and then renamed
+        to ``path``, so that concurrent processes never see a partial cache.
+        """
+        tmp_path = f'{path}.tmp.{uuid.uuid4().hex}'
+        os.makedirs(tmp_path)
+        meta = dict(
+            img_keys=list(self.img_columns), inst_keys=list(self.inst_columns))
+        for key, column in self.img_columns.items():
+            np.save(osp.join(tmp_path, f'img.{key}.npy'), column)
+        for key, column in self.inst_columns.items():
+            np.save(osp.join(tmp_path, f'inst.{key}.npy'), column)
+        np.save(osp.join(tmp_path, 'inst_offsets.npy'), self.inst_offsets)
+        with open(osp.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process has finished dumping the same cache.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load columns dumped by :meth:`dump`, memory-mapped by default."""
+        mmap_mode = 'r' if mmap else None
+        with open(osp.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        def load_column(name):
+            return np.load(osp.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+        img_columns = {
+            key: load_column(f'img.{key}')
+            for key in meta['img_keys']
+        }
+        inst_columns = {
+            key: load_column(f'inst.{key}')
+            for key in meta['inst_keys']
+        }
+        inst_offsets = load_column('inst_offsets')
+        return cls(img_columns, inst_columns, inst_offsets)
+
+
+def get_cache_path(cache_dir, prefix, **key_items):
+    """Get the cache path whose name is hashed from ``key_items``."""
+    key_items['cache_version'] = CACHE_VERSION
+    key = json.dumps(key_items, sort_keys=True, default=str)
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return osp.join(cache_dir, f'{prefix}_{key}')
+
+
+def file_stat(filename):
+    """Get the stat items of a file which are used to invalidate caches."""
+    stat = os.stat(filename)
+    return dict(
+        path=osp.abspath(filename), mtime=stat.st_mtime, size=stat.st_size)
@@ -0,0 +1,123 @@
+import json
+import os
+import os.path as osp
+
+import numpy as np
+
+
+def _feature_key(img_path, flip_direction=None):
+    direction = 'none' if flip_direction is None else flip_direction
+    return f'{osp.normpath(img_path)}|{direction}'.encode('utf-8')
+
+
+class FeatureStoreWriter:
+    """Write fixed-shape feature maps into a memory-mapped store.
+
+    All features are kept in one ``features.npy`` array with shape
+    ``(num_items, *feat_shape)``, which is allocated up front and filled row
+    by row. Each row is keyed by the image path and the flip direction it is
+    computed with. :meth:`close` writes ``index.npz`` and ``meta.json`` which
+    are read by :class:`FeatureStoreReader`.
+
+    Args:
+        out_dir (str): Output directory.
+        num_items (int): Number of feature maps to be written.
+        feat_shape (tuple[int]): Shape of each feature map.
+        dtype (str): Data type of the store. Defaults to 'float16'.
+        meta (dict, optional): Extra information saved in ``meta.json``,
+            e.g., the image shape the features are computed at.
+    """
+
+    def __init__(self,
+                 out_dir,
+                 num_items,
+                 feat_shape,
+                 dtype='float16',
+                 meta=None):
+        self.out_dir = out_dir
+        self.meta = dict() if meta is None else meta
+        os.makedirs(out_dir, exist_ok=True)
+        self.features = np.lib.format.open_memmap(
+            osp.join(out_dir, 'features.npy'),
+            mode='w+',
+            dtype=dtype,
+            shape=(num_items, ) + tuple(feat_shape))
+        self.keys = []
+
+    def write(self, img_path, feat, flip_direction=None):
+        """Write the feature map of an image with a flip direction."""
+        if len(self.keys) >= len(self.features):
+            raise IndexError('the feature store is full')
+        self.features[len(self.keys)] = feat
+        self.keys.append(_feature_key(img_path, flip_direction))
+
+    def close(self):
+        if self.features is None:
+            return
+        self.features.flush()
+        keys = np.array(self.keys, dtype=bytes)
+        order = np.argsort(keys, kind='stable')
+        np.savez(
+            osp.join(self.out_dir, 'index.npz'),
+            keys=keys[order],
+            rows=np.arange(len(keys), dtype=np.int64)[order])
+        meta = dict(self.meta)
+        meta.update(
+            num_items=len(self.keys),
+            feat_shape=list(self.features.shape[1:]),
+            dtype=str(self.features.dtype))
+        with open(osp.join(self.out_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        self.features = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FeatureStoreReader:
+    """Read feature maps from a store written by :class:`FeatureStoreWriter`.
+
+    The sorted index is looked up with binary search and ``features.npy`` is
+    memory-mapped lazily in each process, so forked data loader workers share
+    the page cache and never copy the store when the reader is pickled.
+
+    Args:
+        store_dir (str): Directory of the feature store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(osp.join(store_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        with np.load(osp.join(store_dir, 'index.npz')) as index:
+            self.keys = index['keys']
+            self.rows = index['rows']
+        self._features = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = np.load(
+                osp.join(self.store_dir, 'features.npy'), mmap_mode='r')
+        return self._features
+
+    def get(self, img_path, flip_direction=None):
+        """Get the feature map of an image with a flip direction."""
+        key = _feature_key(img_path, flip_direction)
+        idx = np.searchsorted(self.keys, key)
+        if idx >= len(self.keys) or self.keys[idx] != key:
+            raise KeyError(f'{img_path} with flip direction '
+                           f'{flip_direction} is not found in '
+                           f'{self.store_dir}')
+        return np.array(self.features[self.rows[idx]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_features'] = None
+        return state
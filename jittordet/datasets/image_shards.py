@@ -0,0 +1,149 @@
+import json
+import os
+import os.path as osp
+
+import numpy as np
+
+
+def _shard_key(img_path):
+    return osp.normpath(img_path).encode('utf-8')
+
+
+class ImageShardWriter:
+    """Write encoded image files into large shard files.
+
+    Image bytes are appended as they are (no re-encoding) to
+    ``shard-xxxxx.bin`` files. A new shard is started once the current one
+    exceeds ``shard_size`` bytes. :meth:`close` writes ``index.npz`` and
+    ``meta.json`` which are read by :class:`ImageShardReader`.
+
+    Args:
+        out_dir (str): Output directory.
+        shard_size (int): Max bytes of one shard. Defaults to 1GB.
+    """
+
+    def __init__(self, out_dir, shard_size=1 << 30):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.shard_files = []
+        self.keys, self.shard_ids, self.offsets, self.lengths = [], [], [], []
+        self._file = None
+        self._offset = 0
+
+    def _new_shard(self):
+        if self._file is not None:
+            self._file.close()
+        filename = f'shard-{len(self.shard_files):05d}.bin'
+        self.shard_files.append(filename)
+        self._file = open(osp.join(self.out_dir, filename), 'wb')
+        self._offset = 0
+
+    def write(self, img_path, img_bytes=None):
+        """Append one image, read from ``img_path`` if bytes are not given."""
+        if img_bytes is None:
+            with open(img_path, 'rb') as f:
+                img_bytes = f.read()
+        if self._file is None or self._offset >= self.shard_size:
+            self._new_shard()
+
+        self._file.write(img_bytes)
+        self.keys.append(_shard_key(img_path))
+        self.shard_ids.append(len(self.shard_files) - 1)
+        self.offsets.append(self._offset)
+        self.lengths.append(len(img_bytes))
+        self._offset += len(img_bytes)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        keys = np.array(self.keys, dtype=bytes)
+        order = np.argsort(keys, kind='stable')
+        np.savez(
+            osp.join(self.out_dir, 'index.npz'),
+            keys=keys[order],
+            shard_ids=np.array(self.shard_ids, dtype=np.int32)[order],
+            offsets=np.array(self.offsets, dtype=np.int64)[order],
+            lengths=np.array(self.lengths, dtype=np.int64)[order])
+        with open(osp.join(self.out_dir, 'meta.json'), 'w') as f:
+            json.dump(dict(shard_files=self.shard_files), f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ImageShardReader:
+    """Read encoded image bytes from shards written by
+    :class:`ImageShardWriter`.
+
+    The index is sorted by image path and looked up with binary search, so
+    it is held in a few numpy arrays instead of a python dict. Shard files
+    are opened lazily in each process and advised for sequential access, and
+    the kernel is asked to prefetch ``readahead`` bytes after every read.
+
+    Args:
+        shard_dir (str): Directory of the shards.
+        readahead (int): Bytes to prefetch after each read. Defaults to 8MB.
+    """
+
+    def __init__(self, shard_dir, readahead=8 << 20):
+        self.shard_dir = shard_dir
+        self.readahead = readahead
+        with open(osp.join(shard_dir, 'meta.json'), 'r') as f:
+            self.shard_files = json.load(f)['shard_files']
+        with np.load(osp.join(shard_dir, 'index.npz')) as index:
+            self.keys = index['keys']
+            self.shard_ids = index['shard_ids']
+            self.offsets = index['offsets']
+            self.lengths = index['lengths']
+
+        self._pid = None
+        self._fds = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def locate(self, img_path):
+        """Get ``(shard_id, offset, length)`` of an image."""
+        key = _shard_key(img_path)
+        idx = np.searchsorted(self.keys, key)
+        if idx >= len(self.keys) or self.keys[idx] != key:
+            raise KeyError(f'{img_path} is not found in {self.shard_dir}')
+        return (int(self.shard_ids[idx]), int(self.offsets[idx]),
+                int(self.lengths[idx]))
+
+    def _get_fd(self, shard_id):
+        # file descriptors can not be shared by forked workers
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._fds = {}
+        if shard_id not in self._fds:
+            fd = os.open(
+                osp.join(self.shard_dir, self.shard_files[shard_id]),
+                os.O_RDONLY)
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            self._fds[shard_id] = fd
+        return self._fds[shard_id]
+
+    def get(self, img_path):
+        """Get the encoded bytes of an image."""
+        shard_id, offset, length = self.locate(img_path)
+        fd = self._get_fd(shard_id)
+        img_bytes = os.pread(fd, length, offset)
+        if self.readahead > 0 and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, offset + length, self.readahead,
+                             os.POSIX_FADV_WILLNEED)
+        return img_bytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pid'] = None
+        state['_fds'] = {}
+        return state
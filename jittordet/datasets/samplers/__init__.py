@@ -1,5 +1,12 @@
 from .aspect_ratio_batch_sampler import AspectRatioBatchSampler
+from .aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
 from .base_batch_sampler import BaseBatchSampler
 from .pad_batch_sampler import PadBatchSampler
+from .shape_bucket_batch_sampler import ShapeBucketBatchSampler
+from .shard_batch_sampler import ShardBatchSampler
 
-__all__ = ['BaseBatchSampler', 'PadBatchSampler', 'AspectRatioBatchSampler']
+__all__ = [
+    'BaseBatchSampler', 'PadBatchSampler', 'AspectRatioBatchSampler',
+    'ShardBatchSampler', 'ShapeBucketBatchSampler',
+    'AspectRatioBucketBatchSampler'
+]
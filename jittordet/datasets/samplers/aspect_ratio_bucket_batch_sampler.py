@@ -0,0 +1,124 @@
+import logging
+
+import jittor as jt
+import numpy as np
+
+from jittordet.engine import BATCH_SAMPLERS, print_log
+from .base_batch_sampler import BaseBatchSampler
+
+
+def _quantize(values, num_bins):
+    """Quantize values into ``num_bins`` bins holding similar numbers of
+    values."""
+    if num_bins <= 1 or values.size == 0:
+        return np.zeros(values.size, dtype=np.int64)
+    edges = np.quantile(values, np.linspace(0, 1, num_bins + 1)[1:-1])
+    return np.searchsorted(np.unique(edges), values, side='right')
+
+
+@BATCH_SAMPLERS.register_module()
+class AspectRatioBucketBatchSampler(BaseBatchSampler):
+    """Batch sampler that groups samples by quantized aspect ratios and
+    sizes.
+
+    Different from :class:`AspectRatioBatchSampler` which only splits samples
+    into landscape and portrait ones, the log aspect ratios and the log areas
+    of the resized samples are quantized into ``num_ratio_buckets`` and
+    ``num_size_buckets`` bins by their quantiles. Batches of each rank are
+    built inside the ``num_ratio_buckets * num_size_buckets`` buckets, and
+    the remainders of buckets are batched in the order of buckets. The
+    padding ratio, i.e., the fraction of padded pixels in batches, is logged
+    at each epoch and kept in ``padding_ratio``.
+
+    Args:
+        dataset (BaseDetDataset): The dataset.
+        num_ratio_buckets (int): Number of aspect ratio bins. Defaults to 4.
+        num_size_buckets (int): Number of size bins. Defaults to 2.
+        pad_size_divisor (int): The same as the one of the preprocessor.
+            Defaults to 1.
+        drop_last (bool): Whether to drop the last incomplete batch.
+            Defaults to False.
+    """
+
+    def __init__(self,
+                 dataset,
+                 num_ratio_buckets=4,
+                 num_size_buckets=2,
+                 pad_size_divisor=1,
+                 drop_last=False):
+        super().__init__(dataset=dataset)
+        self.drop_last = drop_last
+        self.shapes = self.get_resized_shapes(dataset, pad_size_divisor)
+        self.padding_ratio = None
+
+        log_shapes = np.log(np.maximum(self.shapes, 1))
+        ratio_ids = _quantize(log_shapes[:, 0] - log_shapes[:, 1],
+                              num_ratio_buckets)
+        size_ids = _quantize(log_shapes.sum(1), num_size_buckets)
+        bucket_ids = ratio_ids * num_size_buckets + size_ids
+        self.bucket_groups = [
+            np.nonzero(bucket_ids == i)[0]
+            for i in range(num_ratio_buckets * num_size_buckets)
+        ]
+        self.bucket_groups = [g for g in self.bucket_groups if g.size > 0]
+
+    def get_index_list(self, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+
+        world_size = 1 if not jt.in_mpi else jt.world_size
+        total_bs = self.total_bs
+        real_bs = int(total_bs // world_size)
+        assert real_bs * world_size == total_bs
+
+        # batches of each rank inside buckets
+        batches, remainders = [], []
+        for group in self.bucket_groups:
+            group = rng.permutation(group)
+            num_full = group.size // real_bs * real_bs
+            batches.append(group[:num_full].reshape(-1, real_bs))
+            remainders.append(group[num_full:])
+        # remainders of adjacent buckets are batched together
+        remainders = np.concatenate(remainders + [np.zeros(0)])
+        num_full = remainders.size // real_bs * real_bs
+        batches.append(remainders[:num_full].reshape(-1, real_bs))
+
+        index = np.concatenate(batches, axis=0).astype(np.int64)
+        if index.shape[0] == 0:
+            # fewer samples than a batch
+            index = np.resize(remainders, (1, real_bs)).astype(np.int64)
+        shuffle_idx = rng.permutation(index.shape[0])
+        index = index[shuffle_idx]
+
+        real_bs_num = len(self) * world_size
+        repeat_num = int((real_bs_num - 0.5) // max(index.shape[0], 1) + 1)
+        index = np.concatenate([index] * repeat_num, axis=0)
+        index = index[:real_bs_num]
+
+        self.padding_ratio = self.get_padding_ratio(index)
+        # not initialize the logger which is set up by the runner
+        print_log(
+            f'{self.__class__.__name__}: padding ratio of batches is '
+            f'{self.padding_ratio:.2%}',
+            logger=logging.getLogger('jittordet'))
+
+        if jt.in_mpi:
+            index = index.reshape(-1, total_bs)
+            index = index[:, jt.rank * real_bs:(jt.rank + 1) * real_bs]
+
+        index = index.flatten()
+        return index
+
+    def get_padding_ratio(self, index):
+        """Get the fraction of padded pixels in batches.
+
+        Args:
+            index (np.ndarray): Sample indices with shape (num_batches, bs).
+
+        Returns:
+            float: The padding ratio.
+        """
+        shapes = self.shapes[index]
+        batch_areas = shapes.max(1).prod(-1) * index.shape[1]
+        img_areas = shapes.prod(-1).sum(1)
+        return float(1 - img_areas.sum() / max(batch_areas.sum(), 1))
@@ -1,6 +1,11 @@
 from abc import ABCMeta, abstractmethod
+from math import ceil
+
+import numpy as np
 
 from jittordet.engine import BATCH_SAMPLERS
+from jittordet.utils import rescale_size
+from ..transforms.transforms import _get_max_resize_scale
 
 
 @BATCH_SAMPLERS.register_module()
@@ -19,3 +24,34 @@ class BaseBatchSampler(metaclass=ABCMeta):
     @abstractmethod
     def get_index_list(self, rng=None):
         pass
+
+    @staticmethod
+    def get_resized_shapes(dataset, pad_size_divisor=1):
+        """Estimate the (h, w) of all samples after the resize transform of
+        the dataset and the padding to ``pad_size_divisor``.
+
+        Returns:
+            np.ndarray: Shapes with shape (N, 2).
+        """
+        transforms = dataset.transforms
+        if hasattr(transforms, 'composes'):
+            # PartCompose of ConcatDataset
+            transforms = transforms.composes[0]
+        resize_scale = None
+        for transform in transforms.transforms:
+            resize_scale = _get_max_resize_scale(transform)
+            if resize_scale is not None:
+                break
+
+        shapes = []
+        for data in dataset.data_list:
+            h, w = data['height'], data['width']
+            if resize_scale is not None:
+                scale, keep_ratio = resize_scale
+                if keep_ratio:
+                    w, h = rescale_size((w, h), scale)
+                else:
+                    w, h = scale
+            shapes.append((ceil(h / pad_size_divisor) * pad_size_divisor,
+                           ceil(w / pad_size_divisor) * pad_size_divisor))
+        return np.array(shapes, dtype=np.int64).reshape(-1, 2)
@@ -21,7 +21,10 @@ class PadBatchSampler(BaseBatchSampler):
 
         index = rng.permutation(self.num_data_list) if self.shuffle \
             else np.arange(self.num_data_list)
+        return self._pad_and_split(index)
 
+    def _pad_and_split(self, index):
+        """Pad or drop ``index`` to full batches and split it over ranks."""
         mod_size = self.num_data_list % self.total_bs
         if mod_size != 0:
             if self.drop_last:
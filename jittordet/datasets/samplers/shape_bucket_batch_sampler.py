@@ -0,0 +1,67 @@
+import numpy as np
+
+from jittordet.engine import BATCH_SAMPLERS
+from jittordet.utils import get_shape_bucket
+from .pad_batch_sampler import PadBatchSampler
+
+
+@BATCH_SAMPLERS.register_module()
+class ShapeBucketBatchSampler(PadBatchSampler):
+    """Batch sampler that groups samples by canonical batch shapes.
+
+    The shape of every sample after resizing is estimated from its
+    ``height``, ``width`` and the resize transform of the dataset, and the
+    sample is assigned to the smallest bucket holding it. Batches are built
+    inside buckets, so that :class:`Preprocessor` with the same
+    ``batch_shape_buckets`` pads every batch to one of a few shapes and
+    Jittor compiles kernels for these shapes only.
+
+    Args:
+        dataset (BaseDetDataset): The dataset.
+        buckets (list[tuple[int]]): Canonical (h, w) of batches.
+        pad_size_divisor (int): The same as the one of the preprocessor.
+            Defaults to 1.
+        shuffle (bool): Whether to shuffle. Defaults to True.
+        drop_last (bool): Whether to drop the last incomplete batch.
+            Defaults to False.
+    """
+
+    def __init__(self,
+                 dataset,
+                 buckets,
+                 pad_size_divisor=1,
+                 shuffle=True,
+                 drop_last=False):
+        super().__init__(dataset=dataset, shuffle=shuffle, drop_last=drop_last)
+        self.buckets = np.array(buckets, dtype=np.int64).reshape(-1, 2)
+        self.pad_size_divisor = pad_size_divisor
+
+        bucket_ids = [
+            get_shape_bucket(shape, self.buckets)
+            for shape in self.get_resized_shapes(dataset, pad_size_divisor)
+        ]
+        bucket_ids = np.array(bucket_ids, dtype=np.int64).reshape(-1)
+        # samples larger than all buckets are grouped together
+        self.bucket_groups = [
+            np.nonzero(bucket_ids == i)[0]
+            for i in range(-1, len(self.buckets))
+        ]
+        self.bucket_groups = [g for g in self.bucket_groups if g.size > 0]
+
+    def get_index_list(self, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+
+        # full batches inside buckets, and the remainders of all buckets
+        batches, remainders = [], []
+        for group in self.bucket_groups:
+            if self.shuffle:
+                group = rng.permutation(group)
+            num_full = group.size // self.total_bs * self.total_bs
+            batches.extend(group[:num_full].reshape(-1, self.total_bs))
+            remainders.append(group[num_full:])
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        index = np.concatenate(batches + remainders + [np.zeros(0)])
+        index = index.astype(np.int64)
+        return self._pad_and_split(index)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from jittordet.engine import BATCH_SAMPLERS
+from ..image_shards import ImageShardReader
+from .pad_batch_sampler import PadBatchSampler
+
+
+@BATCH_SAMPLERS.register_module()
+class ShardBatchSampler(PadBatchSampler):
+    """Batch sampler that keeps the reading from image shards sequential.
+
+    Samples are grouped by the shard holding their images. When shuffling,
+    the order of shards and the order of samples inside each shard are
+    shuffled, so that workers read one shard at a time. Otherwise samples
+    are sorted by their offsets in the shards.
+
+    Args:
+        dataset (BaseDetDataset): The dataset.
+        shard_dir (str): Directory of the image shards.
+        shuffle (bool): Whether to shuffle. Defaults to True.
+        drop_last (bool): Whether to drop the last incomplete batch.
+            Defaults to False.
+    """
+
+    def __init__(self, dataset, shard_dir, shuffle=True, drop_last=False):
+        super().__init__(dataset=dataset, shuffle=shuffle, drop_last=drop_last)
+        reader = ImageShardReader(shard_dir)
+        locations = [
+            reader.locate(data['img_path'])[:2] for data in dataset.data_list
+        ]
+        locations = np.array(locations, dtype=np.int64).reshape(-1, 2)
+        # sort samples by (shard_id, offset)
+        order = np.lexsort((locations[:, 1], locations[:, 0]))
+        shard_ids = locations[order, 0]
+        split_points = np.nonzero(np.diff(shard_ids))[0] + 1
+        self.shard_groups = np.split(order, split_points)
+
+    def get_index_list(self, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+
+        if self.shuffle and len(self.shard_groups) > 0:
+            shard_order = rng.permutation(len(self.shard_groups))
+            index = np.concatenate(
+                [rng.permutation(self.shard_groups[i]) for i in shard_order])
+        elif len(self.shard_groups) > 0:
+            index = np.concatenate(self.shard_groups)
+        else:
+            index = np.zeros(0, dtype=np.int64)
+        return self._pad_and_split(index)
@@ -1,8 +1,10 @@
 from .formatting import PackDetInputs
-from .loading import LoadAnnotations, LoadImageFromFile
+from .loading import (LoadAnnotations, LoadImageFromFile, LoadImageFromShard,
+                      LoadWaveletFeatures)
 from .transforms import RandomChoiceResize, RandomFlip, RandomResize, Resize
 
 __all__ = [
-    'PackDetInputs', 'LoadAnnotations', 'LoadImageFromFile', 'Resize',
-    'RandomResize', 'RandomChoiceResize', 'RandomFlip'
+    'PackDetInputs', 'LoadAnnotations', 'LoadImageFromFile',
+    'LoadImageFromShard', 'Resize', 'RandomResize', 'RandomChoiceResize',
+    'RandomFlip', 'LoadWaveletFeatures'
 ]
@@ -24,8 +24,9 @@ class PackDetInputs:
             img = results['img']
             if len(img.shape) < 3:
                 img = np.expand_dims(img, -1)
-            img = np.ascontiguousarray(img.transpose(2, 0, 1))
-            packed_results['inputs'] = img
+            # the transposed view is copied into the batch buffer once by
+            # BaseDetDataset.collate_batch
+            packed_results['inputs'] = img.transpose(2, 0, 1)
 
         if 'gt_ignore_flags' in results:
             valid_idx = np.where(results['gt_ignore_flags'] == 0)[0]
@@ -47,6 +48,9 @@ class PackDetInputs:
                 instance_data[self.mapping_table[key]] = results[key]
         data_sample.gt_instances = instance_data
         data_sample.ignored_instances = ignore_instance_data
+        if 'wavelet_feats' in results:
+            # precomputed by LoadWaveletFeatures, consumed by MSFA
+            data_sample.wavelet_feats = results['wavelet_feats']
 
         img_meta = {}
         for key in self.meta_keys:
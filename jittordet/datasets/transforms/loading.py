@@ -1,32 +1,189 @@
+import os.path as osp
+
 import cv2
 import numpy as np
 
 from jittordet.engine import TRANSFORMS
+from jittordet.utils import rescale_size
+from ..feature_store import FeatureStoreReader
+from ..image_shards import ImageShardReader
+from .transforms import _get_max_resize_scale
+
+IMREAD_FLAGS = {
+    'color': {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    },
+    'grayscale': {
+        1: cv2.IMREAD_GRAYSCALE,
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+    }
+}
 
 
 @TRANSFORMS.register_module()
 class LoadImageFromFile:
-    """Load an image from file."""
+    """Load an image from file.
 
-    def __init__(self, to_float32=False):
+    Args:
+        to_float32 (bool): Whether to convert the image to float32.
+            Defaults to False.
+        color_type (str): ``'color'`` decodes 3-channel BGR images and
+            ``'grayscale'`` decodes single-channel images of shape (H, W),
+            e.g., for SAR data. Defaults to ``'color'``.
+        reduced_decode (bool): Whether to decode JPEG images at 1/2, 1/4 or
+            1/8 resolution when the following resize transform shrinks them
+            anyway. The largest reduction whose output still covers the
+            resize target is used. ``ori_shape`` keeps the full resolution
+            shape and the resize transform computes ``scale_factor`` against
+            it, so boxes and rescaling at evaluation are unchanged.
+            Requires ``height`` and ``width`` in the data info.
+            Defaults to False.
+    """
+
+    def __init__(self,
+                 to_float32=False,
+                 color_type='color',
+                 reduced_decode=False):
+        assert color_type in IMREAD_FLAGS, \
+            f'color_type should be in {list(IMREAD_FLAGS)}, ' \
+            f'but got {color_type}'
         self.to_float32 = to_float32
+        self.color_type = color_type
+        self.reduced_decode = reduced_decode
+        self.resize_scale = None
+
+    def look_ahead(self, transforms):
+        """Find the resize target from the transforms after loading."""
+        for transform in transforms:
+            if isinstance(transform, LoadAnnotations):
+                continue
+            self.resize_scale = _get_max_resize_scale(transform)
+            break
+
+    def _get_reduce_factor(self, results):
+        if not self.reduced_decode or self.resize_scale is None:
+            return 1
+        if osp.splitext(results['img_path'])[1].lower() not in \
+                ('.jpg', '.jpeg'):
+            return 1
+        if 'height' not in results or 'width' not in results:
+            return 1
+
+        h, w = results['height'], results['width']
+        scale, keep_ratio = self.resize_scale
+        if keep_ratio:
+            target_w, target_h = rescale_size((w, h), scale)
+        else:
+            target_w, target_h = scale
+        for factor in (8, 4, 2):
+            if -(-w // factor) >= target_w and -(-h // factor) >= target_h:
+                return factor
+        return 1
+
+    def _imread(self, img_path, flags=cv2.IMREAD_COLOR):
+        return cv2.imread(img_path, flags)
 
     def __call__(self, results):
-        img = cv2.imread(results['img_path'])
+        factor = self._get_reduce_factor(results)
+        if factor > 1:
+            img = self._imread(results['img_path'],
+                               IMREAD_FLAGS[self.color_type][factor])
+            h, w = results['height'], results['width']
+            if img is None or img.shape[:2] != (-(-h // factor),
+                                                -(-w // factor)):
+                # annotated size mismatches the file, decode it fully.
+                factor = 1
+        if factor == 1:
+            img = self._imread(results['img_path'],
+                               IMREAD_FLAGS[self.color_type][1])
         if self.to_float32:
             img = img.astype(np.float32)
 
         results['img'] = img
         results['img_shape'] = img.shape[:2]
-        results['ori_shape'] = img.shape[:2]
+        if factor > 1:
+            results['ori_shape'] = (results['height'], results['width'])
+            results['decode_scale_factor'] = (img.shape[1] / results['width'],
+                                              img.shape[0] / results['height'])
+        else:
+            results['ori_shape'] = img.shape[:2]
         return results
 
     def __repr__(self):
         repr_str = (f'{self.__class__.__name__}('
-                    f'to_float32={self.to_float32})')
+                    f'to_float32={self.to_float32}, '
+                    f'color_type={self.color_type}, '
+                    f'reduced_decode={self.reduced_decode})')
+        return repr_str
+
+
+@TRANSFORMS.register_module()
+class LoadImageFromShard(LoadImageFromFile):
+    """Load an image from shards built by ``tools/build_shards.py``.
+
+    Args:
+        shard_dir (str): Directory of the image shards.
+        readahead (int): Bytes prefetched after each read. Defaults to 8MB.
+    """
+
+    def __init__(self, shard_dir, readahead=8 << 20, **kwargs):
+        super().__init__(**kwargs)
+        self.shard_dir = shard_dir
+        self.reader = ImageShardReader(shard_dir, readahead=readahead)
+
+    def _imread(self, img_path, flags=cv2.IMREAD_COLOR):
+        img_bytes = self.reader.get(img_path)
+        return cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), flags)
+
+    def __repr__(self):
+        repr_str = (f'{self.__class__.__name__}('
+                    f'shard_dir={self.shard_dir}, '
+                    f'to_float32={self.to_float32}, '
+                    f'color_type={self.color_type})')
         return repr_str
 
 
+@TRANSFORMS.register_module()
+class LoadWaveletFeatures:
+    """Load the wavelet features of MSFA precomputed by
+    ``tools/build_wavelet_features.py``.
+
+    It should be placed after all geometric transforms (e.g. ``Resize`` and
+    ``RandomFlip``), so that the features computed with the same image shape
+    and flip direction are loaded into ``results['wavelet_feats']``.
+
+    Args:
+        store_dir (str): Directory of the feature store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.reader = FeatureStoreReader(store_dir)
+        img_shape = self.reader.meta.get('img_shape', None)
+        self.img_shape = None if img_shape is None else tuple(img_shape)
+
+    def __call__(self, results):
+        if self.img_shape is not None and \
+                tuple(results['img_shape']) != self.img_shape:
+            raise ValueError(
+                f'wavelet features in {self.store_dir} are computed at '
+                f'{self.img_shape}, but got image shape '
+                f'{results["img_shape"]}')
+        flip_direction = results.get('flip_direction', None) \
+            if results.get('flip', False) else None
+        results['wavelet_feats'] = self.reader.get(results['img_path'],
+                                                   flip_direction)
+        return results
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(store_dir={self.store_dir})'
+
+
 @TRANSFORMS.register_module()
 class LoadAnnotations:
     """Load multiple types of annotations."""
@@ -3,8 +3,8 @@ from collections.abc import Sequence
 import numpy as np
 
 from jittordet.engine import TRANSFORMS
-from jittordet.utils import (_scale_size, imflip, imrescale, imresize,
-                             is_list_of, is_seq_of, is_tuple_of)
+from jittordet.utils import (_scale_size, imflip, imresize, is_list_of,
+                             is_seq_of, is_tuple_of, rescale_size)
 
 
 @TRANSFORMS.register_module()
@@ -44,30 +44,37 @@ class Resize:
                 f'expect scale_factor is float or Tuple(float), but'
                 f'get {type(scale_factor)}')
 
+    @staticmethod
+    def _get_ref_shape(results):
+        """Shape that ``scale`` and ``scale_factor`` are computed against.
+
+        Images decoded at a reduced resolution by the loader are resized as
+        if they had been decoded at the full resolution.
+        """
+        if 'decode_scale_factor' in results:
+            return results['ori_shape']
+        return results['img'].shape[:2]
+
     def _resize_img(self, results: dict) -> None:
         """Resize images with ``results['scale']``."""
 
         if results.get('img', None) is not None:
+            h, w = self._get_ref_shape(results)
             if self.keep_ratio:
-                img, scale_factor = imrescale(
-                    results['img'],
-                    results['scale'],
-                    interpolation=self.interpolation,
-                    return_scale=True,
-                    backend=self.backend)
-                # the w_scale and h_scale has minor difference
-                # a real fix should be done in the mmcv.imrescale in the future
-                new_h, new_w = img.shape[:2]
-                h, w = results['img'].shape[:2]
-                w_scale = new_w / w
-                h_scale = new_h / h
+                new_size = rescale_size((w, h), results['scale'])
             else:
-                img, w_scale, h_scale = imresize(
-                    results['img'],
-                    results['scale'],
-                    interpolation=self.interpolation,
-                    return_scale=True,
-                    backend=self.backend)
+                new_size = results['scale']
+            img = imresize(
+                results['img'],
+                new_size,
+                interpolation=self.interpolation,
+                backend=self.backend)
+            # the w_scale and h_scale has minor difference
+            # a real fix should be done in the mmcv.imrescale in the future
+            new_h, new_w = img.shape[:2]
+            w_scale = new_w / w
+            h_scale = new_h / h
+            results.pop('decode_scale_factor', None)
             results['img'] = img
             results['img_shape'] = img.shape[:2]
             results['scale_factor'] = (w_scale, h_scale)
@@ -89,7 +96,7 @@ class Resize:
         if self.scale:
             results['scale'] = self.scale
         else:
-            img_shape = results['img'].shape[:2]
+            img_shape = self._get_ref_shape(results)
             results['scale'] = _scale_size(img_shape[::-1], self.scale_factor)
         self._resize_img(results)
         self._resize_bboxes(results)
@@ -210,6 +217,29 @@ class RandomChoiceResize:
         return repr_str
 
 
+def _get_max_resize_scale(transform):
+    """Get the largest ``(scale, keep_ratio)`` a resize transform can use."""
+    if isinstance(transform, Resize):
+        if transform.scale is None:
+            return None
+        return tuple(transform.scale), transform.keep_ratio
+    if isinstance(transform, RandomResize):
+        scale = transform.scale
+        if is_tuple_of(scale, int) and transform.ratio_range is not None:
+            max_ratio = max(transform.ratio_range)
+            scale = (int(scale[0] * max_ratio), int(scale[1] * max_ratio))
+        elif is_seq_of(scale, tuple):
+            scale = tuple(max(s[i] for s in scale) for i in range(2))
+        else:
+            return None
+        return scale, transform.resize.keep_ratio
+    if isinstance(transform, RandomChoiceResize):
+        scales = transform.scales
+        scale = tuple(max(s[i] for s in scales) for i in range(2))
+        return scale, transform.resize.keep_ratio
+    return None
+
+
 @TRANSFORMS.register_module()
 class RandomFlip:
     """Flip the image & bbox."""
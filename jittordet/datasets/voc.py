@@ -1,15 +1,77 @@
 # modified from mmdetection.datasets.xml_style
+import os
 import os.path as osp
 import xml.etree.ElementTree as ET
+from functools import partial
+from multiprocessing import Pool
 
+import numpy as np
 from PIL import Image
 
 from ..engine import DATASETS
 from .base import BaseDetDataset
+from .data_list import ColumnarDataList, file_stat, get_cache_path
+
+
+def parse_voc_xml(img_info, classes):
+    """Parse the xml annotation of one image into a data info."""
+    cat2label = {cat: i for i, cat in enumerate(classes)}
+    data_info = {}
+    data_info['img_id'] = img_info['img_id']
+    data_info['img_path'] = img_info['img_path']
+    data_info['xml_path'] = img_info['xml_path']
+
+    # deal with xml file
+    raw_ann_info = ET.parse(data_info['xml_path'])
+    root = raw_ann_info.getroot()
+    size = root.find('size')
+    if size is not None:
+        width = int(size.find('width').text)
+        height = int(size.find('height').text)
+    else:
+        img = Image.open(img_info['img_path'])
+        height, width = img.height, img.width
+        del img
+
+    data_info['height'] = height
+    data_info['width'] = width
+
+    instances = []
+    for obj in raw_ann_info.findall('object'):
+        instance = {}
+        name = obj.find('name').text
+        if name not in classes:
+            continue
+        difficult = obj.find('difficult')
+        difficult = 0 if difficult is None else int(difficult.text)
+        bnd_box = obj.find('bndbox')
+        bbox = [
+            int(float(bnd_box.find('xmin').text)) - 1,
+            int(float(bnd_box.find('ymin').text)) - 1,
+            int(float(bnd_box.find('xmax').text)) - 1,
+            int(float(bnd_box.find('ymax').text)) - 1
+        ]
+        instance['ignore_flag'] = difficult
+        instance['bbox'] = bbox
+        instance['bbox_label'] = cat2label[name]
+        instances.append(instance)
+    data_info['instances'] = instances
+    return data_info
 
 
 @DATASETS.register_module()
 class VocDataset(BaseDetDataset):
+    """Dataset for PASCAL VOC.
+
+    Args:
+        num_parse_workers (int): Number of processes used to parse the xml
+            annotations. Parse serially if it is not larger than 1.
+            Defaults to 0.
+        cache_dir (str, optional): If set, the parsed data list is cached in
+            this directory as memory-mapped columnar arrays. The cache is
+            invalidated once the image-set file or any xml file is modified.
+            Defaults to None.
+    """
 
     METAINFO = {
         'classes':
@@ -25,6 +87,11 @@ class VocDataset(BaseDetDataset):
                     (183, 130, 88)]
     }
 
+    def __init__(self, *args, num_parse_workers=0, cache_dir=None, **kwargs):
+        self.num_parse_workers = num_parse_workers
+        self.cache_dir = cache_dir
+        super().__init__(*args, **kwargs)
+
     def load_data_list(self):
         assert self.metainfo.get('classes', None) is not None, \
             'CLASSES in `VocDataset` can not be None.'
@@ -33,7 +100,7 @@ class VocDataset(BaseDetDataset):
             for i, cat in enumerate(self.metainfo['classes'])
         }
 
-        data_list = []
+        img_infos = []
         for img_id in open(self.ann_file, 'r'):
             img_id = img_id.strip()
             img_path = osp.join(self.img_path, f'{img_id}.jpg')
@@ -43,53 +110,42 @@ class VocDataset(BaseDetDataset):
             raw_img_info['img_id'] = img_id
             raw_img_info['img_path'] = img_path
             raw_img_info['xml_path'] = xml_path
+            img_infos.append(raw_img_info)
+
+        cache_path = None
+        if self.cache_dir is not None:
+            xml_mtimes = [
+                os.stat(info['xml_path']).st_mtime for info in img_infos
+            ]
+            cache_path = get_cache_path(
+                self.cache_dir,
+                self.__class__.__name__,
+                ann_file=file_stat(self.ann_file),
+                img_path=self.img_path,
+                xml_path=self.xml_path,
+                xml_mtimes=xml_mtimes,
+                classes=self.metainfo['classes'])
+            if osp.isdir(cache_path):
+                return ColumnarDataList.load(cache_path)
+
+        if self.num_parse_workers > 1:
+            with Pool(self.num_parse_workers) as pool:
+                data_list = pool.map(
+                    partial(parse_voc_xml, classes=self.metainfo['classes']),
+                    img_infos,
+                    chunksize=64)
+        else:
+            data_list = [
+                self.parse_data_info(img_info) for img_info in img_infos
+            ]
 
-            parsed_data_info = self.parse_data_info(raw_img_info)
-            data_list.append(parsed_data_info)
+        if cache_path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            ColumnarDataList.from_data_infos(data_list).dump(cache_path)
         return data_list
 
     def parse_data_info(self, img_info):
-        data_info = {}
-        data_info['img_id'] = img_info['img_id']
-        data_info['img_path'] = img_info['img_path']
-        data_info['xml_path'] = img_info['xml_path']
-
-        # deal with xml file
-        raw_ann_info = ET.parse(data_info['xml_path'])
-        root = raw_ann_info.getroot()
-        size = root.find('size')
-        if size is not None:
-            width = int(size.find('width').text)
-            height = int(size.find('height').text)
-        else:
-            img = Image.open(img_info['img_path'])
-            height, width = img.height, img.width
-            del img
-
-        data_info['height'] = height
-        data_info['width'] = width
-
-        instances = []
-        for obj in raw_ann_info.findall('object'):
-            instance = {}
-            name = obj.find('name').text
-            if name not in self._metainfo['classes']:
-                continue
-            difficult = obj.find('difficult')
-            difficult = 0 if difficult is None else int(difficult.text)
-            bnd_box = obj.find('bndbox')
-            bbox = [
-                int(float(bnd_box.find('xmin').text)) - 1,
-                int(float(bnd_box.find('ymin').text)) - 1,
-                int(float(bnd_box.find('xmax').text)) - 1,
-                int(float(bnd_box.find('ymax').text)) - 1
-            ]
-            instance['ignore_flag'] = difficult
-            instance['bbox'] = bbox
-            instance['bbox_label'] = self.cat2label[name]
-            instances.append(instance)
-        data_info['instances'] = instances
-        return data_info
+        return parse_voc_xml(img_info, self.metainfo['classes'])
 
     def filter_data(self):
         if self.test_mode:
@@ -100,6 +156,9 @@ class VocDataset(BaseDetDataset):
         min_size = self.filter_cfg.get('min_size', 0) \
             if self.filter_cfg is not None else 0
 
+        if isinstance(self.data_list, ColumnarDataList):
+            return self._filter_columnar(filter_empty_gt, min_size)
+
         valid_data_infos = []
         for i, data_info in enumerate(self.data_list):
             width = data_info['width']
@@ -110,3 +169,17 @@ class VocDataset(BaseDetDataset):
                 valid_data_infos.append(data_info)
 
         return valid_data_infos
+
+    def _filter_columnar(self, filter_empty_gt, min_size):
+        """Filter a cached data list on its columns without decoding it."""
+        data_list = self.data_list
+        if len(data_list) == 0:
+            return data_list
+        img_columns = data_list.img_columns
+        valid = np.minimum(img_columns['width'],
+                           img_columns['height']) >= min_size
+        if filter_empty_gt:
+            valid &= np.diff(data_list.inst_offsets) > 0
+        if valid.all():
+            return data_list
+        return data_list.subset(np.flatnonzero(valid))
@@ -1,3 +1,5 @@
+from itertools import chain
+
 from ..engine import BATCH_SAMPLERS, DATASETS
 from ..utils import is_list_of
 from .base import BaseDetDataset
@@ -32,13 +34,16 @@ class ConcatDataset(BaseDetDataset):
                  test_mode=False,
                  batch_sampler=None,
                  max_refetch=100,
+                 serialize_data=True,
+                 pack_inputs=True,
                  **kwargs):
         super(BaseDetDataset, self).__init__(
             batch_size=batch_size, num_workers=num_workers, **kwargs)
+        self.pack_inputs = pack_inputs
 
         # override some setting in sub dataset
         assert is_list_of(datasets, dict)
-        self.data_list, self.lengths = [], []
+        data_lists, self.lengths = [], []
         transforms = []
         for dataset in datasets:
             dataset['batch_size'] = 1
@@ -46,11 +51,16 @@ class ConcatDataset(BaseDetDataset):
             dataset['metainfo'] = metainfo
             dataset['test_mode'] = test_mode
             dataset['batch_sampler'] = None
+            dataset['serialize_data'] = False
             dataset = DATASETS.build(dataset)
-            self.data_list.extend(dataset.data_list)
+            data_lists.append(dataset.data_list)
             self.lengths.append(len(dataset.data_list))
             transforms.append(dataset.transforms)
 
+        self.data_list = list(chain(*data_lists))
+        if serialize_data:
+            self.data_list = self.serialize_data_list(self.data_list)
+
         self.transforms = PartCompose(transforms, self.lengths)
 
         self.test_mode = test_mode
@@ -64,3 +74,4 @@ class ConcatDataset(BaseDetDataset):
                 batch_sampler, dataset=self)
         else:
             self.batch_sampler = None
+        self._reset_sampler_state()
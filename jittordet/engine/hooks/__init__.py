@@ -1,5 +1,6 @@
 from .base_hook import BaseHook
 from .checkpoint_hook import CheckpointHook
+from .compile_stats_hook import CompileStatsHook
 from .logger_hook import LoggerHook
 
-__all__ = ['BaseHook', 'CheckpointHook', 'LoggerHook']
+__all__ = ['BaseHook', 'CheckpointHook', 'LoggerHook', 'CompileStatsHook']
@@ -46,5 +46,5 @@ class CheckpointHook(BaseHook):
         if save_ckpt:
             ckpt_filepath = osp.join(runner.log_dir,
                                      f'iter_{cur_iter + 1}.pkl')
-            runner.save_checkpoint(ckpt_filepath)
+            runner.save_checkpoint(ckpt_filepath, end_epoch=False)
             runner.logger.info(f'save checkpoint to {ckpt_filepath}')
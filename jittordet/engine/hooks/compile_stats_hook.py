@@ -0,0 +1,56 @@
+import os
+import os.path as osp
+
+import jittor as jt
+
+from ..register import HOOKS
+from .base_hook import BaseHook
+
+
+def count_compiled_kernels():
+    """Count the kernels in the jit cache of Jittor."""
+    jit_dir = osp.join(jt.flags.cache_path, 'jit')
+    if not osp.isdir(jit_dir):
+        return 0
+    return sum(1 for name in os.listdir(jit_dir) if name.endswith('.so'))
+
+
+@HOOKS.register_module()
+class CompileStatsHook(BaseHook):
+    """Log the statistics about Jittor kernel compilation during training.
+
+    It logs the number of distinct batch shapes and their hit rate counted
+    by the preprocessor of the model (see ``batch_shape_buckets`` of
+    :class:`Preprocessor`), and the number of kernels newly compiled into
+    the jit cache since the training starts.
+
+    Args:
+        interval (int): Logging interval of iterations. Defaults to 50.
+    """
+
+    def __init__(self, interval=50):
+        self.interval = interval
+        self._num_kernels = 0
+
+    def before_train(self, runner):
+        self._num_kernels = count_compiled_kernels()
+
+    def after_train_iter(self,
+                         runner,
+                         batch_idx,
+                         data_batch=None,
+                         outputs=None):
+        if not self.every_n_interval(batch_idx, self.interval):
+            return
+        log_str_list = []
+        preprocessor = getattr(runner.model, 'preprocessor', None)
+        if hasattr(preprocessor, 'get_shape_stats'):
+            stats = preprocessor.get_shape_stats()
+            log_str_list.extend([
+                f'batch shapes: {stats["num_shapes"]}',
+                f'shape hit rate: {stats["hit_rate"]:.2%}',
+                f'bucket overflows: {stats["num_overflows"]}'
+            ])
+        num_kernels = count_compiled_kernels() - self._num_kernels
+        log_str_list.append(f'compiled kernels: {num_kernels}')
+        runner.logger.info('(compile) ' + '  '.join(log_str_list))
@@ -74,24 +74,31 @@ class LoggerHook(BaseHook):
 
         # epoch iteration number information
         log_str = '(train) '
-        cur_epoch = runner.train_loop.cur_epoch
-        max_epoch = runner.train_loop.max_epoch
-        iter_per_epoch = len(runner.train_dataset)
-        # get the max length of iteration and epoch number
-        epoch_len = len(str(max_epoch))
-        iter_len = len(str(iter_per_epoch))
-        # right just the length
-        cur_epoch = str(cur_epoch + 1).rjust(epoch_len)
-        cur_iter = str(batch_idx + 1).rjust(iter_len)
-        log_str += f'[{cur_epoch}/{max_epoch}]'
-        log_str += f'[{cur_iter}/{iter_per_epoch}]'
+        if hasattr(runner.train_loop, 'max_iters'):
+            # iteration-based training loop
+            total_iter = runner.train_loop.max_iters
+            iter_len = len(str(total_iter))
+            cur_iter = str(batch_idx + 1).rjust(iter_len)
+            log_str += f'[{cur_iter}/{total_iter}]'
+        else:
+            cur_epoch = runner.train_loop.cur_epoch
+            max_epoch = runner.train_loop.max_epoch
+            iter_per_epoch = len(runner.train_dataset)
+            total_iter = iter_per_epoch * max_epoch
+            # get the max length of iteration and epoch number
+            epoch_len = len(str(max_epoch))
+            iter_len = len(str(iter_per_epoch))
+            # right just the length
+            cur_epoch = str(cur_epoch + 1).rjust(epoch_len)
+            cur_iter = str(batch_idx + 1).rjust(iter_len)
+            log_str += f'[{cur_epoch}/{max_epoch}]'
+            log_str += f'[{cur_iter}/{iter_per_epoch}]'
         log_str_list.append(log_str)
 
         # iter time and etc time
         iter_time = self.get_log_hitory(
             'train', 'time', 1000, reduction='mean')
         past_iter = runner.train_loop.cur_iter
-        total_iter = len(runner.train_dataset) * max_epoch
         eta_time = iter_time * (total_iter - past_iter)
         eta_time = datetime.timedelta(seconds=int(eta_time))
         mm, ss = divmod(eta_time.seconds, 60)
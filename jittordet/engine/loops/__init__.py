@@ -1,6 +1,8 @@
 from .base_loop import BaseLoop
 from .test_loop import TestLoop
-from .train_loop import EpochTrainLoop
+from .train_loop import EpochTrainLoop, IterTrainLoop
 from .val_loop import ValLoop
 
-__all__ = ['BaseLoop', 'EpochTrainLoop', 'ValLoop', 'TestLoop']
+__all__ = [
+    'BaseLoop', 'EpochTrainLoop', 'IterTrainLoop', 'ValLoop', 'TestLoop'
+]
@@ -27,8 +27,13 @@ class EpochTrainLoop(BaseLoop):
         self.runner.call_hook('before_train_epoch')
 
         self.runner.model.train()
-        for idx, data_batch in enumerate(self.runner.train_dataset):
-            self.run_iter(idx, data_batch)
+        # not zero if resumed from the middle of an epoch, and the epoch only
+        # needs to be finished if resumed from its last iteration
+        start_idx = self._iter - self._epoch * len(self.runner.train_dataset)
+        if start_idx < len(self.runner.train_dataset):
+            for idx, data_batch in enumerate(self.runner.train_dataset,
+                                             start_idx):
+                self.run_iter(idx, data_batch)
 
         for _scheduler in self.runner.scheduler:
             if not getattr(_scheduler, 'by_iter', False):
@@ -55,3 +60,75 @@ class EpochTrainLoop(BaseLoop):
             data_batch=data_batch,
             outputs=loss_vars)
         self._iter += 1
+
+
+@LOOPS.register_module()
+class IterTrainLoop(BaseLoop):
+    """Iteration-based training loop.
+
+    The training dataset is consumed as an infinite stream, so the data
+    loader workers keep loading batches across epochs rather than waiting
+    for a new ``__iter__`` at every epoch boundary. All schedulers are
+    stepped by iteration, and validation runs every ``val_interval``
+    iterations. Use ``CheckpointHook`` with ``by_iter=True`` to save
+    checkpoints by iteration.
+
+    Args:
+        runner (Runner): The runner.
+        max_iters (int): Total training iterations.
+        val_interval (int): Validation interval of iterations.
+            Defaults to 1000.
+    """
+
+    def __init__(self, runner, max_iters, val_interval=1000):
+        super().__init__(runner=runner)
+        self.val_interval = val_interval
+        self._max_iters = max_iters
+
+    @property
+    def max_iters(self):
+        return self._max_iters
+
+    def data_stream(self):
+        """Yield training batches endlessly."""
+        dataset = self.runner.train_dataset
+        if dataset.num_workers > 0:
+            # workers fetch the index list of the next epoch by themselves
+            dataset.endless = True
+            yield from dataset
+        else:
+            while True:
+                yield from dataset
+
+    def run(self):
+        self.runner.call_hook('before_train')
+
+        self.runner.model.train()
+        data_stream = self.data_stream()
+        while self._iter < self._max_iters:
+            self.run_iter(self._iter, next(data_stream))
+
+            if self._iter % self.val_interval == 0 or \
+                    self._iter == self._max_iters:
+                if self.runner.val_loop is not None:
+                    self.runner.val_loop.run()
+                    self.runner.model.train()
+
+        self.runner.call_hook('after_train')
+
+    def run_iter(self, idx, data_batch):
+        """Iterate one min-batch."""
+        self.runner.call_hook(
+            'before_train_iter', batch_idx=idx, data_batch=data_batch)
+
+        loss, loss_vars = self.runner.model(data_batch, phase='loss')
+        self.runner.optimizer.step(loss)
+        for _scheduler in self.runner.scheduler:
+            _scheduler.step()
+
+        self.runner.call_hook(
+            'after_train_iter',
+            batch_idx=idx,
+            data_batch=data_batch,
+            outputs=loss_vars)
+        self._iter += 1
@@ -11,14 +11,18 @@ import numpy as np
 from jittor.dataset import Dataset
 from jittor.optim import Optimizer
 
+from jittordet.structures import DetDataSample, InstanceData
 from .config import dump_cfg
 from .evaluator import BaseEvaluator
 from .hooks import BaseHook
+from .hooks.compile_stats_hook import count_compiled_kernels
 from .logger import get_logger
 from .loops import BaseLoop
 from .register import (DATASETS, EVALUATORS, HOOKS, LOOPS, MODELS, OPTIMIZERS,
                        SCHEDULERS)
 
+PHASE_MODES = dict(train='loss', val='predict', test='predict')
+
 __all__ = ['Runner']
 
 
@@ -43,6 +47,7 @@ class Runner:
                  resume_from=None,
                  load_from=None,
                  experiment_name=None,
+                 warmup=None,
                  cfg=None):
         # setup work dir
         self._work_dir = osp.abspath(work_dir)
@@ -78,6 +83,7 @@ class Runner:
         self.disable_cuda = disable_cuda
         self._load_from = load_from
         self._resume_from = resume_from
+        self._warmup = warmup
         self.logger = None
 
         # build model
@@ -121,6 +127,7 @@ class Runner:
             resume_from=cfg.get('resume_from'),
             load_from=cfg.get('load_from'),
             experiment_name=cfg.get('experiment_name'),
+            warmup=cfg.get('warmup'),
             cfg=cfg)
         return runner
 
@@ -244,6 +251,10 @@ class Runner:
             self.init_model_weights()
         if not self.disable_cuda:
             jt.flags.use_cuda = 1
+        if self._warmup is not None:
+            self.warmup_kernels('train')
+            if self.val_loop is not None:
+                self.warmup_kernels('val')
 
         # start run
         self.train_loop.run()
@@ -264,6 +275,8 @@ class Runner:
             raise RuntimeError('Model has not been load in val')
         if not self.disable_cuda:
             jt.flags.use_cuda = 1
+        if self._warmup is not None:
+            self.warmup_kernels('val')
 
         # start run
         self.val_loop.run()
@@ -284,10 +297,133 @@ class Runner:
             raise RuntimeError('Model has not been load in test')
         if not self.disable_cuda:
             jt.flags.use_cuda = 1
+        if self._warmup is not None:
+            self.warmup_kernels('test')
 
         # start run
         self.test_loop.run()
 
+    def warmup(self, phases=('train', 'test')):
+        """Only compile the kernels of phases without running loops, which is
+        used by ``tools/warmup.py``."""
+        assert all([phase in PHASE_MODES for phase in phases])
+        self.setup_logger_dir(phases[0])
+        if self._warmup is None:
+            self._warmup = dict()
+        self.load_or_resume()
+        if not self.disable_cuda:
+            jt.flags.use_cuda = 1
+        for phase in phases:
+            dataset = getattr(self, f'{phase}_dataset')
+            assert dataset is not None, f'"{phase}_dataset" should be set'
+            setattr(self, f'{phase}_dataset', self.build_dataset(dataset))
+            self.warmup_kernels(phase)
+
+    def warmup_kernels(self, phase):
+        """Compile the kernels of a phase on synthetic batches.
+
+        Jittor compiles kernels when an op graph runs at the first time,
+        which stalls the first iterations of the loops. It runs the forward
+        (and the backward for training) of the model on a random batch of
+        each shape in ``warmup.shapes`` and each ``warmup.batch_size``, so
+        that the loop starts with a hot kernel cache. The parameters and
+        buffers of the model and the global random states are restored
+        afterwards, so a seeded run reads the same data with or without the
+        warm-up. Jittor only exposes its seed, so its generators are seeded
+        again with it.
+
+        The ``warmup`` config accepts:
+
+        - shapes (list[tuple[int]]): (h, w) of batches. Defaults to
+          ``batch_shape_buckets`` of the preprocessor.
+        - batch_size (int | list[int]): Defaults to the batch size of the
+          dataset of the phase.
+        - num_channels (int): Channels of images. Defaults to 3.
+        - num_gts (int): Ground truth boxes per image. Defaults to 3.
+        """
+        mode = PHASE_MODES[phase]
+        dataset = getattr(self, f'{phase}_dataset')
+        cfg = self._warmup
+        shapes = cfg.get('shapes')
+        if shapes is None:
+            shapes = getattr(self.model.preprocessor, 'batch_shape_buckets',
+                             None)
+        assert shapes is not None, \
+            '"shapes" should be set in the warmup config if the ' \
+            'preprocessor has no "batch_shape_buckets".'
+        batch_sizes = cfg.get('batch_size')
+        if batch_sizes is None:
+            batch_sizes = dataset.batch_size // jt.world_size \
+                if jt.in_mpi else dataset.batch_size
+        if isinstance(batch_sizes, int):
+            batch_sizes = [batch_sizes]
+
+        state_dict = self.model.state_dict(to='numpy')
+        random_states = (random.getstate(), np.random.get_state(),
+                         jt.get_seed())
+        rng = np.random.default_rng(0)
+        if mode == 'loss':
+            self.model.train()
+        else:
+            self.model.eval()
+        params = [p for p in self.model.parameters() if not p.is_stop_grad()]
+        start_time, num_kernels = time.time(), count_compiled_kernels()
+        for h, w in shapes:
+            for batch_size in batch_sizes:
+                data = self.build_warmup_batch(dataset, (int(h), int(w)),
+                                               batch_size, rng)
+                if mode == 'loss':
+                    loss, _ = self.model(data, phase='loss')
+                    jt.sync(jt.grad(loss, params))
+                else:
+                    with jt.no_grad():
+                        self.model(data, phase='predict')
+                jt.sync_all(True)
+        self.model.load_state_dict(state_dict)
+        random.setstate(random_states[0])
+        np.random.set_state(random_states[1])
+        jt.set_seed(random_states[2])
+        if hasattr(self.model.preprocessor, 'reset_shape_stats'):
+            self.model.preprocessor.reset_shape_stats()
+        jt.gc()
+
+        self.logger.info(
+            f'Warm up {len(shapes) * len(batch_sizes)} batch shapes of '
+            f'{phase} in {time.time() - start_time:.1f}s, '
+            f'{count_compiled_kernels() - num_kernels} kernels are compiled '
+            f'into {jt.flags.cache_path}')
+
+    def build_warmup_batch(self, dataset, shape, batch_size, rng):
+        """Build a random batch in the format of ``PackDetInputs`` and
+        ``collate_batch`` of the dataset, drawn from the local ``rng``."""
+        num_channels = self._warmup.get('num_channels', 3)
+        num_gts = self._warmup.get('num_gts', 3)
+        h, w = shape
+        samples = []
+        for i in range(batch_size):
+            img = rng.integers(0, 256, (num_channels, h, w), dtype=np.uint8)
+            xy = rng.random((num_gts, 2)) * (w / 2, h / 2)
+            wh = rng.random((num_gts, 2)) * (w / 2, h / 2) + 1
+            gt_instances = InstanceData(
+                bboxes=np.concatenate([xy, xy + wh], 1).astype(np.float32),
+                labels=np.zeros(num_gts, dtype=np.int64))
+            data_sample = DetDataSample(
+                metainfo=dict(
+                    sample_idx=i,
+                    img_id=i,
+                    img_path='',
+                    ori_shape=(h, w),
+                    img_shape=(h, w),
+                    scale_factor=(1., 1.),
+                    flip=False,
+                    flip_direction=None))
+            data_sample.gt_instances = gt_instances
+            data_sample.ignored_instances = InstanceData(
+                bboxes=np.zeros((0, 4), dtype=np.float32),
+                labels=np.zeros(0, dtype=np.int64))
+            samples.append(dict(inputs=img, data_samples=data_sample))
+        return dataset.to_jittor(dataset.collate_batch(samples))
+
     def setup_logger_dir(self, phase):
         assert phase in ['train', 'val', 'test']
         log_dir = osp.join(self.work_dir, self.time_stamp + '_' + phase)
@@ -331,6 +467,11 @@ class Runner:
         if self.train_loop is not None and 'loop' in data:
             self.train_loop.load_state_dict(data['loop'])
 
+        # load sampler info to continue from the next batch
+        if hasattr(self.train_dataset, 'load_sampler_state_dict') and \
+                'sampler' in data:
+            self.train_dataset.load_sampler_state_dict(data['sampler'])
+
         # load optimizer info
         if self.optimizer is not None and 'optimizer' in data:
             self.optimizer.load_state_dict(data['optimizer'])
@@ -360,8 +501,15 @@ class Runner:
         loop_state_dict = self.train_loop.state_dict()
         if end_epoch:
             loop_state_dict['epoch'] += 1
+        else:
+            # saved by iteration hooks before the iteration counter increases
+            loop_state_dict['iter'] += 1
         data['loop'] = loop_state_dict
 
+        # sampler info
+        if hasattr(self.train_dataset, 'sampler_state_dict'):
+            data['sampler'] = self.train_dataset.sampler_state_dict()
+
         # optimizer info
         data['optimizer'] = self.optimizer.state_dict()
 
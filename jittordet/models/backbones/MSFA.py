@@ -8,14 +8,31 @@
 import jittor as jt
 from jittor import nn
 from jittordet.engine import MODELS
-from kymatio.torch import Scattering2D
+from ..layers import Scattering2D
 
 @MODELS.register_module()
 class MSFA(nn.Module):
-    def __init__(self, backbone, use_sar=True, use_wavelet=False, input_size=(800,800)):
+    """Multi-source feature fusion of the SAR image and its wavelet
+    scattering features.
+
+    The scattering features are computed online from the (normalized)
+    inputs, or consumed directly when they are precomputed by
+    ``tools/build_wavelet_features.py`` and loaded with
+    ``LoadWaveletFeatures``. In that case the inputs are a tuple of
+    ``(batch_inputs, wavelet_feats)``.
+
+    Args:
+        online_wavelet (bool): Whether to build the scattering transform to
+            compute the wavelet features which are not precomputed. Set it
+            to False to skip building the filter bank when all splits are
+            precomputed. Defaults to True.
+    """
+
+    def __init__(self, backbone, use_sar=True, use_wavelet=False, input_size=(800,800), online_wavelet=True):
         self.use_sar = use_sar
         self.use_wavelet = use_wavelet
         self.input_size=input_size
+        self.online_wavelet = online_wavelet
         if use_sar and not use_wavelet :
             self.in_channels = 3 
         elif use_sar and use_wavelet:
@@ -24,19 +41,32 @@ class MSFA(nn.Module):
             self.in_channels = 0
         if use_wavelet:
             self.in_channels += 81
-            self.wavelet_trans = Scattering2D(J=2, shape=self.input_size)
+            if online_wavelet:
+                self.wavelet_trans = Scattering2D(J=2, shape=self.input_size)
         backbone['in_channels'] = self.in_channels
         self.backbone = MODELS.build(backbone)
     def execute(self, x):
         xs = []
+        wavelet_feats = None
+        if isinstance(x, (tuple, list)):
+            x, wavelet_feats = x
         if self.use_sar and not self.use_wavelet:
+            if x.shape[1] == 1:
+                # broadcast grayscale inputs to the 3 input channels
+                x = x.repeat(1, 3, 1, 1)
             return self.backbone(x)
-        x_ = x.mean(1,keepdim=True)
+        # grayscale inputs (e.g. LoadImageFromFile with color_type
+        # 'grayscale') are already single-channel
+        x_ = x if x.shape[1] == 1 else x.mean(1,keepdim=True)
         with jt.no_grad():
             if self.use_sar and self.use_wavelet:
                 xs.append(x_)
             if self.use_wavelet:
-                out = nn.functional.interpolate(self.wavelet_trans(x_).squeeze(1), self.input_size, mode='bilinear')
+                if wavelet_feats is None:
+                    assert self.online_wavelet, \
+                        'wavelet features are neither precomputed nor online'
+                    wavelet_feats = self.wavelet_trans(x_).squeeze(1)
+                out = nn.interpolate(wavelet_feats.float32(), self.input_size, mode='bilinear')
                 xs.append(out)
             x = jt.cat(xs,1)
         x = self.backbone(x)
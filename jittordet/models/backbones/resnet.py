@@ -149,7 +149,8 @@ class ResNet(nn.Module):
                  width_per_group=64,
                  replace_stride_with_dilation=None,
                  pretrained=None,
-                 norm_layer=None):
+                 norm_layer=None,
+                 in_channels=3):
         super(ResNet, self).__init__()
         if (norm_layer is None):
             norm_layer = nn.BatchNorm
@@ -167,7 +168,12 @@ class ResNet(nn.Module):
         self.groups = groups
         self.base_width = width_per_group
         self.conv1 = nn.Conv(
-            3, self.inplanes, kernel_size=7, stride=2, padding=3, bias=False)
+            in_channels,
+            self.inplanes,
+            kernel_size=7,
+            stride=2,
+            padding=3,
+            bias=False)
         jt.init.relu_invariant_gauss_(self.conv1.weight, mode='fan_out')
         self.bn1 = norm_layer(self.inplanes)
         self.relu = nn.Relu()
@@ -8,7 +8,9 @@ import jittor as jt
 import jittor.nn as nn
 
 from jittordet.engine import ConfigDict
-from jittordet.models.utils import (batched_nms, filter_scores_and_topk,
+from jittordet.models.utils import (filter_mlvl_scores_and_topk,
+                                    filter_scores_and_topk,
+                                    multi_image_batched_nms,
                                     select_single_mlvl, unpack_gt_instances)
 from jittordet.structures import InstanceData, InstanceList, SampleList
 
@@ -215,10 +217,10 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
         mlvl_priors = self.prior_generator.grid_priors(
             featmap_sizes, dtype=cls_scores[0].dtype)
 
-        result_list = []
-
+        cfg = self.test_cfg if cfg is None else cfg
+        batch_mlvl_scores = []
+        batch_mlvl_results = []
         for img_id in range(len(batch_img_metas)):
-            img_meta = batch_img_metas[img_id]
             cls_score_list = select_single_mlvl(
                 cls_scores, img_id, detach=True)
             bbox_pred_list = select_single_mlvl(
@@ -229,16 +231,31 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
             else:
                 score_factor_list = [None for _ in range(num_levels)]
 
-            results = self._predict_by_feat_single(
+            mlvl_scores, mlvl_results = self._get_mlvl_scores_single(
                 cls_score_list=cls_score_list,
                 bbox_pred_list=bbox_pred_list,
                 score_factor_list=score_factor_list,
-                mlvl_priors=mlvl_priors,
+                mlvl_priors=mlvl_priors)
+            batch_mlvl_scores.append(mlvl_scores)
+            batch_mlvl_results.append(mlvl_results)
+
+        # the candidates of all levels of all images are selected at once
+        batch_mlvl_filtered = self._filter_batch_mlvl_scores(
+            batch_mlvl_scores, batch_mlvl_results, cfg)
+
+        result_list = []
+        for mlvl_filtered, img_meta in zip(batch_mlvl_filtered,
+                                           batch_img_metas):
+            results = self._decode_filtered_single(
+                mlvl_filtered=mlvl_filtered,
                 img_meta=img_meta,
                 cfg=cfg,
                 rescale=rescale,
-                with_nms=with_nms)
+                # nms of all images is applied at once below
+                with_nms=False)
             result_list.append(results)
+        if with_nms:
+            result_list = self._bbox_nms(result_list, cfg)
         return result_list
 
     def _predict_by_feat_single(self,
@@ -289,36 +306,58 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
                 - bboxes (Tensor): Has a shape (num_instances, 4),
                   the last dimension 4 arrange as (x1, y1, x2, y2).
         """
-        if score_factor_list[0] is None:
-            # e.g. Retina, FreeAnchor, etc.
-            with_score_factors = False
-        else:
-            # e.g. FCOS, PAA, ATSS, etc.
-            with_score_factors = True
-
         cfg = self.test_cfg if cfg is None else cfg
-        cfg = copy.deepcopy(cfg)
-        img_shape = img_meta['img_shape']
-        nms_pre = cfg.get('nms_pre', -1)
+        mlvl_scores, mlvl_results = self._get_mlvl_scores_single(
+            cls_score_list=cls_score_list,
+            bbox_pred_list=bbox_pred_list,
+            score_factor_list=score_factor_list,
+            mlvl_priors=mlvl_priors)
+        mlvl_filtered = self._filter_batch_mlvl_scores([mlvl_scores],
+                                                       [mlvl_results], cfg)[0]
+        return self._decode_filtered_single(
+            mlvl_filtered=mlvl_filtered,
+            img_meta=img_meta,
+            cfg=cfg,
+            rescale=rescale,
+            with_nms=with_nms)
+
+    def _get_mlvl_scores_single(
+            self, cls_score_list: List[jt.Var], bbox_pred_list: List[jt.Var],
+            score_factor_list: List[jt.Var],
+            mlvl_priors: List[jt.Var]) -> Tuple[List[jt.Var], List[dict]]:
+        """Get the scores of all scale levels of a single image, with the
+        results to be filtered together with them.
+
+        Args:
+            cls_score_list (list[Tensor]): Box scores from all scale
+                levels of a single image, each item has shape
+                (num_priors * num_classes, H, W).
+            bbox_pred_list (list[Tensor]): Box energies / deltas from
+                all scale levels of a single image, each item has shape
+                (num_priors * 4, H, W).
+            score_factor_list (list[Tensor]): Score factor from all scale
+                levels of a single image, each item has shape
+                (num_priors * 1, H, W).
+            mlvl_priors (list[Tensor]): Each element in the list is
+                the priors of a single level in feature pyramid.
+
+        Returns:
+            tuple[list]: The scores of each level, each has shape
+            (num_priors, num_classes), and the results of each level, each
+            is a dict of ``bbox_pred``, ``priors`` and optional
+            ``score_factor``.
+        """
+        with_score_factors = score_factor_list[0] is not None
 
-        mlvl_bbox_preds = []
-        mlvl_valid_priors = []
         mlvl_scores = []
-        mlvl_labels = []
-        if with_score_factors:
-            mlvl_score_factors = []
-        else:
-            mlvl_score_factors = None
-        for level_idx, (cls_score, bbox_pred, score_factor, priors) in \
-                enumerate(zip(cls_score_list, bbox_pred_list,
-                              score_factor_list, mlvl_priors)):
+        mlvl_results = []
+        for cls_score, bbox_pred, score_factor, priors in zip(
+                cls_score_list, bbox_pred_list, score_factor_list,
+                mlvl_priors):
 
             assert cls_score.size()[-2:] == bbox_pred.size()[-2:]
 
             bbox_pred = bbox_pred.permute(1, 2, 0).reshape(-1, 4)
-            if with_score_factors:
-                score_factor = score_factor.permute(1, 2,
-                                                    0).reshape(-1).sigmoid()
             cls_score = cls_score.permute(1, 2,
                                           0).reshape(-1, self.cls_out_channels)
             if self.use_sigmoid_cls:
@@ -329,31 +368,98 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
                 # BG cat_id: num_class
                 scores = cls_score.softmax(-1)[:, :-1]
 
-            # After https://github.com/open-mmlab/mmdetection/pull/6268/,
-            # this operation keeps fewer bboxes under the same `nms_pre`.
-            # There is no difference in performance for most models. If you
-            # find a slight drop in performance, you can set a larger
-            # `nms_pre` than before.
-            score_thr = cfg.get('score_thr', 0)
+            level_results = dict(bbox_pred=bbox_pred, priors=priors)
+            if with_score_factors:
+                level_results['score_factor'] = score_factor.permute(
+                    1, 2, 0).reshape(-1).sigmoid()
+            mlvl_scores.append(scores)
+            mlvl_results.append(level_results)
+        return mlvl_scores, mlvl_results
 
-            results = filter_scores_and_topk(
-                scores, score_thr, nms_pre,
-                dict(bbox_pred=bbox_pred, priors=priors))
-            scores, labels, keep_idxs, filtered_results = results
+    def _filter_batch_mlvl_scores(self, batch_mlvl_scores: List[List[jt.Var]],
+                                  batch_mlvl_results: List[List[dict]],
+                                  cfg: ConfigDict) -> List[List[tuple]]:
+        """Filter the scores of all levels of several images by ``score_thr``
+        and keep the ``nms_pre`` top candidates of each level.
 
-            bbox_pred = filtered_results['bbox_pred']
-            priors = filtered_results['priors']
+        The candidates of all levels of all images are selected by a single
+        :func:`filter_mlvl_scores_and_topk`.
 
-            if with_score_factors:
-                score_factor = score_factor[keep_idxs]
+        Args:
+            batch_mlvl_scores (list[list[Tensor]]): The scores of each level
+                of each image, see :meth:`_get_mlvl_scores_single`.
+            batch_mlvl_results (list[list[dict]]): The results of each level
+                of each image to be filtered with the scores.
+            cfg (ConfigDict): Test / postprocessing configuration.
+
+        Returns:
+            list[list[tuple]]: The filtered results of each level of each
+            image, see :func:`filter_scores_and_topk`.
+        """
+        nms_pre = cfg.get('nms_pre', -1)
+        score_thr = cfg.get('score_thr', 0)
+        # After https://github.com/open-mmlab/mmdetection/pull/6268/,
+        # this operation keeps fewer bboxes under the same `nms_pre`.
+        # There is no difference in performance for most models. If you
+        # find a slight drop in performance, you can set a larger
+        # `nms_pre` than before.
+        if nms_pre <= 0:
+            batch_mlvl_filtered = []
+            for mlvl_scores, mlvl_results in zip(batch_mlvl_scores,
+                                                 batch_mlvl_results):
+                batch_mlvl_filtered.append([
+                    filter_scores_and_topk(scores, score_thr, nms_pre, results)
+                    for scores, results in zip(mlvl_scores, mlvl_results)
+                ])
+            return batch_mlvl_filtered
+
+        mlvl_filtered = filter_mlvl_scores_and_topk(
+            sum(batch_mlvl_scores, []), score_thr, nms_pre,
+            sum(batch_mlvl_results, []))
+        batch_mlvl_filtered = []
+        for mlvl_scores in batch_mlvl_scores:
+            batch_mlvl_filtered.append(mlvl_filtered[:len(mlvl_scores)])
+            mlvl_filtered = mlvl_filtered[len(mlvl_scores):]
+        return batch_mlvl_filtered
+
+    def _decode_filtered_single(self,
+                                mlvl_filtered: List[tuple],
+                                img_meta: dict,
+                                cfg: ConfigDict,
+                                rescale: bool = False,
+                                with_nms: bool = True) -> InstanceData:
+        """Decode the filtered candidates of a single image into bbox
+        results.
+
+        Args:
+            mlvl_filtered (list[tuple]): The filtered results of each level,
+                see :meth:`_filter_batch_mlvl_scores`.
+            img_meta (dict): Image meta info.
+            cfg (ConfigDict): Test / postprocessing configuration.
+            rescale (bool): If True, return boxes in original image space.
+                Defaults to False.
+            with_nms (bool): If True, do nms before return boxes.
+                Defaults to True.
+
+        Returns:
+            :obj:`InstanceData`: Detection results of the image after the
+            post process, see :meth:`_predict_by_feat_single`.
+        """
+        cfg = copy.deepcopy(cfg)
+        img_shape = img_meta['img_shape']
 
-            mlvl_bbox_preds.append(bbox_pred)
-            mlvl_valid_priors.append(priors)
+        mlvl_bbox_preds = []
+        mlvl_valid_priors = []
+        mlvl_scores = []
+        mlvl_labels = []
+        mlvl_score_factors = []
+        for scores, labels, _, filtered_results in mlvl_filtered:
+            mlvl_bbox_preds.append(filtered_results['bbox_pred'])
+            mlvl_valid_priors.append(filtered_results['priors'])
             mlvl_scores.append(scores)
             mlvl_labels.append(labels)
-
-            if with_score_factors:
-                mlvl_score_factors.append(score_factor)
+            if 'score_factor' in filtered_results:
+                mlvl_score_factors.append(filtered_results['score_factor'])
 
         bbox_pred = jt.concat(mlvl_bbox_preds)
         priors = jt.concat(mlvl_valid_priors)
@@ -363,7 +469,7 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
         results.bboxes = bboxes
         results.scores = jt.concat(mlvl_scores)
         results.labels = jt.concat(mlvl_labels)
-        if with_score_factors:
+        if mlvl_score_factors:
             results.score_factors = jt.concat(mlvl_score_factors)
 
         return self._bbox_post_process(
@@ -428,13 +534,32 @@ class BaseDenseHead(nn.Module, metaclass=ABCMeta):
                 results = results[valid_mask]
 
         # TODO: deal with `with_nms` and `nms_cfg=None` in test_cfg
-        if with_nms and results.bboxes.numel() > 0:
-            _, det_scores, keep_idxs = batched_nms(results.bboxes,
-                                                   results.scores,
-                                                   results.labels, cfg.nms)
-            results = results[keep_idxs]
-            # some nms would reweight the score, such as softnms
-            results.scores = det_scores
-            results = results[:cfg.max_per_img]
+        if with_nms:
+            results = self._bbox_nms([results], cfg)[0]
 
         return results
+
+    def _bbox_nms(self, result_list: InstanceList,
+                  cfg: ConfigDict) -> InstanceList:
+        """Apply nms to the results of several images in one call.
+
+        Args:
+            result_list (list[:obj:`InstanceData`]): Detection results of
+                each image before nms, which contain ``bboxes``, ``scores``
+                and ``labels``.
+            cfg (ConfigDict): Test / postprocessing configuration.
+
+        Returns:
+            list[:obj:`InstanceData`]: Detection results of each image after
+            nms, at most ``cfg.max_per_img`` ones are kept for each image.
+        """
+        nms_results = multi_image_batched_nms(
+            [results.bboxes for results in result_list],
+            [results.scores for results in result_list],
+            [results.labels for results in result_list], cfg.nms)
+        for i, (_, det_scores, keep_idxs) in enumerate(nms_results):
+            results = result_list[i][keep_idxs]
+            # some nms would reweight the score, such as softnms
+            results.scores = det_scores
+            result_list[i] = results[:cfg.max_per_img]
+        return result_list
@@ -11,8 +11,8 @@ from jittordet.utils import bbox_overlaps, reduce_mean
 from ..layers import ConvModule, Scale
 from ..task_utils.prior_generators import anchor_inside_flags
 from ..task_utils.samplers import PseudoSampler
-from ..utils import (bias_init_with_prob, filter_scores_and_topk,
-                     images_to_levels, multi_apply, normal_init, unmap)
+from ..utils import (bias_init_with_prob, images_to_levels, multi_apply,
+                     normal_init, unmap)
 from .anchor_head import AnchorHead
 
 
@@ -388,17 +388,12 @@ class GFLHead(AnchorHead):
         return dict(
             loss_cls=losses_cls, loss_bbox=losses_bbox, loss_dfl=losses_dfl)
 
-    def _predict_by_feat_single(self,
-                                cls_score_list: List[jt.Var],
-                                bbox_pred_list: List[jt.Var],
-                                score_factor_list: List[jt.Var],
-                                mlvl_priors: List[jt.Var],
-                                img_meta: dict,
-                                cfg: ConfigDict,
-                                rescale: bool = False,
-                                with_nms: bool = True) -> InstanceData:
-        """Transform a single image's features extracted from the head into
-        bbox results.
+    def _get_mlvl_scores_single(
+            self, cls_score_list: List[jt.Var], bbox_pred_list: List[jt.Var],
+            score_factor_list: List[jt.Var],
+            mlvl_priors: List[jt.Var]) -> Tuple[List[jt.Var], List[dict]]:
+        """Get the scores of all scale levels of a single image, with the
+        results to be filtered together with them.
 
         Args:
             cls_score_list (list[Tensor]): Box scores from all scale
@@ -412,38 +407,17 @@ class GFLHead(AnchorHead):
             mlvl_priors (list[Tensor]): Each element in the list is
                 the priors of a single level in feature pyramid, has shape
                 (num_priors, 4).
-            img_meta (dict): Image meta info.
-            cfg (:obj: `ConfigDict`): Test / postprocessing configuration,
-                if None, test_cfg would be used.
-            rescale (bool): If True, return boxes in original image space.
-                Defaults to False.
-            with_nms (bool): If True, do nms before return boxes.
-                Defaults to True.
 
         Returns:
-            tuple[Tensor]: Results of detected bboxes and labels. If with_nms
-            is False and mlvl_score_factor is None, return mlvl_bboxes and
-            mlvl_scores, else return mlvl_bboxes, mlvl_scores and
-            mlvl_score_factor. Usually with_nms is False is used for aug
-            test. If with_nms is True, then return the following format
-
-            - det_bboxes (Tensor): Predicted bboxes with shape
-              [num_bboxes, 5], where the first 4 columns are bounding
-              box positions (tl_x, tl_y, br_x, br_y) and the 5-th
-              column are scores between 0 and 1.
-            - det_labels (Tensor): Predicted labels of the corresponding
-              box with shape [num_bboxes].
+            tuple[list]: The scores of each level, each has shape
+            (num_priors, num_classes), and the results of each level, each
+            is a dict of the integral ``bbox_pred`` and ``priors``.
         """
-        cfg = self.test_cfg if cfg is None else cfg
-        img_shape = img_meta['img_shape']
-        nms_pre = cfg.get('nms_pre', -1)
-
-        mlvl_bboxes = []
         mlvl_scores = []
-        mlvl_labels = []
-        for level_idx, (cls_score, bbox_pred, stride, priors) in enumerate(
-                zip(cls_score_list, bbox_pred_list,
-                    self.prior_generator.strides, mlvl_priors)):
+        mlvl_results = []
+        for cls_score, bbox_pred, stride, priors in zip(
+                cls_score_list, bbox_pred_list, self.prior_generator.strides,
+                mlvl_priors):
             assert cls_score.size()[-2:] == bbox_pred.size()[-2:]
             assert stride[0] == stride[1]
 
@@ -452,22 +426,43 @@ class GFLHead(AnchorHead):
 
             scores = cls_score.permute(1, 2, 0).reshape(
                 -1, self.cls_out_channels).sigmoid()
+            mlvl_scores.append(scores)
+            mlvl_results.append(dict(bbox_pred=bbox_pred, priors=priors))
+        return mlvl_scores, mlvl_results
 
-            # After https://github.com/open-mmlab/mmdetection/pull/6268/,
-            # this operation keeps fewer bboxes under the same `nms_pre`.
-            # There is no difference in performance for most models. If you
-            # find a slight drop in performance, you can set a larger
-            # `nms_pre` than before.
-            results = filter_scores_and_topk(
-                scores, cfg.score_thr, nms_pre,
-                dict(bbox_pred=bbox_pred, priors=priors))
-            scores, labels, _, filtered_results = results
+    def _decode_filtered_single(self,
+                                mlvl_filtered: List[tuple],
+                                img_meta: dict,
+                                cfg: ConfigDict,
+                                rescale: bool = False,
+                                with_nms: bool = True) -> InstanceData:
+        """Decode the filtered candidates of a single image into bbox
+        results.
 
-            bbox_pred = filtered_results['bbox_pred']
-            priors = filtered_results['priors']
+        Args:
+            mlvl_filtered (list[tuple]): The filtered results of each level,
+                see :meth:`_filter_batch_mlvl_scores`.
+            img_meta (dict): Image meta info.
+            cfg (:obj: `ConfigDict`): Test / postprocessing configuration.
+            rescale (bool): If True, return boxes in original image space.
+                Defaults to False.
+            with_nms (bool): If True, do nms before return boxes.
+                Defaults to True.
 
+        Returns:
+            :obj:`InstanceData`: Detection results of the image after the
+            post process.
+        """
+        img_shape = img_meta['img_shape']
+
+        mlvl_bboxes = []
+        mlvl_scores = []
+        mlvl_labels = []
+        for scores, labels, _, filtered_results in mlvl_filtered:
             bboxes = self.bbox_coder.decode(
-                self.anchor_center(priors), bbox_pred, max_shape=img_shape)
+                self.anchor_center(filtered_results['priors']),
+                filtered_results['bbox_pred'],
+                max_shape=img_shape)
             mlvl_bboxes.append(bboxes)
             mlvl_scores.append(scores)
             mlvl_labels.append(labels)
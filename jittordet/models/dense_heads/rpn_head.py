@@ -1,15 +1,17 @@
 # Modified from OpenMMLab mmdet/models/dense_heads/rpn_head.py
 # Copyright (c) OpenMMLab. All rights reserved.
 import copy
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import jittor as jt
 import jittor.nn as nn
+import numpy as np
 
 from jittordet.engine import MODELS, ConfigDict
+from jittordet.ops import segmented_topk
 from jittordet.structures import InstanceData, InstanceList, OptInstanceList
 from ..layers import ConvModule
-from ..utils import batched_nms, normal_init
+from ..utils import normal_init
 from .anchor_head import AnchorHead
 
 
@@ -102,27 +104,14 @@ class RPNHead(AnchorHead):
         return dict(
             loss_rpn_cls=losses['loss_cls'], loss_rpn_bbox=losses['loss_bbox'])
 
-    def _predict_by_feat_single(self,
-                                cls_score_list: List[jt.Var],
-                                bbox_pred_list: List[jt.Var],
-                                score_factor_list: List[jt.Var],
-                                mlvl_priors: List[jt.Var],
-                                img_meta: dict,
-                                cfg: ConfigDict,
-                                rescale: bool = False,
-                                with_nms: bool = True) -> InstanceData:
-        cfg = self.test_cfg if cfg is None else cfg
-        cfg = copy.deepcopy(cfg)
-        img_shape = img_meta['img_shape']
-        nms_pre = cfg.get('nms_pre', -1)
-
-        mlvl_bbox_preds = []
-        mlvl_valid_priors = []
+    def _get_mlvl_scores_single(
+            self, cls_score_list: List[jt.Var], bbox_pred_list: List[jt.Var],
+            score_factor_list: List[jt.Var],
+            mlvl_priors: List[jt.Var]) -> Tuple[List[jt.Var], List[dict]]:
         mlvl_scores = []
-        level_ids = []
-
-        for level_idx, (cls_score, bbox_pred, priors) in enumerate(
-                zip(cls_score_list, bbox_pred_list, mlvl_priors)):
+        mlvl_results = []
+        for cls_score, bbox_pred, priors in zip(cls_score_list, bbox_pred_list,
+                                                mlvl_priors):
             assert cls_score.shape[-2:] == bbox_pred.shape[-2:]
             bbox_pred = bbox_pred.permute(1, 2, 0).reshape(-1, 4)
             cls_score = cls_score.permute(1, 2,
@@ -133,18 +122,65 @@ class RPNHead(AnchorHead):
                 # remind that we set FG labels to [0] since mmdet v2.0
                 # BG cat_id: 1
                 scores = nn.softmax(cls_score, -1)[:, :-1]
-            scores = jt.squeeze(scores, -1)
-            if 0 < nms_pre < scores.shape[0]:
-                # sort is faster than topk
-                # _, topk_inds = scores.topk(cfg.nms_pre)
-                rank_inds, ranked_scores = scores.argsort(descending=True)
-                topk_inds = rank_inds[:nms_pre]
-                scores = ranked_scores[:nms_pre]
-                bbox_pred = bbox_pred[topk_inds, :]
-                priors = priors[topk_inds]
-
-            mlvl_bbox_preds.append(bbox_pred)
-            mlvl_valid_priors.append(priors)
+            mlvl_scores.append(jt.squeeze(scores, -1))
+            mlvl_results.append(dict(bbox_pred=bbox_pred, priors=priors))
+        return mlvl_scores, mlvl_results
+
+    def _filter_batch_mlvl_scores(self, batch_mlvl_scores: List[List[jt.Var]],
+                                  batch_mlvl_results: List[List[dict]],
+                                  cfg: ConfigDict) -> List[List[tuple]]:
+        """Keep the ``nms_pre`` top proposals of each level of several images.
+
+        Proposals are not filtered by scores, so the number kept of each level
+        is known without a sync, and the proposals of all levels of all
+        images are selected by a single :func:`segmented_topk`.
+        """
+        nms_pre = cfg.get('nms_pre', -1)
+        if nms_pre <= 0:
+            return [[(scores, None, None, results)
+                     for scores, results in zip(mlvl_scores, mlvl_results)]
+                    for mlvl_scores, mlvl_results in zip(
+                        batch_mlvl_scores, batch_mlvl_results)]
+
+        num_scores = [
+            scores.shape[0] for mlvl_scores in batch_mlvl_scores
+            for scores in mlvl_scores
+        ]
+        offsets = np.concatenate([[0], np.cumsum(num_scores)])
+        topk_scores, topk_inds = segmented_topk(
+            jt.concat(sum(batch_mlvl_scores, [])), offsets, nms_pre)
+        batch_mlvl_filtered = []
+        i = 0
+        for mlvl_scores, mlvl_results in zip(batch_mlvl_scores,
+                                             batch_mlvl_results):
+            mlvl_filtered = []
+            for results in mlvl_results:
+                num_topk = min(num_scores[i], nms_pre)
+                inds = topk_inds[i, :num_topk]
+                filtered_results = {k: v[inds] for k, v in results.items()}
+                mlvl_filtered.append(
+                    (topk_scores[i, :num_topk], None, inds, filtered_results))
+                i += 1
+            batch_mlvl_filtered.append(mlvl_filtered)
+        return batch_mlvl_filtered
+
+    def _decode_filtered_single(self,
+                                mlvl_filtered: List[tuple],
+                                img_meta: dict,
+                                cfg: ConfigDict,
+                                rescale: bool = False,
+                                with_nms: bool = True) -> InstanceData:
+        cfg = copy.deepcopy(cfg)
+        img_shape = img_meta['img_shape']
+
+        mlvl_bbox_preds = []
+        mlvl_valid_priors = []
+        mlvl_scores = []
+        level_ids = []
+        for level_idx, (scores, _, _,
+                        filtered_results) in enumerate(mlvl_filtered):
+            mlvl_bbox_preds.append(filtered_results['bbox_pred'])
+            mlvl_valid_priors.append(filtered_results['priors'])
             mlvl_scores.append(scores)
             level_ids.append(
                 jt.full((scores.size(0), ), level_idx, dtype=jt.int64))
@@ -158,7 +194,11 @@ class RPNHead(AnchorHead):
         results.scores = jt.concat(mlvl_scores)
         results.level_ids = jt.concat(level_ids)
         return self._bbox_post_process(
-            results=results, cfg=cfg, rescale=rescale, img_meta=img_meta)
+            results=results,
+            cfg=cfg,
+            rescale=rescale,
+            with_nms=with_nms,
+            img_meta=img_meta)
 
     def _bbox_post_process(self,
                            results: InstanceData,
@@ -166,7 +206,6 @@ class RPNHead(AnchorHead):
                            rescale: bool = False,
                            with_nms: bool = True,
                            img_meta: Optional[dict] = None) -> InstanceData:
-        assert with_nms, '`with_nms` must be True in RPNHead'
         if rescale:
             assert img_meta.get('scale_factor') is not None
             results.bboxes /= jt.array(
@@ -181,24 +220,21 @@ class RPNHead(AnchorHead):
             if not valid_mask.all():
                 results = results[valid_mask]
 
-        if results.bboxes.numel() > 0:
-            bboxes = results.bboxes
-            # TODO batched_nms
-            _, det_scores, keep_idxs = batched_nms(bboxes, results.scores,
-                                                   results.level_ids, cfg.nms)
-            results = results[keep_idxs]
-            # some nms would reweight the score, such as softnms
-            results.scores = det_scores
-            results = results[:cfg.max_per_img]
+        if with_nms:
+            results = self._bbox_nms([results], cfg)[0]
+        return results
+
+    def _bbox_nms(self, result_list: InstanceList,
+                  cfg: ConfigDict) -> InstanceList:
+        """Apply nms to the proposals of several images in one call.
+
+        Proposals of different levels are suppressed separately.
+        """
+        for results in result_list:
+            results.labels = results.pop('level_ids')
+        result_list = super()._bbox_nms(result_list, cfg)
+        for results in result_list:
             # TODO: This would unreasonably show the 0th class label
             #  in visualization
             results.labels = jt.zeros(len(results), dtype=jt.int64)
-            del results.level_ids
-        else:
-            # To avoid some potential error
-            results_ = InstanceData()
-            results_.bboxes = jt.zeros_like(results.bboxes)
-            results_.scores = jt.zeros_like(results.scores)
-            results_.labels = jt.zeros_like(results.scores)
-            results = results_
-        return results
+        return result_list
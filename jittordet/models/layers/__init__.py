@@ -1,5 +1,6 @@
 from .conv_module import ConvModule
 from .linear import *  # noqa: F403, F401
 from .scale import Scale
+from .scattering import Scattering2D
 
-__all__ = ['ConvModule', 'Scale']
+__all__ = ['ConvModule', 'Scale', 'Scattering2D']
@@ -0,0 +1,217 @@
+# Modified from kymatio.scattering2d
+# Copyright (c) 2018-present, The Kymatio developers. All rights reserved.
+import jittor as jt
+import jittor.nn as nn
+import numpy as np
+
+
+def gabor_2d(M, N, sigma, theta, xi, slant=1.0, offset=0):
+    """Compute a 2D Gabor filter in space, periodized over 5x5 tiles."""
+    gab = np.zeros((M, N), np.complex64)
+    R = np.array([[np.cos(theta), -np.sin(theta)],
+                  [np.sin(theta), np.cos(theta)]], np.float32)
+    R_inv = np.array([[np.cos(theta), np.sin(theta)],
+                      [-np.sin(theta), np.cos(theta)]], np.float32)
+    D = np.array([[1, 0], [0, slant * slant]])
+    curv = np.dot(R, np.dot(D, R_inv)) / (2 * sigma * sigma)
+
+    for ex in [-2, -1, 0, 1, 2]:
+        for ey in [-2, -1, 0, 1, 2]:
+            [xx, yy] = np.mgrid[offset + ex * M:offset + M + ex * M,
+                                offset + ey * N:offset + N + ey * N]
+            arg = -(curv[0, 0] * np.multiply(xx, xx) +
+                    (curv[0, 1] + curv[1, 0]) * np.multiply(xx, yy) +
+                    curv[1, 1] * np.multiply(yy, yy)) + 1.j * (
+                        xx * xi * np.cos(theta) + yy * xi * np.sin(theta))
+            gab += np.exp(arg)
+
+    norm_factor = (2 * 3.1415 * sigma * sigma / slant)
+    gab /= norm_factor
+    return gab
+
+
+def morlet_2d(M, N, sigma, theta, xi, slant=0.5, offset=0):
+    """Compute a 2D Morlet filter, i.e., a zero-mean Gabor filter."""
+    wv = gabor_2d(M, N, sigma, theta, xi, slant, offset)
+    wv_modulus = gabor_2d(M, N, sigma, theta, 0, slant, offset)
+    K = np.sum(wv) / np.sum(wv_modulus)
+    return wv - K * wv_modulus
+
+
+def periodize_filter_fft(x, res):
+    """Crop a Fourier filter to the resolution ``2 ** -res``."""
+    M, N = x.shape
+    mask = np.ones(x.shape, np.float32)
+    len_x = int(M * (1 - 2**(-res)))
+    start_x = int(M * 2**(-res - 1))
+    len_y = int(N * (1 - 2**(-res)))
+    start_y = int(N * 2**(-res - 1))
+    mask[start_x:start_x + len_x, :] = 0
+    mask[:, start_y:start_y + len_y] = 0
+    x = np.multiply(x, mask)
+
+    k = 2**res
+    return x.reshape(k, M // k, k, N // k).sum(axis=(0, 2)).astype(x.dtype)
+
+
+def filter_bank(M, N, J, L=8):
+    """Build the Morlet filter bank in the Fourier domain."""
+    filters = {}
+    filters['psi'] = []
+    for j in range(J):
+        for theta in range(L):
+            psi_signal = morlet_2d(M, N, 0.8 * 2**j,
+                                   (int(L - L / 2 - 1) - theta) * np.pi / L,
+                                   3.0 / 4.0 * np.pi / 2**j, 4.0 / L)
+            psi_signal_fourier = np.real(np.fft.fft2(psi_signal))
+            levels = [
+                periodize_filter_fft(psi_signal_fourier, res)
+                for res in range(min(j + 1, max(J - 1, 1)))
+            ]
+            filters['psi'].append(dict(levels=levels, j=j, theta=theta))
+
+    phi_signal = gabor_2d(M, N, 0.8 * 2**(J - 1), 0, 0)
+    phi_signal_fourier = np.real(np.fft.fft2(phi_signal))
+    levels = [
+        periodize_filter_fft(phi_signal_fourier, res) for res in range(J)
+    ]
+    filters['phi'] = dict(levels=levels, j=J)
+    return filters
+
+
+def fft2(x, inverse=False):
+    """2D (inverse) FFT over dims 1, 2 of a (B, M, N, 2) complex Var.
+
+    cuFFT is used on CUDA and numpy (pocketfft) on CPU.
+    """
+    if jt.flags.use_cuda:
+        return nn._fft2(x, inverse=inverse)
+
+    def forward_code(np, data):
+        a = data['inputs'][0]
+        out = data['outputs'][0]
+        a = a[..., 0] + 1j * a[..., 1]
+        a = np.fft.ifft2(a) if inverse else np.fft.fft2(a)
+        out[..., 0] = a.real
+        out[..., 1] = a.imag
+
+    return jt.numpy_code(x.shape, x.dtype, [x], forward_code)
+
+
+class Scattering2D(nn.Module):
+    """2D scattering transform implemented with Jittor.
+
+    A drop-in replacement of ``kymatio.torch.Scattering2D`` with the default
+    ``max_order=2`` and ``out_type='array'``. The Morlet filter bank is built
+    once in the Fourier domain and kept on the device. All filters of the
+    same scale are applied in one batched FFT.
+
+    Args:
+        J (int): Log-2 of the scattering scale.
+        shape (tuple[int]): Spatial size (M, N) of the input.
+        L (int): Number of angles of the wavelets. Defaults to 8.
+
+    Input of shape (B, C, M, N) results in output of shape
+    (B, C, K, M // 2**J, N // 2**J), where ``K = 1 + J*L + L*L*J*(J-1)/2``.
+    """
+
+    def __init__(self, J, shape, L=8):
+        super().__init__()
+        M, N = shape
+        if 2**J > M or 2**J > N:
+            raise RuntimeError(
+                'The smallest dimension should be larger than 2^J.')
+        self.J = J
+        self.L = L
+        self.shape = tuple(shape)
+        self.M_padded = ((M + 2**J) // 2**J + 1) * 2**J
+        self.N_padded = ((N + 2**J) // 2**J + 1) * 2**J
+        pad_m, pad_n = self.M_padded - M, self.N_padded - N
+        assert pad_m < M and pad_n < N, 'padding should be smaller than input'
+        # padding in the order of [left, right, top, bottom]
+        self.padding = (pad_n // 2, (pad_n + 1) // 2, pad_m // 2,
+                        (pad_m + 1) // 2)
+
+        filters = filter_bank(self.M_padded, self.N_padded, J, L)
+        # filters are not learnable, keep them out of parameters()
+        self._phi = [
+            jt.array(level.astype(np.float32)).stop_grad()
+            for level in filters['phi']['levels']
+        ]
+        # self._psi[j][res] is a (L, M / 2**res, N / 2**res) Var
+        self._psi = []
+        for j in range(J):
+            psis = [psi for psi in filters['psi'] if psi['j'] == j]
+            self._psi.append([
+                jt.array(
+                    np.stack([psi['levels'][res] for psi in psis
+                              ]).astype(np.float32)).stop_grad()
+                for res in range(len(psis[0]['levels']))
+            ])
+
+    @staticmethod
+    def _subsample_fourier(x, k):
+        if k == 1:
+            return x
+        M, N = x.shape[-3:-1]
+        x = x.reshape(tuple(x.shape[:-3]) + (k, M // k, k, N // k, 2))
+        return x.mean(-3).mean(-4)
+
+    @staticmethod
+    def _cdgmm(x, f):
+        return x * f.unsqueeze(-1)
+
+    @staticmethod
+    def _fft(x, inverse=False):
+        batch_shape = tuple(x.shape[:-3])
+        x = fft2(x.reshape((-1, ) + tuple(x.shape[-3:])), inverse=inverse)
+        return x.reshape(batch_shape + tuple(x.shape[-3:]))
+
+    def _rfft(self, x):
+        return self._fft(jt.stack([x, jt.zeros_like(x)], dim=-1))
+
+    def _modulus(self, x):
+        return (x * x).sum(-1).sqrt()
+
+    def _irfft_unpad(self, x):
+        return self._fft(x, inverse=True)[..., 1:-1, 1:-1, 0]
+
+    def execute(self, x):
+        batch_shape = tuple(x.shape[:-2])
+        x = x.reshape((-1, 1) + tuple(x.shape[-2:])).float32()
+        x = nn.pad(x, self.padding, mode='reflect')[:, 0]
+        B, J = x.shape[0], self.J
+
+        U_0_c = self._rfft(x)
+
+        # zeroth order
+        S_0 = self._subsample_fourier(self._cdgmm(U_0_c, self._phi[0]), 2**J)
+        outs_0 = [self._irfft_unpad(S_0).unsqueeze(1)]
+
+        # first order, all angles of one scale are processed together
+        outs_1, outs_2 = [], []
+        for j1 in range(J):
+            U_1_c = self._cdgmm(U_0_c.unsqueeze(1), self._psi[j1][0])
+            U_1_c = self._subsample_fourier(U_1_c, 2**j1)
+            U_1_c = self._rfft(self._modulus(self._fft(U_1_c, True)))
+
+            S_1_c = self._subsample_fourier(
+                self._cdgmm(U_1_c, self._phi[j1]), 2**(J - j1))
+            outs_1.append(self._irfft_unpad(S_1_c))
+
+            # second order, (B, L(theta1), L(theta2), ...) for each j2
+            S_2 = []
+            for j2 in range(j1 + 1, J):
+                U_2_c = self._cdgmm(U_1_c.unsqueeze(2), self._psi[j2][j1])
+                U_2_c = self._subsample_fourier(U_2_c, 2**(j2 - j1))
+                U_2_c = self._rfft(self._modulus(self._fft(U_2_c, True)))
+
+                S_2_c = self._subsample_fourier(
+                    self._cdgmm(U_2_c, self._phi[j2]), 2**(J - j2))
+                S_2.append(self._irfft_unpad(S_2_c))
+            if len(S_2) > 0:
+                S_2 = jt.concat(S_2, dim=2)
+                outs_2.append(S_2.reshape((B, -1) + tuple(S_2.shape[-2:])))
+
+        out = jt.concat(outs_0 + outs_1 + outs_2, dim=1)
+        return out.reshape(batch_shape + tuple(out.shape[1:]))
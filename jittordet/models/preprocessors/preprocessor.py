@@ -2,15 +2,17 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 import math
 from numbers import Number
-from typing import List, Optional, Sequence, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import jittor as jt
 import jittor.nn as nn
 import numpy as np
 
 from jittordet.engine import MODELS
-from jittordet.structures import DetDataSample
-from jittordet.utils import is_list_of
+from jittordet.ops.preprocess import (normalize_pad_stack,
+                                      normalize_pad_stack_packed)
+from jittordet.structures import DetDataSample, SampleList
+from jittordet.utils import get_shape_bucket, is_list_of
 
 
 @MODELS.register_module()
@@ -25,7 +27,9 @@ class Preprocessor(nn.Module):
 
     It provides the data pre-processing as follows
 
-    - Collate and move data to the target device.
+    - Collate and move data to the target device. Images packed into one
+      buffer by :meth:`BaseDetDataset.collate_batch` are moved as a whole,
+      and converted to float only after they are on the device.
     - Pad inputs to the maximum size of current batch with defined
       ``pad_value``. The padding size can be divisible by a defined
       ``pad_size_divisor``
@@ -50,12 +54,24 @@ class Preprocessor(nn.Module):
         seg_pad_value (int): The padded pixel value for semantic
             segmentation maps. Defaults to 255.
         bgr_to_rgb (bool): whether to convert image from BGR to RGB.
+            Single-channel grayscale images are not converted.
             Defaults to False.
         rgb_to_bgr (bool): whether to convert image from RGB to RGB.
             Defaults to False.
         boxtype2tensor (bool): Whether to keep the ``BaseBoxes`` type of
             bboxes data or not. Defaults to False.
         batch_augments (list[dict], optional): Batch-level augmentations
+        fuse_pad_normalize (bool): Whether to convert, normalize, pad and
+            stack a list of inputs in a single kernel with
+            :func:`normalize_pad_stack`, instead of processing every image
+            separately. Defaults to True.
+        batch_shape_buckets (list[tuple[int]], optional): Canonical (h, w)
+            of batches. If given, every batch is padded to the smallest
+            bucket holding it, so that Jittor only compiles kernels for a
+            few input shapes. Batches larger than all buckets are padded by
+            ``pad_size_divisor`` as usual. Use it with
+            :class:`ShapeBucketBatchSampler` to group samples by buckets.
+            Defaults to None.
     """
 
     def __init__(self,
@@ -67,7 +83,9 @@ class Preprocessor(nn.Module):
                  mask_pad_value: int = 0,
                  bgr_to_rgb: bool = False,
                  rgb_to_bgr: bool = False,
-                 batch_augments: Optional[List[dict]] = None):
+                 batch_augments: Optional[List[dict]] = None,
+                 fuse_pad_normalize: bool = True,
+                 batch_shape_buckets: Optional[Sequence[tuple]] = None):
         super().__init__()
         assert not (bgr_to_rgb and rgb_to_bgr), (
             '`bgr2rgb` and `rgb2bgr` cannot be set to True at the same time')
@@ -83,11 +101,20 @@ class Preprocessor(nn.Module):
             self._enable_normalize = True
             self.mean = np.array(mean).reshape(-1, 1, 1)
             self.std = np.array(std).reshape(-1, 1, 1)
+            # cached on device, not parameters as prefixed with underscore
+            self._mean = jt.array(self.mean, dtype='float32').stop_grad()
+            self._std = jt.array(self.std, dtype='float32').stop_grad()
         else:
             self._enable_normalize = False
         self._channel_conversion = rgb_to_bgr or bgr_to_rgb
+        self.fuse_pad_normalize = fuse_pad_normalize
         self.pad_size_divisor = pad_size_divisor
         self.pad_value = pad_value
+        self.batch_shape_buckets = None
+        if batch_shape_buckets is not None:
+            self.batch_shape_buckets = np.array(
+                batch_shape_buckets, dtype=np.int64).reshape(-1, 2)
+        self.reset_shape_stats()
         if batch_augments is not None:
             self.batch_augments = nn.ModuleList(
                 [MODELS.build(aug) for aug in batch_augments])
@@ -107,14 +134,44 @@ class Preprocessor(nn.Module):
         Returns:
             dict: Data in the same format as the model input.
         """
+        if self._is_packed(data['inputs']) and not self.fuse_pad_normalize:
+            data['inputs'] = self.unpack_inputs(data['inputs'])
         batch_pad_shape = self._get_pad_shape(data)
         _batch_inputs = data['inputs']
-        # Process data with `pseudo_collate`.
-        if is_list_of(_batch_inputs, jt.Var):
+        # Process data packed by `BaseDetDataset.collate_batch` or with
+        # `pseudo_collate`, images are converted to float in the kernel.
+        if self.fuse_pad_normalize and (self._is_packed(_batch_inputs)
+                                        or is_list_of(_batch_inputs, jt.Var)):
+            if self._is_packed(_batch_inputs):
+                img_shapes = self._get_img_shapes(_batch_inputs)
+            else:
+                img_shapes = [tuple(img.shape) for img in _batch_inputs]
+            if self._enable_normalize and self.mean.shape[0] == 3:
+                assert all(
+                    len(shape) == 3 and shape[0] == 3
+                    for shape in img_shapes), (
+                        'If the mean has 3 values, the input tensor should '
+                        f'in shape of (3, H, W), but got {img_shapes}')
+            mean, std = (self._mean.reshape(-1), self._std.reshape(-1)) \
+                if self._enable_normalize else (None, None)
+            kwargs = dict(
+                pad_value=self.pad_value,
+                swap_channel=self._channel_conversion,
+                batch_shape=self._get_batch_shape(
+                    max(shape[1] for shape in img_shapes),
+                    max(shape[2] for shape in img_shapes)))
+            if self._is_packed(_batch_inputs):
+                batch_inputs = normalize_pad_stack_packed(
+                    _batch_inputs['img_buffer'], img_shapes, mean, std,
+                    **kwargs)
+            else:
+                batch_inputs = normalize_pad_stack(_batch_inputs, mean, std,
+                                                   **kwargs)
+        elif is_list_of(_batch_inputs, jt.Var):
             batch_inputs = []
             for _batch_input in _batch_inputs:
-                # channel transform
-                if self._channel_conversion:
+                # channel transform, grayscale images are kept as they are
+                if self._channel_conversion and _batch_input.shape[0] == 3:
                     _batch_input = _batch_input[[2, 1, 0], ...]
                 # Convert to float after channel conversion to ensure
                 # efficiency
@@ -128,32 +185,33 @@ class Preprocessor(nn.Module):
                         ), ('If the mean has 3 values, the input tensor '
                             'should in shape of (3, H, W), but got the tensor '
                             f'with shape {_batch_input.shape}')
-                    mean, std = jt.array(self.mean), jt.array(self.std)
-                    _batch_input = (_batch_input - mean) / std
+                    _batch_input = (_batch_input - self._mean) / self._std
                 batch_inputs.append(_batch_input)
             # Pad and stack Tensor.
             batch_inputs = self.stack_batch(batch_inputs,
                                             self.pad_size_divisor,
                                             self.pad_value)
+            h, w = batch_inputs.shape[2:]
+            target_h, target_w = self._get_batch_shape(h, w)
+            if (target_h, target_w) != (h, w):
+                batch_inputs = nn.pad(batch_inputs,
+                                      (0, target_w - w, 0, target_h - h),
+                                      'constant', self.pad_value)
         # Process data with `default_collate`.
         elif isinstance(_batch_inputs, jt.Var):
             assert _batch_inputs.ndim == 4, (
                 'The input of `ImgDataPreprocessor` should be a NCHW tensor '
                 'or a list of tensor, but got a tensor with shape: '
                 f'{_batch_inputs.shape}')
-            if self._channel_conversion:
+            if self._channel_conversion and _batch_inputs.shape[1] == 3:
                 _batch_inputs = _batch_inputs[:, [2, 1, 0], ...]
             # Convert to float after channel conversion to ensure
             # efficiency
             _batch_inputs = _batch_inputs.float()
             if self._enable_normalize:
-                mean, std = jt.array(self.mean), jt.array(self.std)
-                _batch_inputs = (_batch_inputs - mean) / std
+                _batch_inputs = (_batch_inputs - self._mean) / self._std
             h, w = _batch_inputs.shape[2:]
-            target_h = math.ceil(
-                h / self.pad_size_divisor) * self.pad_size_divisor
-            target_w = math.ceil(
-                w / self.pad_size_divisor) * self.pad_size_divisor
+            target_h, target_w = self._get_batch_shape(h, w)
             pad_h = target_h - h
             pad_w = target_w - w
             batch_inputs = nn.pad(_batch_inputs, (0, pad_w, 0, pad_h),
@@ -163,6 +221,7 @@ class Preprocessor(nn.Module):
                             'or a tuple with inputs and data_samples, but got'
                             f'{type(data)}: {data}')
 
+        self._update_shape_stats(tuple(batch_inputs.shape))
         data['inputs'] = batch_inputs
         data.setdefault('data_samples', None)
 
@@ -185,6 +244,9 @@ class Preprocessor(nn.Module):
             for batch_aug in self.batch_augments:
                 inputs, data_samples = batch_aug(inputs, data_samples)
 
+        if data_samples is not None and 'wavelet_feats' in data_samples[0]:
+            inputs = (inputs, self.stack_wavelet_feats(data_samples))
+
         return {'inputs': inputs, 'data_samples': data_samples}
 
     @staticmethod
@@ -241,20 +303,81 @@ class Preprocessor(nn.Module):
                 nn.pad(tensor, tuple(pad[idx].tolist()), value=pad_value))
         return jt.stack(batch_tensor)
 
+    def _get_batch_shape(self, h: int, w: int) -> Tuple[int, int]:
+        """Get the padded (h, w) of a batch whose largest image is (h, w)."""
+        divisor = self.pad_size_divisor
+        shape = (math.ceil(h / divisor) * divisor,
+                 math.ceil(w / divisor) * divisor)
+        if self.batch_shape_buckets is not None:
+            idx = get_shape_bucket(shape, self.batch_shape_buckets)
+            if idx >= 0:
+                shape = tuple(int(x) for x in self.batch_shape_buckets[idx])
+            else:
+                self.shape_stats['num_overflows'] += 1
+        return shape
+
+    def reset_shape_stats(self) -> None:
+        """Reset the statistics of batch input shapes."""
+        self.shape_stats = dict(num_batches=0, num_hits=0, num_overflows=0)
+        self._batch_shapes = set()
+
+    def _update_shape_stats(self, shape: tuple) -> None:
+        self.shape_stats['num_batches'] += 1
+        if shape in self._batch_shapes:
+            self.shape_stats['num_hits'] += 1
+        else:
+            self._batch_shapes.add(shape)
+
+    def get_shape_stats(self) -> dict:
+        """Get the statistics of batch input shapes.
+
+        Jittor compiles kernels for every new input shape, so the hit rate
+        of batch shapes, i.e., the ratio of batches whose (N, C, H, W) has
+        been seen before, approximates the hit rate of the compile cache.
+        """
+        stats = dict(self.shape_stats)
+        stats['num_shapes'] = len(self._batch_shapes)
+        stats['hit_rate'] = stats['num_hits'] / max(stats['num_batches'], 1)
+        return stats
+
+    @staticmethod
+    def _is_packed(batch_inputs) -> bool:
+        return isinstance(batch_inputs, dict) and 'img_buffer' in batch_inputs
+
+    @staticmethod
+    def _get_img_shapes(batch_inputs: dict) -> List[tuple]:
+        return [
+            tuple(int(x) for x in shape)
+            for shape in batch_inputs['img_shapes']
+        ]
+
+    def unpack_inputs(self, batch_inputs: dict) -> List[jt.Var]:
+        """Split the images packed by :meth:`BaseDetDataset.collate_batch`
+        into a list of (C, H, W) Vars."""
+        img_buffer = batch_inputs['img_buffer']
+        imgs, offset = [], 0
+        for shape in self._get_img_shapes(batch_inputs):
+            size = int(np.prod(shape))
+            imgs.append(img_buffer[offset:offset + size].reshape(shape))
+            offset += size
+        return imgs
+
     def _get_pad_shape(self, data: dict) -> List[tuple]:
         """Get the pad_shape of each image based on data and
         pad_size_divisor."""
         _batch_inputs = data['inputs']
-        # Process data with `pseudo_collate`.
-        if is_list_of(_batch_inputs, jt.Var):
+        # Process data with `pseudo_collate` or packed data.
+        if is_list_of(_batch_inputs, jt.Var) or self._is_packed(_batch_inputs):
+            if self._is_packed(_batch_inputs):
+                img_shapes = self._get_img_shapes(_batch_inputs)
+            else:
+                img_shapes = [img.shape for img in _batch_inputs]
             batch_pad_shape = []
-            for ori_input in _batch_inputs:
-                pad_h = int(
-                    np.ceil(ori_input.shape[1] /
-                            self.pad_size_divisor)) * self.pad_size_divisor
-                pad_w = int(
-                    np.ceil(ori_input.shape[2] /
-                            self.pad_size_divisor)) * self.pad_size_divisor
+            for shape in img_shapes:
+                pad_h = int(np.ceil(
+                    shape[1] / self.pad_size_divisor)) * self.pad_size_divisor
+                pad_w = int(np.ceil(
+                    shape[2] / self.pad_size_divisor)) * self.pad_size_divisor
                 batch_pad_shape.append((pad_h, pad_w))
         # Process data with `default_collate`.
         elif isinstance(_batch_inputs, jt.Var):
@@ -275,6 +398,17 @@ class Preprocessor(nn.Module):
                             f'{type(data)}: {data}')
         return batch_pad_shape
 
+    @staticmethod
+    def stack_wavelet_feats(batch_data_samples: SampleList) -> jt.Var:
+        """Pop the precomputed wavelet features from data samples and stack
+        them into a batch, they are passed to the backbone (e.g.
+        :class:`MSFA`) together with the batch inputs."""
+        wavelet_feats = []
+        for data_sample in batch_data_samples:
+            wavelet_feats.append(data_sample.wavelet_feats)
+            del data_sample.wavelet_feats
+        return jt.stack(wavelet_feats)
+
     def pad_gt_masks(self,
                      batch_data_samples: Sequence[DetDataSample]) -> None:
         """Pad gt_masks to shape of batch_input_shape."""
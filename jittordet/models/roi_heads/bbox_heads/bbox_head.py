@@ -8,7 +8,8 @@ from jittordet.engine import MODELS, TASK_UTILS, ConfigDict, ConfigType
 from jittordet.models.losses import accuracy
 from jittordet.models.task_utils.samplers.sampling_result import SamplingResult
 from jittordet.models.utils import (empty_instances, multi_apply,
-                                    multiclass_nms, normal_init)
+                                    multi_image_multiclass_nms, multiclass_nms,
+                                    normal_init)
 from jittordet.structures import InstanceData, InstanceList
 
 
@@ -422,15 +423,38 @@ class BBoxHead(nn.Module):
         result_list = []
         for img_id in range(len(batch_img_metas)):
             img_meta = batch_img_metas[img_id]
+            # get the raw results, nms of all images is applied at once below
             results = self._predict_by_feat_single(
                 roi=rois[img_id],
                 cls_score=cls_scores[img_id],
                 bbox_pred=bbox_preds[img_id],
                 img_meta=img_meta,
                 rescale=rescale,
-                rcnn_test_cfg=rcnn_test_cfg)
+                rcnn_test_cfg=None)
             result_list.append(results)
-
+        if rcnn_test_cfg is None:
+            # This means that it is aug test.
+            # It needs to return the raw results without nms.
+            return result_list
+
+        img_inds = [i for i, roi in enumerate(rois) if roi.shape[0] > 0]
+        nms_results = multi_image_multiclass_nms(
+            [result_list[i].bboxes for i in img_inds],
+            [result_list[i].scores for i in img_inds], rcnn_test_cfg.score_thr,
+            rcnn_test_cfg.nms, rcnn_test_cfg.max_per_img)
+        for i, (det_bboxes, det_scores,
+                det_labels) in zip(img_inds, nms_results):
+            results = InstanceData()
+            results.bboxes = det_bboxes
+            results.scores = det_scores
+            results.labels = det_labels
+            result_list[i] = results
+        for i, roi in enumerate(rois):
+            if roi.shape[0] == 0:
+                result_list[i] = empty_instances(
+                    [batch_img_metas[i]],
+                    instance_results=[InstanceData()],
+                    num_classes=self.num_classes)[0]
         return result_list
 
     def _predict_by_feat_single(
@@ -5,6 +5,7 @@ from typing import List, Optional, Tuple
 
 import jittor as jt
 
+from jittordet import ops
 from jittordet.engine import MODELS, ConfigType
 from .base_roi_extractor import BaseRoIExtractor
 
@@ -84,6 +85,20 @@ class SingleRoIExtractor(BaseRoIExtractor):
                 return roi_feats
             return self.roi_layers[0](feats[0], rois)
 
+        roi_layers = self.roi_layers[:num_levels]
+        if isinstance(roi_layers[0], ops.ROIAlign):
+            if len(rois) == 0:
+                return roi_feats
+            # map, rescale and pool the rois of all levels in a single op
+            return ops.multi_level_roi_align(
+                feats,
+                rois,
+                out_size, [layer.spatial_scale for layer in roi_layers],
+                finest_scale=self.finest_scale,
+                roi_scale_factor=roi_scale_factor,
+                sampling_ratio=roi_layers[0].sampling_ratio,
+                version=roi_layers[0].version)
+
         target_lvls = self.map_roi_levels(rois, num_levels)
 
         if roi_scale_factor is not None:
@@ -1,4 +1,6 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+from collections import OrderedDict
+
 import jittor as jt
 import numpy as np
 
@@ -34,6 +36,10 @@ class AnchorGenerator:
             float is given, they will be used to shift the centers of anchors.
         center_offset (float): The offset of center in proportion to anchors'
             width and height. By default it is 0 in V2.0.
+        cache_size (int): The number of grid priors and valid flags of
+            different feature map sizes and pad shapes kept in LRU caches,
+            which are shared by the images and iterations. 0 disables the
+            caches. Defaults to 16.
 
     Examples:
         >>> from mmdet.core import AnchorGenerator
@@ -63,7 +69,8 @@ class AnchorGenerator:
                  octave_base_scale=None,
                  scales_per_octave=None,
                  centers=None,
-                 center_offset=0.):
+                 center_offset=0.,
+                 cache_size=16):
         # check center and center_offset
         if center_offset != 0:
             assert centers is None, 'center cannot be set when center_offset' \
@@ -108,6 +115,12 @@ class AnchorGenerator:
         self.center_offset = center_offset
         self.base_anchors = self.gen_base_anchors()
 
+        self.cache_size = cache_size
+        self._caches = dict(
+            grid_priors=OrderedDict(), valid_flags=OrderedDict())
+        self.cache_hits = dict(grid_priors=0, valid_flags=0)
+        self.cache_misses = dict(grid_priors=0, valid_flags=0)
+
     @property
     def num_base_priors(self):
         """list[int]: The number of priors (anchors) at a point
@@ -184,6 +197,32 @@ class AnchorGenerator:
 
         return base_anchors
 
+    def _cached(self, name, key, func):
+        """Get the result of ``func`` from the LRU cache ``name`` by ``key``.
+
+        Args:
+            name (str): Name of the cache, ``grid_priors`` or
+                ``valid_flags``.
+            key (tuple): Key of the result.
+            func (callable): Function computing the result on a miss.
+
+        Returns:
+            list[jt.Var]: A new list of the cached multi-level results, so
+                callers can modify the list without touching the cache.
+        """
+        cache = self._caches[name]
+        if key in cache:
+            cache.move_to_end(key)
+            self.cache_hits[name] += 1
+            return list(cache[key])
+        self.cache_misses[name] += 1
+        result = func()
+        if self.cache_size > 0:
+            cache[key] = result
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return list(result)
+
     def _meshgrid(self, x, y, row_major=True):
         """Generate mesh grid of x and y.
 
@@ -222,12 +261,18 @@ class AnchorGenerator:
                 num_base_anchors is the number of anchors for that level.
         """
         assert self.num_levels == len(featmap_sizes)
-        multi_level_anchors = []
-        for i in range(self.num_levels):
-            anchors = self.single_level_grid_priors(
-                featmap_sizes[i], level_idx=i, dtype=dtype)
-            multi_level_anchors.append(anchors)
-        return multi_level_anchors
+        featmap_sizes = tuple(
+            tuple(int(s) for s in size) for size in featmap_sizes)
+
+        def _grid_priors():
+            return [
+                self.single_level_grid_priors(
+                    featmap_sizes[i], level_idx=i, dtype=dtype)
+                for i in range(self.num_levels)
+            ]
+
+        return self._cached('grid_priors', (featmap_sizes, str(dtype)),
+                            _grid_priors)
 
     def single_level_grid_priors(self,
                                  featmap_size,
@@ -318,18 +363,25 @@ class AnchorGenerator:
             list(torch.Tensor): Valid flags of anchors in multiple levels.
         """
         assert self.num_levels == len(featmap_sizes)
-        multi_level_flags = []
-        for i in range(self.num_levels):
-            anchor_stride = self.strides[i]
-            feat_h, feat_w = featmap_sizes[i]
-            h, w = pad_shape[:2]
-            valid_feat_h = min(int(np.ceil(h / anchor_stride[1])), feat_h)
-            valid_feat_w = min(int(np.ceil(w / anchor_stride[0])), feat_w)
-            flags = self.single_level_valid_flags((feat_h, feat_w),
-                                                  (valid_feat_h, valid_feat_w),
-                                                  self.num_base_priors[i])
-            multi_level_flags.append(flags)
-        return multi_level_flags
+        featmap_sizes = tuple(
+            tuple(int(s) for s in size) for size in featmap_sizes)
+        h, w = (int(s) for s in pad_shape[:2])
+
+        def _valid_flags():
+            multi_level_flags = []
+            for i in range(self.num_levels):
+                anchor_stride = self.strides[i]
+                feat_h, feat_w = featmap_sizes[i]
+                valid_feat_h = min(int(np.ceil(h / anchor_stride[1])), feat_h)
+                valid_feat_w = min(int(np.ceil(w / anchor_stride[0])), feat_w)
+                flags = self.single_level_valid_flags(
+                    (feat_h, feat_w), (valid_feat_h, valid_feat_w),
+                    self.num_base_priors[i])
+                multi_level_flags.append(flags)
+            return multi_level_flags
+
+        return self._cached('valid_flags', (featmap_sizes, (h, w)),
+                            _valid_flags)
 
     def single_level_valid_flags(self, featmap_size, valid_size,
                                  num_base_anchors):
@@ -375,5 +427,6 @@ class AnchorGenerator:
         repr_str += f'{self.scales_per_octave},\n'
         repr_str += f'{indent_str}num_levels={self.num_levels}\n'
         repr_str += f'{indent_str}centers={self.centers},\n'
-        repr_str += f'{indent_str}center_offset={self.center_offset})'
+        repr_str += f'{indent_str}center_offset={self.center_offset},\n'
+        repr_str += f'{indent_str}cache_size={self.cache_size})'
         return repr_str
@@ -1,15 +1,19 @@
 from .initialize import (bias_init_with_prob, caffe2_xavier_init,
                          constant_init, kaiming_init, normal_init,
                          trunc_normal_init, uniform_init, xavier_init)
-from .misc import (empty_instances, filter_scores_and_topk, images_to_levels,
-                   multi_apply, select_single_mlvl, unmap, unpack_gt_instances)
-from .nms import batched_nms, multiclass_nms
+from .misc import (empty_instances, filter_mlvl_scores_and_topk,
+                   filter_scores_and_topk, images_to_levels, multi_apply,
+                   select_single_mlvl, unmap, unpack_gt_instances)
+from .nms import (batched_nms, multi_image_batched_nms,
+                  multi_image_multiclass_nms, multiclass_nms)
 from .transforms import bbox2roi
 
 __all__ = [
     'normal_init', 'constant_init', 'xavier_init', 'trunc_normal_init',
     'uniform_init', 'kaiming_init', 'caffe2_xavier_init',
     'bias_init_with_prob', 'unpack_gt_instances', 'empty_instances',
-    'select_single_mlvl', 'filter_scores_and_topk', 'batched_nms',
-    'multi_apply', 'unmap', 'images_to_levels', 'bbox2roi', 'multiclass_nms'
+    'select_single_mlvl', 'filter_scores_and_topk',
+    'filter_mlvl_scores_and_topk', 'batched_nms', 'multi_apply', 'unmap',
+    'images_to_levels', 'bbox2roi', 'multiclass_nms',
+    'multi_image_batched_nms', 'multi_image_multiclass_nms'
 ]
@@ -4,7 +4,9 @@ from functools import partial
 from typing import List
 
 import jittor as jt
+import numpy as np
 
+from jittordet.ops.topk import segmented_topk
 from jittordet.structures import InstanceData, OptInstanceList, SampleList
 
 
@@ -75,6 +77,20 @@ def select_single_mlvl(mlvl_tensors, batch_id, detach=True):
     return mlvl_tensor_list
 
 
+def _filter_results(results, keep_idxs):
+    if results is None:
+        return None
+    if isinstance(results, dict):
+        return {k: v[keep_idxs] for k, v in results.items()}
+    elif isinstance(results, list):
+        return [result[keep_idxs] for result in results]
+    elif isinstance(results, jt.Var):
+        return results[keep_idxs]
+    else:
+        raise NotImplementedError(f'Only supports dict or list or Tensor, '
+                                  f'but get {type(results)}.')
+
+
 def filter_scores_and_topk(scores, score_thr, topk, results=None):
     """Filter results using score threshold and topk candidates.
 
@@ -99,6 +115,10 @@ def filter_scores_and_topk(scores, score_thr, topk, results=None):
                 The filtered results. The shape of each item is \
                 (num_bboxes_filtered, N).
     """
+    if topk > 0:
+        return filter_mlvl_scores_and_topk([scores], score_thr, topk,
+                                           [results])[0]
+
     valid_mask = scores > score_thr
     scores = scores[valid_mask]
     valid_idxs = jt.nonzero(valid_mask)
@@ -109,20 +129,56 @@ def filter_scores_and_topk(scores, score_thr, topk, results=None):
     topk_idxs = valid_idxs[idxs[:num_topk]]
     keep_idxs, labels = topk_idxs.unbind(dim=1)
 
-    filtered_results = None
-    if results is not None:
-        if isinstance(results, dict):
-            filtered_results = {k: v[keep_idxs] for k, v in results.items()}
-        elif isinstance(results, list):
-            filtered_results = [result[keep_idxs] for result in results]
-        elif isinstance(results, jt.Var):
-            filtered_results = results[keep_idxs]
-        else:
-            raise NotImplementedError(f'Only supports dict or list or Tensor, '
-                                      f'but get {type(results)}.')
+    filtered_results = _filter_results(results, keep_idxs)
     return scores, labels, keep_idxs, filtered_results
 
 
+def filter_mlvl_scores_and_topk(mlvl_scores,
+                                score_thr,
+                                topk,
+                                mlvl_results=None):
+    """Filter results of several levels using score threshold and topk
+    candidates, the same as :func:`filter_scores_and_topk` on each level.
+
+    The topk candidates of all levels are selected by a single
+    :func:`segmented_topk`, which sorts the selected candidates only instead
+    of all scores.
+
+    Args:
+        mlvl_scores (list[Tensor]): The scores of each level, each has shape
+            (num_bboxes, K).
+        score_thr (float): The score filter threshold.
+        topk (int): The number of topk candidates of each level, which
+            should be positive.
+        mlvl_results (list, Optional): The results of each level to which
+            the filtering rule is to be applied, see
+            :func:`filter_scores_and_topk`.
+
+    Returns:
+        list[tuple]: Filtered results of each level, the same as the ones of
+        :func:`filter_scores_and_topk`.
+    """
+    assert topk > 0
+    if mlvl_results is None:
+        mlvl_results = [None] * len(mlvl_scores)
+    num_scores = [scores.numel() for scores in mlvl_scores]
+    offsets = np.concatenate([[0], np.cumsum(num_scores)])
+    topk_scores, topk_idxs = segmented_topk(
+        jt.concat([scores.reshape(-1) for scores in mlvl_scores]), offsets,
+        topk)
+    # candidates are sorted, so the valid ones come first
+    num_valid = (topk_scores > score_thr).sum(dim=1).numpy()
+
+    outputs = []
+    for i, (scores, results) in enumerate(zip(mlvl_scores, mlvl_results)):
+        idxs = topk_idxs[i, :int(num_valid[i])]
+        keep_idxs = idxs // scores.size(1)
+        labels = idxs % scores.size(1)
+        outputs.append((topk_scores[i, :int(num_valid[i])], labels, keep_idxs,
+                        _filter_results(results, keep_idxs)))
+    return outputs
+
+
 def multi_apply(func, *args, **kwargs):
     """Apply function to a list of arguments.
 
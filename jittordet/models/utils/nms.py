@@ -1,9 +1,113 @@
 # Modified from OpenMMLab mmcv/ops/nms.py
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import jittor as jt
+import numpy as np
 
 from jittordet.engine import ConfigType
+from jittordet.ops.nms import segmented_nms
+from jittordet.utils import bbox_overlaps
+
+
+def _sorted_iou_matrix(boxes, scores, idxs=None, nms_pre=-1):
+    """Sort boxes by scores in descending order and get the IoU matrix whose
+    (i, j) element is the IoU of the i-th and j-th boxes when i < j and they
+    have the same index, or 0 otherwise.
+
+    Only the top ``nms_pre`` boxes are kept if it is positive.
+    """
+    scores, order = scores.sort(descending=True)
+    if 0 < nms_pre < order.shape[0]:
+        scores, order = scores[:nms_pre], order[:nms_pre]
+    boxes = boxes[order]
+    ious = bbox_overlaps(boxes, boxes)
+    ranks = jt.arange(boxes.shape[0])
+    mask = ranks[:, None] < ranks[None, :]
+    if idxs is not None:
+        idxs = idxs[order]
+        mask = mask & (idxs[:, None] == idxs[None, :])
+    return ious * mask.astype(ious.dtype), scores, order
+
+
+def fast_nms(boxes: jt.Var,
+             scores: jt.Var,
+             idxs: Optional[jt.Var] = None,
+             thresh: float = 0.5,
+             nms_pre: int = -1) -> Tuple[jt.Var, jt.Var]:
+    """Fast NMS in `YOLACT <https://arxiv.org/abs/1904.02689>`_.
+
+    A box is suppressed if its IoU with any box of a higher score is larger
+    than ``thresh``, even if that box is suppressed itself. It removes a bit
+    more boxes than the greedy NMS, but all boxes are handled in parallel.
+
+    Args:
+        boxes (jt.Var): Boxes in shape (N, 4).
+        scores (jt.Var): Scores in shape (N, ).
+        idxs (jt.Var, optional): Boxes of different indices never suppress
+            each other. Defaults to None.
+        thresh (float): IoU threshold. Defaults to 0.5.
+        nms_pre (int): Only the top ``nms_pre`` boxes are handled to bound
+            the memory of the IoU matrix. Defaults to -1, i.e., all boxes.
+
+    Returns:
+        tuple: Indices and scores of kept boxes, sorted by scores in
+        descending order.
+    """
+    ious, scores, order = _sorted_iou_matrix(boxes, scores, idxs, nms_pre)
+    keep = jt.where(ious.max(dim=0) <= thresh)[0]
+    return order[keep], scores[keep]
+
+
+def matrix_nms(boxes: jt.Var,
+               scores: jt.Var,
+               idxs: Optional[jt.Var] = None,
+               kernel: str = 'gaussian',
+               sigma: float = 2.0,
+               filter_thr: float = -1,
+               nms_pre: int = -1) -> Tuple[jt.Var, jt.Var]:
+    """Matrix NMS in `SOLOv2 <https://arxiv.org/abs/2003.10152>`_ applied to
+    boxes.
+
+    Instead of removing boxes, the score of each box is decayed by its IoUs
+    with the boxes of higher scores, compensated by how much those boxes are
+    suppressed themselves. All boxes are handled in parallel.
+
+    Args:
+        boxes (jt.Var): Boxes in shape (N, 4).
+        scores (jt.Var): Scores in shape (N, ).
+        idxs (jt.Var, optional): Boxes of different indices never decay
+            each other. Defaults to None.
+        kernel (str): ``gaussian`` or ``linear`` decay. Defaults to
+            ``gaussian``.
+        sigma (float): Std of the gaussian decay. Defaults to 2.0.
+        filter_thr (float): Boxes whose decayed scores are lower than it are
+            removed. Defaults to -1, i.e., boxes are all kept.
+        nms_pre (int): Only the top ``nms_pre`` boxes are handled to bound
+            the memory of the IoU matrix. Defaults to -1, i.e., all boxes.
+
+    Returns:
+        tuple: Indices and decayed scores of kept boxes, sorted by decayed
+        scores in descending order.
+    """
+    ious, scores, order = _sorted_iou_matrix(boxes, scores, idxs, nms_pre)
+    # the max IoU of each box with the boxes of higher scores
+    compensate_ious = ious.max(dim=0)[:, None]
+    if kernel == 'gaussian':
+        decay = (-sigma * (ious**2 - compensate_ious**2)).exp()
+    elif kernel == 'linear':
+        decay = (1 - ious) / (1 - compensate_ious)
+    else:
+        raise NotImplementedError(
+            f'{kernel} kernel is not supported in matrix nms!')
+    scores = scores * decay.min(dim=0)
+    if filter_thr > 0:
+        keep = jt.where(scores >= filter_thr)[0]
+        scores, order = scores[keep], order[keep]
+    scores, inds = scores.sort(descending=True)
+    return order[inds], scores
+
+
+MATRIX_NMS_FUNCS = dict(fast_nms=fast_nms, matrix_nms=matrix_nms)
 
 
 def batched_nms(boxes: jt.Var,
@@ -34,6 +138,10 @@ def batched_nms(boxes: jt.Var,
             is None, otherwise it should specify nms type and other
             parameters like `iou_thr`. Possible keys includes the following.
 
+            - type (str): ``nms`` (default), ``fast_nms`` or ``matrix_nms``.
+              The latter two suppress boxes in parallel with the IoU matrix
+              of boxes, see :func:`fast_nms` and :func:`matrix_nms` for
+              their arguments.
             - iou_threshold (float): IoU threshold used for NMS.
             - split_thr (float): threshold number of boxes. In some cases the
               number of boxes is large (e.g., 200k). To avoid OOM during
@@ -62,6 +170,13 @@ def batched_nms(boxes: jt.Var,
 
     nms_cfg_ = nms_cfg.copy()
     class_agnostic = nms_cfg_.pop('class_agnostic', class_agnostic)
+    nms_type = nms_cfg_.pop('type', 'nms')
+    if nms_type in MATRIX_NMS_FUNCS:
+        assert boxes.size(-1) == 4, f'{nms_type} only supports 4-d boxes'
+        keep, scores = MATRIX_NMS_FUNCS[nms_type](
+            boxes, scores, None if class_agnostic else idxs, **nms_cfg_)
+        return boxes[keep], scores, keep
+
     if class_agnostic:
         boxes_for_nms = boxes
     else:
@@ -84,8 +199,6 @@ def batched_nms(boxes: jt.Var,
             offsets = idxs.astype(boxes.dtype) * (max_coordinate + 1)
             boxes_for_nms = boxes + offsets[:, None]
 
-    # only support jt.nms for now
-    nms_cfg_.pop('type', 'nms')
     dets = jt.concat([boxes_for_nms, scores[:, None]], dim=1)
     keep = jt.nms(dets, **nms_cfg_)
     boxes = boxes[keep]
@@ -93,6 +206,45 @@ def batched_nms(boxes: jt.Var,
     return boxes, scores, keep
 
 
+def _multiclass_candidates(multi_bboxes,
+                           multi_scores,
+                           score_thr,
+                           score_factors=None):
+    """Flatten the bboxes of all classes and keep the ones whose scores are
+    higher than ``score_thr``, the same as :func:`multiclass_nms`."""
+    num_classes = multi_scores.size(1) - 1
+    # exclude background category
+    if multi_bboxes.shape[1] > 4:
+        bboxes = multi_bboxes.view(multi_scores.size(0), -1, 4)
+    else:
+        bboxes = multi_bboxes[:, None].expand(
+            multi_scores.size(0), num_classes, 4)
+
+    scores = multi_scores[:, :-1]
+
+    labels = jt.arange(num_classes, dtype=jt.int64)
+    labels = labels.view(1, -1).expand_as(scores)
+
+    bboxes = bboxes.reshape(-1, 4)
+    scores = scores.reshape(-1)
+    labels = labels.reshape(-1)
+    valid_mask = scores > score_thr
+    # multiply score_factor after threshold to preserve more bboxes, improve
+    # mAP by 1% for YOLOv3
+    if score_factors is not None:
+        # expand the shape to match original shape of score
+        score_factors = score_factors.view(-1, 1).expand(
+            multi_scores.size(0), num_classes)
+        score_factors = score_factors.reshape(-1)
+        scores = scores * score_factors
+
+    # NonZero not supported  in TensorRT
+    inds = valid_mask.nonzero().squeeze(1)
+    bboxes, scores, labels = bboxes[inds], scores[inds], labels[inds]
+
+    return bboxes, scores, labels, inds
+
+
 def multiclass_nms(multi_bboxes: jt.Var,
                    multi_scores: jt.Var,
                    score_thr: float,
@@ -123,35 +275,8 @@ def multiclass_nms(multi_bboxes: jt.Var,
             (dets, labels, indices (optional)), tensors of shape (k, 5),
             (k), and (k). Dets are boxes with scores. Labels are 0-based.
     """
-    num_classes = multi_scores.size(1) - 1
-    # exclude background category
-    if multi_bboxes.shape[1] > 4:
-        bboxes = multi_bboxes.view(multi_scores.size(0), -1, 4)
-    else:
-        bboxes = multi_bboxes[:, None].expand(
-            multi_scores.size(0), num_classes, 4)
-
-    scores = multi_scores[:, :-1]
-
-    labels = jt.arange(num_classes, dtype=jt.int64)
-    labels = labels.view(1, -1).expand_as(scores)
-
-    bboxes = bboxes.reshape(-1, 4)
-    scores = scores.reshape(-1)
-    labels = labels.reshape(-1)
-    valid_mask = scores > score_thr
-    # multiply score_factor after threshold to preserve more bboxes, improve
-    # mAP by 1% for YOLOv3
-    if score_factors is not None:
-        # expand the shape to match original shape of score
-        score_factors = score_factors.view(-1, 1).expand(
-            multi_scores.size(0), num_classes)
-        score_factors = score_factors.reshape(-1)
-        scores = scores * score_factors
-
-    # NonZero not supported  in TensorRT
-    inds = valid_mask.nonzero().squeeze(1)
-    bboxes, scores, labels = bboxes[inds], scores[inds], labels[inds]
+    bboxes, scores, labels, inds = _multiclass_candidates(
+        multi_bboxes, multi_scores, score_thr, score_factors)
 
     if bboxes.numel() == 0:
         if return_inds:
@@ -170,3 +295,114 @@ def multiclass_nms(multi_bboxes: jt.Var,
         return bboxes, scores, labels[keep], inds[keep]
     else:
         return bboxes, scores, labels[keep]
+
+
+def multi_image_batched_nms(
+        boxes_list: List[jt.Var],
+        scores_list: List[jt.Var],
+        idxs_list: List[jt.Var],
+        nms_cfg: Optional[Dict],
+        class_agnostic: bool = False) -> List[Tuple[jt.Var, jt.Var, jt.Var]]:
+    """Performs :func:`batched_nms` on the boxes of several images in one
+    call.
+
+    The image index is folded into the cluster index of boxes, so boxes of
+    different images or clusters never suppress each other, and the boxes of
+    all images are suppressed by a single :func:`segmented_nms` launch
+    instead of a NMS launch and a sync per image. Rotated boxes and
+    ``nms_cfg=None`` fall back to :func:`batched_nms` of each image, and so
+    do ``fast_nms`` and ``matrix_nms``.
+
+    Args:
+        boxes_list (list[jt.Var]): Boxes of each image in shape (N_i, 4).
+        scores_list (list[jt.Var]): Scores of each image in shape (N_i, ).
+        idxs_list (list[jt.Var]): Cluster indices of boxes of each image in
+            shape (N_i, ).
+        nms_cfg (dict | optional): The same as :func:`batched_nms`.
+        class_agnostic (bool): The same as :func:`batched_nms`.
+
+    Returns:
+        list[tuple]: (boxes, scores, keep) of each image, the same as the
+        results of :func:`batched_nms`. ``keep`` indexes the boxes of its
+        own image.
+    """
+    # the IoU matrices of fast_nms and matrix_nms grow quadratically with the
+    # number of boxes, so they are applied to each image separately
+    if nms_cfg is None or nms_cfg.get('type', 'nms') in MATRIX_NMS_FUNCS or \
+            any(boxes.size(-1) != 4 for boxes in boxes_list):
+        return [
+            batched_nms(boxes, scores, idxs, nms_cfg, class_agnostic)
+            if boxes.shape[0] > 0 else
+            (boxes, scores, jt.zeros((0, ), dtype=jt.int64))
+            for boxes, scores, idxs in zip(boxes_list, scores_list, idxs_list)
+        ]
+
+    nms_cfg_ = nms_cfg.copy()
+    class_agnostic = nms_cfg_.pop('class_agnostic', class_agnostic)
+    nms_cfg_.pop('type', 'nms')
+
+    num_boxes = np.array([boxes.shape[0] for boxes in boxes_list])
+    img_inds = np.nonzero(num_boxes)[0]
+    img_ids = np.repeat(np.arange(len(boxes_list)), num_boxes)
+    if img_ids.size > 0:
+        boxes = jt.concat([boxes_list[i] for i in img_inds])
+        scores = jt.concat([scores_list[i] for i in img_inds])
+        groups = jt.array(img_ids)
+        if not class_agnostic:
+            idxs = jt.concat([idxs_list[i] for i in img_inds]).int64()
+            groups = groups * (idxs.max() + 1) + idxs
+        keep = segmented_nms(boxes, scores, groups, **nms_cfg_).numpy()
+    else:
+        keep = np.zeros(0, dtype=np.int64)
+
+    # kept boxes are sorted by scores, so are the ones of each image
+    keep_img_ids = img_ids[keep]
+    offsets = np.cumsum(num_boxes) - num_boxes
+    results = []
+    for i, (boxes, scores) in enumerate(zip(boxes_list, scores_list)):
+        img_keep = jt.array(keep[keep_img_ids == i] - offsets[i])
+        results.append((boxes[img_keep], scores[img_keep], img_keep))
+    return results
+
+
+def multi_image_multiclass_nms(multi_bboxes_list: List[jt.Var],
+                               multi_scores_list: List[jt.Var],
+                               score_thr: float,
+                               nms_cfg: ConfigType,
+                               max_num: int = -1):
+    """Performs :func:`multiclass_nms` on the bboxes of several images with
+    :func:`multi_image_batched_nms`.
+
+    Args:
+        multi_bboxes_list (list[jt.Var]): Bboxes of each image in shape
+            (n, #class*4) or (n, 4).
+        multi_scores_list (list[jt.Var]): Scores of each image in shape
+            (n, #class), where the last column contains scores of the
+            background class, but this will be ignored.
+        score_thr (float): bbox threshold, bboxes with scores lower than it
+            will not be considered.
+        nms_cfg (Union[:obj:`ConfigDict`, dict]): a dict that contains
+            the arguments of nms operations.
+        max_num (int, optional): if there are more than max_num bboxes of an
+            image after NMS, only top max_num will be kept. Default to -1.
+
+    Returns:
+        list[tuple]: (dets, scores, labels) of each image, the same as the
+        results of :func:`multiclass_nms`.
+    """
+    candidates = [
+        _multiclass_candidates(multi_bboxes, multi_scores, score_thr) for
+        multi_bboxes, multi_scores in zip(multi_bboxes_list, multi_scores_list)
+    ]
+    nms_results = multi_image_batched_nms([c[0] for c in candidates],
+                                          [c[1] for c in candidates],
+                                          [c[2] for c in candidates], nms_cfg)
+    results = []
+    for (_, _, labels, _), (bboxes, scores,
+                            keep) in zip(candidates, nms_results):
+        if max_num > 0:
+            bboxes = bboxes[:max_num]
+            scores = scores[:max_num]
+            keep = keep[:max_num]
+        results.append((bboxes, scores, labels[keep]))
+    return results
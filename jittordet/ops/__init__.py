@@ -1,4 +1,10 @@
-from .roi_align import ROIAlign, roi_align
+from .preprocess import normalize_pad_stack, normalize_pad_stack_packed
+from .roi_align import ROIAlign, multi_level_roi_align, roi_align
 from .roi_pool import ROIPool, roi_pool
+from .topk import segmented_topk, topk
 
-__all__ = ['ROIAlign', 'roi_align', 'ROIPool', 'roi_pool']
+__all__ = [
+    'ROIAlign', 'roi_align', 'multi_level_roi_align', 'ROIPool', 'roi_pool',
+    'normalize_pad_stack', 'normalize_pad_stack_packed', 'segmented_topk',
+    'topk'
+]
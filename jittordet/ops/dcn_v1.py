@@ -4,27 +4,11 @@ import jittor as jt
 from jittor import nn
 from jittor.misc import _pair
 
-HEADER = r'''
-#undef out
-#include<executor.h>
-#include <stdio.h>
-#include <math.h>
-#include <float.h>
-
-#define CUDA_KERNEL_LOOP(i, n)                                 \
-  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < (n); \
-       i += blockDim.x * gridDim.x)
-
-const int CUDA_NUM_THREADS = 1024;
-const int kMaxGridNum = 65535;
-
-inline int GET_BLOCKS(const int N)
-{
-  return std::min(kMaxGridNum, (N + CUDA_NUM_THREADS - 1) / CUDA_NUM_THREADS);
-}
-
+# The kernels are shared by cuda and cpu. On cpu, the kernel loop is an
+# OpenMP loop and the scattered gradients are added atomically.
+KERNELS = r'''
 template <typename scalar_t>
-__device__ scalar_t deformable_im2col_bilinear(const scalar_t *bottom_data, const int data_width,
+HOST_DEVICE scalar_t deformable_im2col_bilinear(const scalar_t *bottom_data, const int data_width,
                                                const int height, const int width, scalar_t h, scalar_t w)
 {
 
@@ -57,7 +41,7 @@ __device__ scalar_t deformable_im2col_bilinear(const scalar_t *bottom_data, cons
 }
 
 template <typename scalar_t>
-__device__ scalar_t get_gradient_weight(scalar_t argmax_h, scalar_t argmax_w,
+HOST_DEVICE scalar_t get_gradient_weight(scalar_t argmax_h, scalar_t argmax_w,
                                         const int h, const int w, const int height, const int width)
 {
 
@@ -85,7 +69,7 @@ __device__ scalar_t get_gradient_weight(scalar_t argmax_h, scalar_t argmax_w,
 }
 
 template <typename scalar_t>
-__device__ scalar_t get_coordinate_weight(scalar_t argmax_h, scalar_t argmax_w,
+HOST_DEVICE scalar_t get_coordinate_weight(scalar_t argmax_h, scalar_t argmax_w,
                                           const int height, const int width, const scalar_t *im_data,
                                           const int data_width, const int bp_dir)
 {
@@ -130,7 +114,7 @@ __device__ scalar_t get_coordinate_weight(scalar_t argmax_h, scalar_t argmax_w,
 }
 
 template <typename scalar_t>
-__global__ void deformable_im2col_gpu_kernel(const int n, const scalar_t *data_im, const scalar_t *data_offset,
+KERNEL void deformable_im2col_kernel(const int n, const scalar_t *data_im, const scalar_t *data_offset,
                                              const int height, const int width, const int kernel_h, const int kernel_w,
                                              const int pad_h, const int pad_w, const int stride_h, const int stride_w,
                                              const int dilation_h, const int dilation_w, const int channel_per_deformable_group,
@@ -184,7 +168,7 @@ __global__ void deformable_im2col_gpu_kernel(const int n, const scalar_t *data_i
   }
 }
 template <typename scalar_t>
-__global__ void deformable_col2im_gpu_kernel(
+KERNEL void deformable_col2im_kernel(
     const int n, const scalar_t *data_col, const scalar_t *data_offset,
     const int channels, const int height, const int width,
     const int kernel_h, const int kernel_w,
@@ -234,7 +218,7 @@ __global__ void deformable_col2im_gpu_kernel(
         {
           int cur_bottom_grad_pos = ((b * channels + c) * height + cur_h + dy) * width + cur_w + dx;
           scalar_t weight = get_gradient_weight(cur_inv_h_data, cur_inv_w_data, cur_h + dy, cur_w + dx, height, width);
-          atomicAdd(grad_im + cur_bottom_grad_pos, weight * cur_top_grad);
+          ATOMIC_ADD(grad_im + cur_bottom_grad_pos, weight * cur_top_grad);
         }
       }
     }
@@ -242,7 +226,7 @@ __global__ void deformable_col2im_gpu_kernel(
 }
 
 template <typename scalar_t>
-__global__ void deformable_col2im_coord_gpu_kernel(const int n, const scalar_t *data_col,
+KERNEL void deformable_col2im_coord_kernel(const int n, const scalar_t *data_col,
                                                    const scalar_t *data_im, const scalar_t *data_offset,
                                                    const int channels, const int height, const int width,
                                                    const int kernel_h, const int kernel_w,
@@ -305,9 +289,55 @@ __global__ void deformable_col2im_coord_gpu_kernel(const int n, const scalar_t *
     grad_offset[index] = val;
   }
 }
-
 '''
 
+CUDA_HEADER = r'''
+#undef out
+#include<executor.h>
+#include <stdio.h>
+#include <math.h>
+#include <float.h>
+
+#define CUDA_KERNEL_LOOP(i, n)                                 \
+  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < (n); \
+       i += blockDim.x * gridDim.x)
+#define HOST_DEVICE __device__
+#define KERNEL __global__
+#define ATOMIC_ADD atomicAdd
+
+const int CUDA_NUM_THREADS = 1024;
+const int kMaxGridNum = 65535;
+
+inline int GET_BLOCKS(const int N)
+{
+  return std::min(kMaxGridNum, (N + CUDA_NUM_THREADS - 1) / CUDA_NUM_THREADS);
+}
+
+''' + KERNELS
+
+CPU_HEADER = r'''
+#undef out
+#include <stdio.h>
+#include <string.h>
+#include <math.h>
+#include <float.h>
+#include <algorithm>
+
+#define CUDA_KERNEL_LOOP(i, n) \
+  _Pragma("omp parallel for") for (int i = 0; i < (n); i++)
+#define HOST_DEVICE inline
+#define KERNEL
+#define ATOMIC_ADD atomic_add
+
+template <typename scalar_t>
+inline void atomic_add(scalar_t *address, scalar_t val)
+{
+  #pragma omp atomic
+  *address += val;
+}
+
+''' + KERNELS
+
 
 def deformable_im2col(data_im, data_offset, channels, height, width, ksize_h,
                       ksize_w, pad_h, pad_w, stride_h, stride_w, dilation_h,
@@ -331,8 +361,19 @@ def deformable_im2col(data_im, data_offset, channels, height, width, ksize_h,
     int width_col = (width + 2 * pad_w - (dilation_w * (ksize_w - 1) + 1)) / stride_w + 1;
     int num_kernels = channels * height_col * width_col * parallel_imgs;
     int channel_per_deformable_group = channels / deformable_group;
+    """
+    cuda_src = src + """
     cudaMemsetAsync(out0_p,0,out0->size);
-    deformable_im2col_gpu_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+    deformable_im2col_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+            num_kernels, in0_p, in1_p, height, width, ksize_h, ksize_w,
+            pad_h, pad_w, stride_h, stride_w, dilation_h, dilation_w,
+            channel_per_deformable_group, parallel_imgs, channels, deformable_group,
+            height_col, width_col, out0_p);
+
+    """
+    cpu_src = src + """
+    memset(out0_p,0,out0->size);
+    deformable_im2col_kernel(
             num_kernels, in0_p, in1_p, height, width, ksize_h, ksize_w,
             pad_h, pad_w, stride_h, stride_w, dilation_h, dilation_w,
             channel_per_deformable_group, parallel_imgs, channels, deformable_group,
@@ -343,8 +384,10 @@ def deformable_im2col(data_im, data_offset, channels, height, width, ksize_h,
         columns_shape,
         data_im.dtype,
         inputs=[data_im, data_offset],
-        cuda_header=HEADER,
-        cuda_src=src)
+        cpu_header=CPU_HEADER,
+        cpu_src=cpu_src,
+        cuda_header=CUDA_HEADER,
+        cuda_src=cuda_src)
 
 
 def deformable_col2im_coord(data_col, data_im, data_offset, channels, height,
@@ -369,8 +412,19 @@ def deformable_col2im_coord(data_col, data_im, data_offset, channels, height,
     int num_kernels = height_col * width_col * 2 * ksize_h * ksize_w * deformable_group * parallel_imgs;
     int channel_per_deformable_group = channels * ksize_h * ksize_w / deformable_group;
 
+    """
+    cuda_src = src + """
     cudaMemsetAsync(out0_p,0,out0->size);
-    deformable_col2im_coord_gpu_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+    deformable_col2im_coord_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+    num_kernels, in0_p, in1_p, in2_p, channels, height, width,
+    ksize_h, ksize_w, pad_h, pad_w, stride_h, stride_w,
+    dilation_h, dilation_w, channel_per_deformable_group,
+    parallel_imgs, 2 * ksize_h * ksize_w * deformable_group, deformable_group,
+    height_col, width_col, out0_p);
+    """
+    cpu_src = src + """
+    memset(out0_p,0,out0->size);
+    deformable_col2im_coord_kernel(
     num_kernels, in0_p, in1_p, in2_p, channels, height, width,
     ksize_h, ksize_w, pad_h, pad_w, stride_h, stride_w,
     dilation_h, dilation_w, channel_per_deformable_group,
@@ -380,8 +434,10 @@ def deformable_col2im_coord(data_col, data_im, data_offset, channels, height,
     return jt.code(
         grad_offset_shape,
         data_offset.dtype, [data_col, data_im, data_offset],
-        cuda_header=HEADER,
-        cuda_src=src)
+        cpu_header=CPU_HEADER,
+        cpu_src=cpu_src,
+        cuda_header=CUDA_HEADER,
+        cuda_src=cuda_src)
 
 
 def deformable_col2im(data_col, data_offset, channels, height, width, ksize_h,
@@ -407,8 +463,18 @@ def deformable_col2im(data_col, data_offset, channels, height, width, ksize_h,
     int num_kernels = channels * ksize_h * ksize_w * height_col * width_col * parallel_imgs;
     int channel_per_deformable_group = channels / deformable_group;
 
+    """
+    cuda_src = src + """
     cudaMemsetAsync(out0_p,0,out0->size);
-    deformable_col2im_gpu_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+    deformable_col2im_kernel<<<GET_BLOCKS(num_kernels), CUDA_NUM_THREADS>>>(
+            num_kernels, in0_p, in1_p, channels, height, width, ksize_h,
+            ksize_w, pad_h, pad_w, stride_h, stride_w,
+            dilation_h, dilation_w, channel_per_deformable_group,
+            parallel_imgs, deformable_group, height_col, width_col, out0_p,whole_size);
+    """
+    cpu_src = src + """
+    memset(out0_p,0,out0->size);
+    deformable_col2im_kernel(
             num_kernels, in0_p, in1_p, channels, height, width, ksize_h,
             ksize_w, pad_h, pad_w, stride_h, stride_w,
             dilation_h, dilation_w, channel_per_deformable_group,
@@ -417,13 +483,15 @@ def deformable_col2im(data_col, data_offset, channels, height, width, ksize_h,
     return jt.code(
         grad_im_shape,
         data_col.dtype, [data_col, data_offset],
-        cuda_header=HEADER,
-        cuda_src=src)
+        cpu_header=CPU_HEADER,
+        cpu_src=cpu_src,
+        cuda_header=CUDA_HEADER,
+        cuda_src=cuda_src)
 
 
-def deform_conv_forward_cuda(input, weight, offset, kW, kH, dW, dH, padW, padH,
-                             dilationW, dilationH, group, deformable_group,
-                             im2col_step):
+def deform_conv_forward(input, weight, offset, kW, kH, dW, dH, padW, padH,
+                        dilationW, dilationH, group, deformable_group,
+                        im2col_step):
 
     batchSize, nInputPlane, inputHeight, inputWidth = input.shape
 
@@ -453,6 +521,8 @@ def deform_conv_forward_cuda(input, weight, offset, kW, kH, dW, dH, padW, padH,
         (output_buffer.size(0), group, output_buffer.size(1) // group,
          output_buffer.size(2), output_buffer.size(3)))
 
+    weight = weight.view((group, weight.size(0) // group, weight.size(1),
+                          weight.size(2), weight.size(3)))
     for elt in range(batchSize // im2col_step):
         columns = deformable_im2col(input[elt], offset[elt], nInputPlane,
                                     inputHeight, inputWidth, kH, kW, padH,
@@ -462,8 +532,6 @@ def deform_conv_forward_cuda(input, weight, offset, kW, kH, dW, dH, padW, padH,
 
         columns = columns.view(
             (group, columns.size(0) // group, columns.size(1)))
-        weight = weight.view((group, weight.size(0) // group, weight.size(1),
-                              weight.size(2), weight.size(3)))
 
         for g in range(group):
             output_buffer[elt, g] = (
@@ -484,9 +552,9 @@ def deform_conv_forward_cuda(input, weight, offset, kW, kH, dW, dH, padW, padH,
     return output
 
 
-def deform_conv_backward_input_cuda(input, offset, gradOutput, weight, kW, kH,
-                                    dW, dH, padW, padH, dilationW, dilationH,
-                                    group, deformable_group, im2col_step):
+def deform_conv_backward_input(input, offset, gradOutput, weight, kW, kH, dW,
+                               dH, padW, padH, dilationW, dilationH, group,
+                               deformable_group, im2col_step):
 
     batchSize, nInputPlane, inputHeight, inputWidth = input.shape
     nOutputPlane = weight.size(0)
@@ -518,11 +586,11 @@ def deform_conv_backward_input_cuda(input, offset, gradOutput, weight, kW, kH,
         (batchSize // im2col_step, im2col_step, deformable_group * 2 * kH * kW,
          outputHeight, outputWidth))
 
+    weight = weight.view((group, weight.size(0) // group, weight.size(1),
+                          weight.size(2), weight.size(3)))
     for elt in range(batchSize // im2col_step):
         columns = columns.view(
             (group, columns.size(0) // group, columns.size(1)))
-        weight = weight.view((group, weight.size(0) // group, weight.size(1),
-                              weight.size(2), weight.size(3)))
         gradOutput = gradOutput.view(
             (gradOutput.size(0), group, gradOutput.size(1) // group,
              gradOutput.size(2), gradOutput.size(3), gradOutput.size(4)))
@@ -555,10 +623,10 @@ def deform_conv_backward_input_cuda(input, offset, gradOutput, weight, kW, kH,
     return gradInput, gradOffset
 
 
-def deform_conv_backward_parameters_cuda(input, offset, gradOutput, gradWeight,
-                                         kW, kH, dW, dH, padW, padH, dilationW,
-                                         dilationH, group, deformable_group,
-                                         scale, im2col_step):
+def deform_conv_backward_parameters(input, offset, gradOutput, gradWeight, kW,
+                                    kH, dW, dH, padW, padH, dilationW,
+                                    dilationH, group, deformable_group, scale,
+                                    im2col_step):
 
     batchSize, nInputPlane, inputHeight, inputWidth = input.shape
     nOutputPlane = gradWeight.size(0)
@@ -660,18 +728,16 @@ class DeformConvFunction(jt.Function):
                                                        self.dilation,
                                                        self.stride)
 
-        if not jt.flags.use_cuda:
-            raise NotImplementedError
-        else:
-            cur_im2col_step = min(self.im2col_step, input.shape[0])
-            assert (input.shape[0] %
-                    cur_im2col_step) == 0, 'im2col step must divide batchsize'
-            output = deform_conv_forward_cuda(
-                input, weight, offset, weight.size(3), weight.size(2),
-                self.stride[1], self.stride[0], self.padding[1],
-                self.padding[0], self.dilation[1], self.dilation[0],
-                self.groups, self.deformable_groups, cur_im2col_step)
-            assert output.shape == output_shape
+        cur_im2col_step = min(self.im2col_step, input.shape[0])
+        assert (input.shape[0] %
+                cur_im2col_step) == 0, 'im2col step must divide batchsize'
+        output = deform_conv_forward(input, weight, offset, weight.size(3),
+                                     weight.size(2), self.stride[1],
+                                     self.stride[0], self.padding[1],
+                                     self.padding[0], self.dilation[1],
+                                     self.dilation[0], self.groups,
+                                     self.deformable_groups, cur_im2col_step)
+        assert output.shape == output_shape
         return output
 
     def grad(self, grad_output):
@@ -679,29 +745,22 @@ class DeformConvFunction(jt.Function):
 
         grad_input = grad_offset = grad_weight = None
 
-        if not jt.flags.use_cuda:
-            raise NotImplementedError
-        else:
-            cur_im2col_step = min(self.im2col_step, input.shape[0])
-            assert (input.shape[0] %
-                    cur_im2col_step) == 0, 'im2col step must divide batchsize'
-
-            grad_input, grad_offset = deform_conv_backward_input_cuda(
-                input, offset, grad_output, weight, weight.size(3),
-                weight.size(2), self.stride[1], self.stride[0],
-                self.padding[1], self.padding[0], self.dilation[1],
-                self.dilation[0], self.groups, self.deformable_groups,
-                cur_im2col_step)
-
-            # print(grad_output.sum(),grad_input.sum(),grad_offset.sum())
-
-            grad_weight = jt.zeros_like(weight)
-            grad_weight = deform_conv_backward_parameters_cuda(
-                input, offset, grad_output, grad_weight, weight.size(3),
-                weight.size(2), self.stride[1], self.stride[0],
-                self.padding[1], self.padding[0], self.dilation[1],
-                self.dilation[0], self.groups, self.deformable_groups, 1,
-                cur_im2col_step)
+        cur_im2col_step = min(self.im2col_step, input.shape[0])
+        assert (input.shape[0] %
+                cur_im2col_step) == 0, 'im2col step must divide batchsize'
+
+        grad_input, grad_offset = deform_conv_backward_input(
+            input, offset, grad_output, weight, weight.size(3), weight.size(2),
+            self.stride[1], self.stride[0], self.padding[1], self.padding[0],
+            self.dilation[1], self.dilation[0], self.groups,
+            self.deformable_groups, cur_im2col_step)
+
+        grad_weight = jt.zeros_like(weight)
+        grad_weight = deform_conv_backward_parameters(
+            input, offset, grad_output, grad_weight, weight.size(3),
+            weight.size(2), self.stride[1], self.stride[0], self.padding[1],
+            self.padding[0], self.dilation[1], self.dilation[0], self.groups,
+            self.deformable_groups, 1, cur_im2col_step)
 
         return grad_input, grad_offset, grad_weight
 
@@ -1,22 +1,13 @@
 import jittor as jt
-from jdet.models.utils.weight_init import normal_init
 from jittor import nn
 
-HEADER = r"""
-#define CUDA_1D_KERNEL_LOOP(i, n)                            \
-  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; \
-       i += blockDim.x * gridDim.x)
-
-#define THREADS_PER_BLOCK 1024
-
-inline int GET_BLOCKS(const int N) {
-    int optimal_block_num = (N + THREADS_PER_BLOCK - 1) / THREADS_PER_BLOCK;
-    int max_block_num = 65000;
-    return std::min(optimal_block_num, max_block_num);
-}
+from jittordet.models.utils import normal_init
 
+# The kernel bodies are shared by the cuda kernels and the cpu loops, so both
+# devices compute the same formulas.
+HELPERS = r"""
 template <typename scalar_t>
-__device__ scalar_t bilinear_interpolate(const scalar_t* bottom_data,
+HOST_DEVICE scalar_t bilinear_interpolate(const scalar_t* bottom_data,
     const int height, const int width,
     scalar_t y, scalar_t x) {
     // deal with cases that inverse elements are out of feature map boundary
@@ -67,7 +58,7 @@ __device__ scalar_t bilinear_interpolate(const scalar_t* bottom_data,
 }
 
 template <typename scalar_t>
-__device__ void bilinear_interpolate_gradient(const int height, const int width,
+HOST_DEVICE void bilinear_interpolate_gradient(const int height, const int width,
     scalar_t y, scalar_t x,
     scalar_t& w1, scalar_t& w2,
     scalar_t& w3, scalar_t& w4,
@@ -111,15 +102,9 @@ __device__ void bilinear_interpolate_gradient(const int height, const int width,
     w1 = hy * hx, w2 = hy * lx, w3 = ly * hx, w4 = ly * lx;
 }
 
-template <typename scalar_t>
-__global__ void feature_refine_forward_kernel(
-    const int nthreads,
-    const int points,
-    const scalar_t* bottom_data,
-    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
-    const float spatial_scale, const int channels, const int height,
-    const int width, scalar_t* top_data) {
-    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+"""
+
+FORWARD_BODY = r"""
         // (n, c, h, w) is an element in the aligned output
         int w = index % width;
         int h = (index / width) % height;
@@ -161,18 +146,9 @@ __global__ void feature_refine_forward_kernel(
                 width, py[i], px[i]);
         }
         top_data[index] = output_val;
-    }
-}
+"""
 
-template <typename scalar_t>
-__global__ void feature_refine_backward_kernel(
-    const int nthreads,
-    const int points,
-    const scalar_t* top_diff,
-    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
-    const float spatial_scale, const int channels, const int height,
-    const int width, scalar_t* bottom_diff) {
-    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+BACKWARD_BODY = r"""
         // (n, c, h, w) is an element in the input diff
         int w = index % width;
         int h = (index / width) % height;
@@ -209,7 +185,7 @@ __global__ void feature_refine_backward_kernel(
             bottom_diff + (n * channels + c) * height * width;
         scalar_t value_top_diff = top_diff[index];
 
-        atomicAdd(bottom_diff + index, value_top_diff);
+        ATOMIC_ADD(bottom_diff + index, value_top_diff);
         for (int i = 0; i < points; i++) {
             scalar_t w1, w2, w3, w4;
             int x_low, x_high, y_low, y_high;
@@ -222,13 +198,92 @@ __global__ void feature_refine_backward_kernel(
             scalar_t g3 = value_top_diff * w3;
             scalar_t g4 = value_top_diff * w4;
             if (x_low >= 0 && x_high >= 0 && y_low >= 0 && y_high >= 0) {
-                atomicAdd(offset_bottom_diff + y_low * width + x_low, g1);
-                atomicAdd(offset_bottom_diff + y_low * width + x_high, g2);
-                atomicAdd(offset_bottom_diff + y_high * width + x_low, g3);
-                atomicAdd(offset_bottom_diff + y_high * width + x_high, g4);
+                ATOMIC_ADD(offset_bottom_diff + y_low * width + x_low, g1);
+                ATOMIC_ADD(offset_bottom_diff + y_low * width + x_high, g2);
+                ATOMIC_ADD(offset_bottom_diff + y_high * width + x_low, g3);
+                ATOMIC_ADD(offset_bottom_diff + y_high * width + x_high, g4);
             }
         }
-    }
+"""
+
+CUDA_HEADER = r"""
+#define CUDA_1D_KERNEL_LOOP(i, n)                            \
+  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; \
+       i += blockDim.x * gridDim.x)
+
+#define THREADS_PER_BLOCK 1024
+
+inline int GET_BLOCKS(const int N) {
+    int optimal_block_num = (N + THREADS_PER_BLOCK - 1) / THREADS_PER_BLOCK;
+    int max_block_num = 65000;
+    return std::min(optimal_block_num, max_block_num);
+}
+
+#define HOST_DEVICE __device__
+#define ATOMIC_ADD atomicAdd
+""" + HELPERS + r"""
+template <typename scalar_t>
+__global__ void feature_refine_forward_kernel(
+    const int nthreads,
+    const int points,
+    const scalar_t* bottom_data,
+    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
+    const float spatial_scale, const int channels, const int height,
+    const int width, scalar_t* top_data) {
+    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+""" + FORWARD_BODY + r"""    }
+}
+
+template <typename scalar_t>
+__global__ void feature_refine_backward_kernel(
+    const int nthreads,
+    const int points,
+    const scalar_t* top_diff,
+    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
+    const float spatial_scale, const int channels, const int height,
+    const int width, scalar_t* bottom_diff) {
+    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+""" + BACKWARD_BODY + r"""    }
+}
+"""
+
+CPU_HEADER = r"""
+#include <cmath>
+#include <cstring>
+#include <algorithm>
+
+#define HOST_DEVICE inline
+#define ATOMIC_ADD(addr, val) (*(addr) += (val))
+""" + HELPERS + r"""
+template <typename scalar_t>
+void feature_refine_forward_kernel(
+    const int nthreads,
+    const int points,
+    const scalar_t* bottom_data,
+    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
+    const float spatial_scale, const int channels, const int height,
+    const int width, scalar_t* top_data) {
+    #pragma omp parallel for
+    for (int index = 0; index < nthreads; index++) {
+""" + FORWARD_BODY + r"""    }
+}
+
+template <typename scalar_t>
+void feature_refine_backward_kernel(
+    const int nthreads,
+    const int points,
+    const scalar_t* top_diff,
+    const scalar_t* best_bboxes,  // of shape (n, h, w, 5)
+    const float spatial_scale, const int channels, const int height,
+    const int width, scalar_t* bottom_diff) {
+    // every location only scatters to the feature map of its own image and
+    // channel, so the maps are split among threads to avoid write conflicts
+    const int map_size = height * width;
+    #pragma omp parallel for
+    for (int map = 0; map < nthreads / map_size; map++)
+    for (int k = 0; k < map_size; k++) {
+        const int index = map * map_size + k;
+""" + BACKWARD_BODY + r"""    }
 }
 """
 
@@ -236,29 +291,43 @@ __global__ void feature_refine_backward_kernel(
 def feature_refine_forward(features, best_bboxes, spatial_scale, points):
     src = f"""
     const int output_size = {features.numel()};
-    feature_refine_forward_kernel<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK >>>(
-                    output_size, {points}, in0_p, in1_p, {spatial_scale},in0_shape1, in0_shape2, in0_shape3, out0_p);
     """
     return jt.code(
         features.shape,
         features.dtype, [features, best_bboxes],
-        cuda_header=HEADER,
-        cuda_src=src)
+        cpu_header=CPU_HEADER,
+        cpu_src=src + f"""
+    feature_refine_forward_kernel(
+                    output_size, {points}, in0_p, in1_p, {spatial_scale},in0_shape1, in0_shape2, in0_shape3, out0_p);
+    """,
+        cuda_header=CUDA_HEADER,
+        cuda_src=src + f"""
+    feature_refine_forward_kernel<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK >>>(
+                    output_size, {points}, in0_p, in1_p, {spatial_scale},in0_shape1, in0_shape2, in0_shape3, out0_p);
+    """)
 
 
 def feature_refine_backward(top_grad, best_bboxes, spatial_scale, points):
-    bottom_grad = jt.zeros_like(top_grad)
     src = f"""
     const int output_size = {top_grad.numel()};
-    feature_refine_backward_kernel<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK >>> (
-                    output_size, {points}, in0_p, in1_p, {spatial_scale},
-                    in0_shape1, in0_shape2, in0_shape3,out0_p);
     """
     return jt.code(
         top_grad.shape,
         top_grad.dtype, [top_grad, best_bboxes],
-        cuda_header=HEADER,
-        cuda_src=src)
+        cpu_header=CPU_HEADER,
+        cpu_src=src + f"""
+    memset(out0_p, 0, out0->size);
+    feature_refine_backward_kernel(
+                    output_size, {points}, in0_p, in1_p, {spatial_scale},
+                    in0_shape1, in0_shape2, in0_shape3,out0_p);
+    """,
+        cuda_header=CUDA_HEADER,
+        cuda_src=src + f"""
+    cudaMemsetAsync(out0_p, 0, out0->size);
+    feature_refine_backward_kernel<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK >>> (
+                    output_size, {points}, in0_p, in1_p, {spatial_scale},
+                    in0_shape1, in0_shape2, in0_shape3,out0_p);
+    """)
 
 
 class FeatureRefineFunction(jt.Function):
@@ -398,5 +467,5 @@ def test():
 
 
 if __name__ == '__main__':
-    jt.flags.use_cuda = 1
+    jt.flags.use_cuda = jt.has_cuda
     test()
@@ -9,9 +9,100 @@ def nms(boxes, scores, thresh):
     return jt.nms(dets, thresh)
 
 
+# intersection and areas of the i-th and j-th boxes, the same as jt.nms
+INTER = r'''
+    (max((float)0, min(@in0(i, 2), @in0(j, 2)) -
+                   max(@in0(i, 0), @in0(j, 0)) + 1) *
+     max((float)0, min(@in0(i, 3), @in0(j, 3)) -
+                   max(@in0(i, 1), @in0(j, 1)) + 1))
+'''
+AREA = '((@in0({0}, 2) - @in0({0}, 0) + 1) * (@in0({0}, 3) - @in0({0}, 1) + 1))'
+# IoU > THRESH without the division
+SUPPRESSED = f'({INTER} > THRESH * ({AREA.format("i")} + ' \
+    f'{AREA.format("j")} - {INTER}))'
+
+
+def _segmented_nms(boxes, labels, pos, thresh):
+    header = f'''
+        #define THRESH ((float){float(thresh)})
+    '''
+    return jt.code(
+        (boxes.shape[0], ),
+        'bool', [boxes, labels, pos],
+        cpu_header=header + '#include <vector>\nusing namespace std;',
+        cpu_src=f'''
+            int n = in0_shape0;
+            std::vector<int> kept;
+            kept.reserve(n);
+            // kept boxes of the current label start from kept[seg]
+            size_t seg = 0;
+            for (int i = 0; i < n; i++) {{
+                if (i > 0 && @in1(i) != @in1(i - 1)) seg = kept.size();
+                bool pass = true;
+                for (size_t k = seg; k < kept.size() && pass; k++) {{
+                    int j = kept[k];
+                    pass = !{SUPPRESSED};
+                }}
+                @out0(@in2(i)) = pass;
+                if (pass) kept.push_back(i);
+            }}
+        ''',
+        cuda_header=header,
+        cuda_src=f'''
+            __global__ static void kernel1(@ARGS_DEF) {{
+                @PRECALC
+                int n = in0_shape0;
+                int tid = threadIdx.x, tnum = blockDim.x;
+                for (int i = tid; i < n; i += tnum) @out0(i) = 1;
+                for (int i = 0; i < n; i++) {{
+                    __syncthreads();
+                    if (!@out0(@in2(i))) continue;
+                    for (int j = i + 1 + tid;
+                         j < n && @in1(j) == @in1(i); j += tnum)
+                        if ({SUPPRESSED}) @out0(@in2(j)) = 0;
+                }}
+            }}
+            int n = in0_shape0;
+            kernel1<<<1, std::max(1, std::min(1024, n))>>>(@ARGS);
+        ''')
+
+
+def segmented_nms(boxes, scores, labels, thresh):
+    """NMS applied independently to the boxes of each label in one launch.
+
+    Boxes are ordered by labels and then by scores, so the boxes of a label
+    are a contiguous segment and each box is only compared with the kept
+    boxes of its own segment. Different from offsetting boxes by their
+    labels, the IoU keeps exact for large coordinates or many labels. The
+    IoU follows :func:`jt.nms` (with the legacy +1 in widths and heights).
+
+    Args:
+        boxes (jt.Var): Boxes with shape (n, 4).
+        scores (jt.Var): Scores with shape (n, ).
+        labels (jt.Var): Labels with shape (n, ).
+        thresh (float): IoU threshold.
+
+    Returns:
+        jt.Var: Indices of kept boxes sorted by scores in descending order.
+    """
+    num_boxes = boxes.shape[0]
+    order, _ = jt.argsort(scores, descending=True)
+    # stable sort by labels with the positions in the score order
+    key = labels[order].int64() * num_boxes + jt.arange(
+        num_boxes, dtype='int64')
+    pos, _ = jt.argsort(key)
+    pos = pos.int32()
+    keep = _segmented_nms(boxes[order][pos].float32(), labels[order][pos], pos,
+                          thresh)
+    return order[jt.where(keep)[0]]
+
+
 def multiclass_nms(mlvl_bboxes, mlvl_scores, score_thr, nms, max_per_img):
     """NMS for multi-class bboxes.
 
+    Boxes of all classes are thresholded and suppressed together by
+    :func:`segmented_nms`, instead of a NMS launch per class.
+
     Args:
         multi_bboxes (Var): shape (n, #class*4) or (n, 4)
         multi_scores (Var): shape (n, #class), where the last column
@@ -26,34 +117,27 @@ def multiclass_nms(mlvl_bboxes, mlvl_scores, score_thr, nms, max_per_img):
         tuple: (dets, labels), Var of shape (k, 5),
             (k), and (k). Dets are boxes with scores. Labels are 0-based.
     """
-    boxes = []
-    scores = []
-    labels = []
-    n_class = mlvl_scores.size(1)
+    n_class = mlvl_scores.size(1) - 1
     if mlvl_bboxes.shape[1] > 4:
         mlvl_bboxes = mlvl_bboxes.view(mlvl_bboxes.size(0), -1, 4)
+        mlvl_bboxes = mlvl_bboxes[:, :n_class]
     else:
         mlvl_bboxes = mlvl_bboxes.unsqueeze(1)
         mlvl_bboxes = mlvl_bboxes.expand((mlvl_bboxes.size(0), n_class, 4))
-    for j in range(0, n_class - 1):
-        bbox_j = mlvl_bboxes[:, j, :]
-        score_j = mlvl_scores[:, j:j + 1]
-        mask = jt.where(score_j > score_thr)[0]
-        bbox_j = bbox_j[mask, :]
-        score_j = score_j[mask]
-        dets = jt.concat([bbox_j, score_j], dim=1)
-        keep = jt.nms(dets, nms['thresh'])
-        bbox_j = bbox_j[keep]
-        score_j = score_j[keep]
-        label_j = jt.ones_like(score_j).int32() * j
-        boxes.append(bbox_j)
-        scores.append(score_j)
-        labels.append(label_j)
-
-    boxes = jt.concat(boxes, dim=0)
-    scores = jt.concat(scores, dim=0)
-    index, _ = jt.argsort(scores, dim=0, descending=True)
-    index = index[:max_per_img, 0]
-    boxes = jt.concat([boxes, scores], dim=1)[index]
-    labels = jt.concat(labels, dim=0).squeeze(1)[index]
-    return boxes, labels
+    scores = mlvl_scores[:, :n_class].reshape(-1)
+    labels = jt.arange(n_class, dtype='int32')
+    labels = labels.view(1, -1).expand((mlvl_scores.size(0), n_class))
+    labels = labels.reshape(-1)
+
+    inds = jt.where(scores > score_thr)[0]
+    if inds.shape[0] == 0:
+        return jt.zeros((0, 5), dtype=mlvl_scores.dtype), jt.zeros(
+            (0, ), dtype='int32')
+    boxes = mlvl_bboxes.reshape(-1, 4)[inds]
+    scores = scores[inds]
+    labels = labels[inds]
+
+    keep = segmented_nms(boxes, scores, labels, nms['thresh'])
+    keep = keep[:max_per_img]
+    boxes = jt.concat([boxes[keep], scores[keep][:, None]], dim=1)
+    return boxes, labels[keep]
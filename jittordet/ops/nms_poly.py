@@ -1,34 +1,25 @@
 import jittor as jt
-from shapely.geometry import Polygon
-
-HEADER = r'''
-#undef out
-#include <executor.h>
-#include <vector>
-#include <iostream>
-#define THCCeilDiv(a,b) ((a + b - 1) / b)
-#define DIVUP(m,n) ((m) / (n) + ((m) % (n) > 0))
-int const threadsPerBlock = sizeof(unsigned long long) * 8;
-
+import numpy as np
 
+HELPERS = r'''
 #define maxn 10
 const double eps=1E-8;
 
-__device__ inline int sig(float d){
+HOST_DEVICE int sig(float d){
     return(d>1e-8)-(d<-1e-8);
 }
 
-__device__ inline int point_eq(const float2 a, const float2 b) {
+HOST_DEVICE int point_eq(const float2 a, const float2 b) {
     return sig(a.x - b.x) == 0 && sig(a.y - b.y)==0;
 }
 
-__device__ inline void point_swap(float2 *a, float2 *b) {
+HOST_DEVICE void point_swap(float2 *a, float2 *b) {
     float2 temp = *a;
     *a = *b;
     *b = temp;
 }
 
-__device__ inline void point_reverse(float2 *first, float2* last)
+HOST_DEVICE void point_reverse(float2 *first, float2* last)
 {
     while ((first!=last)&&(first!=--last)) {
         point_swap (first,last);
@@ -36,10 +27,10 @@ __device__ inline void point_reverse(float2 *first, float2* last)
     }
 }
 
-__device__ inline float cross(float2 o,float2 a,float2 b){  //叉积
+HOST_DEVICE float cross(float2 o,float2 a,float2 b){  //叉积
     return(a.x-o.x)*(b.y-o.y)-(b.x-o.x)*(a.y-o.y);
 }
-__device__ inline float area(float2* ps,int n){
+HOST_DEVICE float area(float2* ps,int n){
     ps[n]=ps[0];
     float res=0;
     for(int i=0;i<n;i++){
@@ -47,7 +38,7 @@ __device__ inline float area(float2* ps,int n){
     }
     return res/2.0;
 }
-__device__ inline int lineCross(float2 a,float2 b,float2 c,float2 d,float2&p){
+HOST_DEVICE int lineCross(float2 a,float2 b,float2 c,float2 d,float2&p){
     float s1,s2;
     s1=cross(a,b,c);
     s2=cross(a,b,d);
@@ -58,7 +49,7 @@ __device__ inline int lineCross(float2 a,float2 b,float2 c,float2 d,float2&p){
     return 1;
 }
 
-__device__ inline void polygon_cut(float2*p,int&n,float2 a,float2 b, float2* pp){
+HOST_DEVICE void polygon_cut(float2*p,int&n,float2 a,float2 b, float2* pp){
 
     int m=0;p[n]=p[0];
     for(int i=0;i<n;i++){
@@ -76,7 +67,7 @@ __device__ inline void polygon_cut(float2*p,int&n,float2 a,float2 b, float2* pp)
 
 //---------------华丽的分隔线-----------------//
 //返回三角形oab和三角形ocd的有向交面积,o是原点//
-__device__ inline float intersectArea(float2 a,float2 b,float2 c,float2 d){
+HOST_DEVICE float intersectArea(float2 a,float2 b,float2 c,float2 d){
     float2 o = make_float2(0,0);
     int s1=sig(cross(o,a,b));
     int s2=sig(cross(o,c,d));
@@ -95,7 +86,7 @@ __device__ inline float intersectArea(float2 a,float2 b,float2 c,float2 d){
     if(s1*s2==-1) res=-res;return res;
 }
 //求两多边形的交面积
-__device__ inline float intersectArea(float2*ps1,int n1,float2*ps2,int n2){
+HOST_DEVICE float intersectArea(float2*ps1,int n1,float2*ps2,int n2){
     if(area(ps1,n1)<0) point_reverse(ps1,ps1+n1);
     if(area(ps2,n2)<0) point_reverse(ps2,ps2+n2);
     ps1[n1]=ps1[0];
@@ -110,7 +101,7 @@ __device__ inline float intersectArea(float2*ps1,int n1,float2*ps2,int n2){
 }
 
 // TODO: optimal if by first calculate the iou between two hbbs
-__device__ inline float devPolyIoU(float const * const p, float const * const q) {
+HOST_DEVICE float devPolyIoU(float const * const p, float const * const q) {
     float2 ps1[maxn], ps2[maxn];
     int n1 = 4;
     int n2 = 4;
@@ -131,7 +122,18 @@ __device__ inline float devPolyIoU(float const * const p, float const * const q)
     }
     return iou;
 }
+'''
 
+CUDA_HEADER = r'''
+#undef out
+#include <executor.h>
+#include <vector>
+#include <iostream>
+#define THCCeilDiv(a,b) ((a + b - 1) / b)
+#define DIVUP(m,n) ((m) / (n) + ((m) % (n) > 0))
+#define HOST_DEVICE __device__ inline
+int const threadsPerBlock = sizeof(unsigned long long) * 8;
+''' + HELPERS + r'''
 __global__ void poly_nms_kernel(const int n_polys, const float nms_overlap_thresh,
                             const float *dev_polys, unsigned long long *dev_mask) {
     const int row_start = blockIdx.y;
@@ -185,13 +187,55 @@ __global__ void poly_nms_kernel(const int n_polys, const float nms_overlap_thres
 }
 '''
 
+CPU_HEADER = r'''
+#include <cmath>
+#include <cstring>
+#include <vector>
+#define HOST_DEVICE inline
+using namespace std;
+
+struct float2 {
+    float x, y;
+};
+
+inline float2 make_float2(float x, float y) {
+    float2 p;
+    p.x = x;
+    p.y = y;
+    return p;
+}
+''' + HELPERS
 
-def poly_nms(boxes, nms_overlap_thresh):
-    assert boxes.ndim == 2 and boxes.shape[1] == 9
-    assert jt.flags.use_cuda
-    scores = boxes[:, 8]
-    order_t, _ = scores.argsort(0, descending=True)
-    boxes_sorted = boxes[order_t]
+CPU_SRC = r'''
+    @alias(boxes_sorted,in0)
+    @alias(keep,out0)
+    memset(keep_p,0,keep->size);
+    const int boxes_num = boxes_sorted_shape0;
+    std::vector<char> suppressed(boxes_num, 0);
+    for (int i = 0; i < boxes_num; i++) {
+        if (suppressed[i]) continue;
+        keep_p[i] = true;
+        const float *cur_box = boxes_sorted_p + i * 9;
+        #pragma omp parallel for
+        for (int j = i + 1; j < boxes_num; j++) {
+            if (suppressed[j]) continue;
+            if (devPolyIoU(cur_box, boxes_sorted_p + j * 9) > nms_overlap_thresh)
+                suppressed[j] = 1;
+        }
+    }
+'''
+
+
+def poly_nms_cpu(boxes_sorted, nms_overlap_thresh):
+    keep = jt.code((boxes_sorted.shape[0], ),
+                   'bool', [boxes_sorted],
+                   cpu_header=CPU_HEADER,
+                   cpu_src=f'const float nms_overlap_thresh = '
+                   f'{nms_overlap_thresh};' + CPU_SRC)
+    return keep
+
+
+def poly_nms_cuda(boxes_sorted, nms_overlap_thresh):
     SRC = f"""
     const float nms_overlap_thresh = {nms_overlap_thresh};
     """ + r"""
@@ -230,10 +274,22 @@ def poly_nms(boxes, nms_overlap_thresh):
     }
     exe.allocator->free(mask_p, matrices_size, mask_allocation);
     """
-    keep = jt.code((boxes.shape[0], ),
+    keep = jt.code((boxes_sorted.shape[0], ),
                    'bool', [boxes_sorted],
-                   cuda_header=HEADER,
+                   cuda_header=CUDA_HEADER,
                    cuda_src=SRC)
+    return keep
+
+
+def poly_nms(boxes, nms_overlap_thresh):
+    assert boxes.ndim == 2 and boxes.shape[1] == 9
+    scores = boxes[:, 8]
+    order_t, _ = scores.argsort(0, descending=True)
+    boxes_sorted = boxes[order_t]
+    if jt.flags.use_cuda:
+        keep = poly_nms_cuda(boxes_sorted, nms_overlap_thresh)
+    else:
+        keep = poly_nms_cpu(boxes_sorted, nms_overlap_thresh)
     return order_t[keep]
 
 
@@ -253,6 +309,8 @@ def multiclass_poly_nms(bboxes, scores, labels, thresh):
 
 
 def iou_poly(poly1, poly2):
+    from shapely.geometry import Polygon
+
     poly1 = Polygon(poly1.reshape(4, 2))
     poly2 = Polygon(poly2.reshape(4, 2))
     inter_area = poly1.intersection(poly2).area
@@ -308,7 +366,7 @@ def test2(i):
 
 
 if __name__ == '__main__':
-    jt.flags.use_cuda = 1
+    jt.flags.use_cuda = jt.has_cuda
     # test2(19)
     # for i in range(1000):
     #     test2(i)
@@ -0,0 +1,139 @@
+import math
+
+import jittor as jt
+import numpy as np
+
+__all__ = ['normalize_pad_stack', 'normalize_pad_stack_packed']
+
+# (b, c, y, x) of the output is read from channel `src_c` of the b-th image
+# in the flattened buffer, or set to `pad_value` out of the image.
+KERNEL_BODY = r'''
+    int64 offset = @in1(b, 0);
+    int c_in = @in1(b, 1), h = @in1(b, 2), w = @in1(b, 3);
+    int src_c = (SWAP_CHANNEL && c_in == 3) ? 2 - c : c;
+    float m = @in2(in2_shape0 == 1 ? 0 : c);
+    float s = @in3(in3_shape0 == 1 ? 0 : c);
+    @out0(b, c, y, x) = (y < h && x < w) ?
+        ((float)@in0(offset + ((int64)src_c * h + y) * w + x) - m) / s :
+        (float)PAD_VALUE;
+'''
+
+
+def _normalize_pad_stack(flat_imgs, img_metas, out_shape, mean, std, pad_value,
+                         swap_channel):
+    header = f'''
+        #define SWAP_CHANNEL {int(swap_channel)}
+        #define PAD_VALUE {float(pad_value)}
+    '''
+    return jt.code(
+        out_shape,
+        'float32', [flat_imgs, img_metas, mean, std],
+        cpu_header=header,
+        cpu_src=f'''
+            for (int b = 0; b < out0_shape0; b++)
+            for (int c = 0; c < out0_shape1; c++)
+            for (int y = 0; y < out0_shape2; y++)
+            for (int x = 0; x < out0_shape3; x++) {{
+                {KERNEL_BODY}
+            }}
+        ''',
+        cuda_header=header,
+        cuda_src=f'''
+            __global__ static void kernel1(@ARGS_DEF) {{
+                @PRECALC
+                int b = blockIdx.z, c = blockIdx.y;
+                for (int y = threadIdx.y + blockIdx.x * blockDim.y;
+                     y < out0_shape2; y += blockDim.y * gridDim.x)
+                for (int x = threadIdx.x; x < out0_shape3; x += blockDim.x) {{
+                    {KERNEL_BODY}
+                }}
+            }}
+            int tx = std::min(1024, out0_shape3);
+            int ty = std::min(1024 / tx, out0_shape2);
+            int bx = (out0_shape2 - 1) / ty + 1;
+            dim3 s1(bx, out0_shape1, out0_shape0);
+            dim3 s2(tx, ty);
+            kernel1<<<s1, s2>>>(@ARGS);
+        ''')
+
+
+def normalize_pad_stack(imgs,
+                        mean=None,
+                        std=None,
+                        pad_size_divisor=1,
+                        pad_value=0,
+                        swap_channel=False,
+                        batch_shape=None):
+    """Normalize, pad and stack a list of images in a single kernel.
+
+    The padded ``(N, C, H, W)`` batch is allocated once and every pixel is
+    written with the channel swap, the normalization and the cast to float32
+    fused, which is equivalent to::
+
+        imgs = [((img[[2, 1, 0]] if swap_channel else img).float() - mean)
+                / std for img in imgs]
+        batch = stack([pad(img, pad_value) for img in imgs])
+
+    Args:
+        imgs (list[jt.Var]): Images with shape (C, H, W) of any dtype.
+        mean (jt.Var, optional): Float32 mean with 1 or C values.
+        std (jt.Var, optional): Float32 std with 1 or C values.
+        pad_size_divisor (int): Pad H and W to be divisible by it.
+            Defaults to 1.
+        pad_value (int | float): Value of the padded pixels, which are not
+            normalized. Defaults to 0.
+        swap_channel (bool): Whether to swap BGR and RGB. Only images with 3
+            channels are swapped. Defaults to False.
+        batch_shape (tuple[int], optional): Pad the batch to this (H, W)
+            instead of the max shape of images rounded up by
+            ``pad_size_divisor``. Defaults to None.
+
+    Returns:
+        jt.Var: The float32 batch with shape (N, C, H, W).
+    """
+    if len({str(img.dtype) for img in imgs}) > 1:
+        imgs = [img.float32() for img in imgs]
+    img_buffer = jt.concat([img.reshape(-1) for img in imgs])
+    return normalize_pad_stack_packed(img_buffer, [img.shape for img in imgs],
+                                      mean, std, pad_size_divisor, pad_value,
+                                      swap_channel, batch_shape)
+
+
+def normalize_pad_stack_packed(img_buffer,
+                               img_shapes,
+                               mean=None,
+                               std=None,
+                               pad_size_divisor=1,
+                               pad_value=0,
+                               swap_channel=False,
+                               batch_shape=None):
+    """The same as :func:`normalize_pad_stack`, but the images are packed
+    into one flattened buffer, e.g., by :meth:`BaseDetDataset.collate_batch`.
+
+    Args:
+        img_buffer (jt.Var): 1-D buffer of the concatenated images.
+        img_shapes (list[tuple[int]]): (C, H, W) of each image.
+    """
+    assert len({shape[0] for shape in img_shapes}) == 1, \
+        'all images should have the same number of channels'
+    if mean is None:
+        mean, std = jt.zeros(1), jt.ones(1)
+
+    img_metas = np.zeros((len(img_shapes), 4), dtype=np.int64)
+    offset = 0
+    for i, (c, h, w) in enumerate(img_shapes):
+        img_metas[i] = (offset, c, h, w)
+        offset += c * h * w
+    assert offset == img_buffer.numel(), \
+        'the size of img_buffer does not match img_shapes'
+
+    max_h = max(shape[1] for shape in img_shapes)
+    max_w = max(shape[2] for shape in img_shapes)
+    if batch_shape is None:
+        batch_shape = (math.ceil(max_h / pad_size_divisor) * pad_size_divisor,
+                       math.ceil(max_w / pad_size_divisor) * pad_size_divisor)
+    assert batch_shape[0] >= max_h and batch_shape[1] >= max_w, \
+        f'images of shape ({max_h}, {max_w}) exceed batch_shape {batch_shape}'
+    out_shape = (len(img_shapes), img_shapes[0][0]) + tuple(batch_shape)
+    return _normalize_pad_stack(img_buffer, jt.array(img_metas), out_shape,
+                                mean, std, pad_value, swap_channel)
@@ -4,13 +4,10 @@ from jittor.misc import _pair
 
 __all__ = ['PSROIAlign']
 
-CUDA_HEADER = r'''
-#include <cmath>
-#include <cstdio>
-#include <climits>
-#define CUDA_1D_KERNEL_LOOP(i, n) for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; i += blockDim.x * gridDim.x)
-using namespace std;
-__device__ float bilinear_interpolate(const float* bottom_data,
+# The kernel bodies are shared by the cuda kernels and the cpu loops, so both
+# devices compute the same formulas.
+HELPERS = r'''
+HOST_DEVICE float bilinear_interpolate(const float* bottom_data,
     const int height, const int width,
     float y, float x,
     const int index /* index for debug only*/) {
@@ -49,7 +46,7 @@ __device__ float bilinear_interpolate(const float* bottom_data,
   float val = (w1 * v1 + w2 * v2 + w3 * v3 + w4 * v4);
   return val;
 }
-__device__ void bilinear_interpolate_gradient(
+HOST_DEVICE void bilinear_interpolate_gradient(
     const int height, const int width,
     float y, float x,
     float & w1, float & w2, float & w3, float & w4,
@@ -92,16 +89,7 @@ __device__ void bilinear_interpolate_gradient(
 }
 '''
 
-CUDA_SRC = r'''
-__global__ void PSRoIAlignForward(@ARGS_DEF,const int nthreads, const float* bottom_data,
-    const int channels,const int height, const int width,const int aligned_height, const int aligned_width,
-    const float* bottom_rois, float* top_data) {
-            @PRECALC
-    // printf("%d\n", out_dim);
-    const float spatial_scale = @in2(0);
-    const float sampling_ratio = @in2(1);
-    // const int out_dim = @in2(2);
-  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+FORWARD_BODY = r'''
         // NOfloatE Mingtao: copied from light-head
         // the order of dims is changed because the original implementation is in floatensorFlow
         int n = index;
@@ -109,8 +97,8 @@ __global__ void PSRoIAlignForward(@ARGS_DEF,const int nthreads, const float* bot
         n /= aligned_width;
         int ph = n % aligned_height;
         n /= aligned_height;
-        int ctop = n % out_dim;
-        n /= out_dim;
+        int ctop = n % pooled_dim;
+        n /= pooled_dim;
         const float* offset_bottom_rois = bottom_rois + n * 5;
         int roi_batch_ind = offset_bottom_rois[0];
         // Do not using rounding; this implementation detail is critical
@@ -124,7 +112,7 @@ __global__ void PSRoIAlignForward(@ARGS_DEF,const int nthreads, const float* bot
         auto bin_size_h = roi_height / aligned_height;
         auto bin_size_w = roi_width / aligned_width;
         // **************************************************************************************
-        int c = ( ctop * aligned_width + ph ) * aligned_width + pw;
+        int c = ( ctop * aligned_height + ph ) * aligned_width + pw;
         // **************************************************************************************
         const float* offset_bottom_data =
             bottom_data + (roi_batch_ind * channels + c) * height * width; //channels?
@@ -151,42 +139,9 @@ __global__ void PSRoIAlignForward(@ARGS_DEF,const int nthreads, const float* bot
         }
         output_val /= count;
         top_data[index] = output_val;
-    }
-}
-@alias(input,in0);
-@alias(rois,in1);
-@alias(output,out0);
-auto num_rois = rois_shape0;
-auto channels = input_shape1;
-auto height = input_shape2;
-auto width = input_shape3;
-auto aligned_height = output_shape2;
-auto aligned_width = output_shape3;
-auto output_size = num_rois * aligned_height * aligned_width * out_dim;
-const int total_count = in1_shape0 * out0_shape2 * out0_shape3 * in0_shape1;
-const int thread_per_block = 512L;
-const int block_count = (total_count + thread_per_block - 1) / thread_per_block;
-PSRoIAlignForward<<<block_count, thread_per_block>>>(@ARGS,output_size,input_p,channels,
-height, width,aligned_height,aligned_width,rois_p,output_p);
 '''
 
-CUDA_GRAD_SRC = [
-    r'''
-__global__ void PSRoIAlignBackwardFeature(@ARGS_DEF,const int nthreads, const float* top_diff,
-    const int num_rois,
-    const int channels, const int height, const int width,
-    const int aligned_height, const int aligned_width,
-    float* bottom_diff,
-    const float* bottom_rois) {
-         @PRECALC
-
-@alias(input,in0)
-@alias(rois,in1)
-@alias(grad_input,out0)
-@alias(grad,dout)
-    const float spatial_scale = @in2(0);
-    const float sampling_ratio = @in2(1);
-  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+BACKWARD_BODY = r'''
         // NOfloatE Mingtao: copied from light-head
         // the order of dims is changed because the original implementation is in floatensorFlow
         int n = index;
@@ -194,8 +149,8 @@ __global__ void PSRoIAlignBackwardFeature(@ARGS_DEF,const int nthreads, const fl
         n /= aligned_width;
         int ph = n % aligned_height;
         n /= aligned_height;
-        int ctop = n % out_dim;
-        n /= out_dim;
+        int ctop = n % pooled_dim;
+        n /= pooled_dim;
         const float* offset_bottom_rois = bottom_rois + n * 5;
         int roi_batch_ind = offset_bottom_rois[0];
         // Do not using rounding; this implementation detail is critical
@@ -208,10 +163,10 @@ __global__ void PSRoIAlignBackwardFeature(@ARGS_DEF,const int nthreads, const fl
         float roi_height = fmaxf(roi_end_h - roi_start_h, 1.f);
         float bin_size_h = roi_height / aligned_height;
         float bin_size_w = roi_width / aligned_width;
-        int c = ( ctop * aligned_width + ph ) * aligned_width + pw;
+        int c = ( ctop * aligned_height + ph ) * aligned_width + pw;
         float* offset_bottom_diff = bottom_diff + (roi_batch_ind * channels + c) * height * width;
 
-        int top_offset = (n * out_dim + ctop) * aligned_height * aligned_width;
+        int top_offset = (n * pooled_dim + ctop) * aligned_height * aligned_width;
         const float* offset_top_diff = top_diff + top_offset;
         const float top_diff_this_bin = offset_top_diff[ph * aligned_width + pw];
         // We use roi_bin_grid to sample the grid and mimic integral
@@ -239,13 +194,105 @@ __global__ void PSRoIAlignBackwardFeature(@ARGS_DEF,const int nthreads, const fl
                 float g3 = top_diff_this_bin * w3 / count;
                 float g4 = top_diff_this_bin * w4 / count;
                 if (x_low >= 0 && x_high >= 0 && y_low >= 0 && y_high >= 0) {
-                    atomicAdd(offset_bottom_diff + y_low * width + x_low, static_cast<float>(g1));
-                    atomicAdd(offset_bottom_diff + y_low * width + x_high, static_cast<float>(g2));
-                    atomicAdd(offset_bottom_diff + y_high * width + x_low, static_cast<float>(g3));
-                    atomicAdd(offset_bottom_diff + y_high * width + x_high, static_cast<float>(g4));
+                    ATOMIC_ADD(offset_bottom_diff + y_low * width + x_low, static_cast<float>(g1));
+                    ATOMIC_ADD(offset_bottom_diff + y_low * width + x_high, static_cast<float>(g2));
+                    ATOMIC_ADD(offset_bottom_diff + y_high * width + x_low, static_cast<float>(g3));
+                    ATOMIC_ADD(offset_bottom_diff + y_high * width + x_high, static_cast<float>(g4));
                 } // if
             } // ix
         } // iy
+'''
+
+CUDA_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <climits>
+#define CUDA_1D_KERNEL_LOOP(i, n) for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; i += blockDim.x * gridDim.x)
+#define HOST_DEVICE __device__
+#define ATOMIC_ADD atomicAdd
+using namespace std;
+''' + HELPERS
+
+CPU_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <climits>
+#define HOST_DEVICE inline
+#define ATOMIC_ADD(addr, val) (*(addr) += (val))
+using namespace std;
+''' + HELPERS
+
+CUDA_SRC = r'''
+__global__ void PSRoIAlignForward(@ARGS_DEF,const int nthreads, const float* bottom_data,
+    const int channels,const int height, const int width,const int aligned_height, const int aligned_width,
+    const float* bottom_rois, float* top_data) {
+            @PRECALC
+    const float spatial_scale = @in2(0);
+    const float sampling_ratio = @in2(1);
+    const int pooled_dim = out0_shape1;
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + FORWARD_BODY + r'''
+    }
+}
+@alias(input,in0);
+@alias(rois,in1);
+@alias(output,out0);
+auto num_rois = rois_shape0;
+auto channels = input_shape1;
+auto height = input_shape2;
+auto width = input_shape3;
+auto aligned_height = output_shape2;
+auto aligned_width = output_shape3;
+auto pooled_dim = output_shape1;
+auto output_size = num_rois * aligned_height * aligned_width * pooled_dim;
+const int thread_per_block = 512L;
+const int block_count = (output_size + thread_per_block - 1) / thread_per_block;
+PSRoIAlignForward<<<block_count, thread_per_block>>>(@ARGS,output_size,input_p,channels,
+height, width,aligned_height,aligned_width,rois_p,output_p);
+'''
+
+CPU_SRC = r'''
+@alias(input,in0);
+@alias(rois,in1);
+@alias(output,out0);
+const float spatial_scale = @in2(0);
+const float sampling_ratio = @in2(1);
+const int channels = input_shape1;
+const int height = input_shape2;
+const int width = input_shape3;
+const int aligned_height = output_shape2;
+const int aligned_width = output_shape3;
+const int pooled_dim = output_shape1;
+const int nthreads = rois_shape0 * aligned_height * aligned_width * pooled_dim;
+const float* bottom_data = input_p;
+const float* bottom_rois = rois_p;
+float* top_data = output_p;
+#pragma omp parallel for
+for (int index = 0; index < nthreads; index++) {
+''' + FORWARD_BODY + r'''
+}
+'''
+
+CUDA_GRAD_SRC = [
+    r'''
+__global__ void PSRoIAlignBackwardFeature(@ARGS_DEF,const int nthreads, const float* top_diff,
+    const int num_rois,
+    const int channels, const int height, const int width,
+    const int aligned_height, const int aligned_width,
+    float* bottom_diff,
+    const float* bottom_rois) {
+         @PRECALC
+
+@alias(input,in0)
+@alias(rois,in1)
+@alias(grad_input,out0)
+@alias(grad,dout)
+    const float spatial_scale = @in2(0);
+    const float sampling_ratio = @in2(1);
+    const int pooled_dim = grad_shape1;
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + BACKWARD_BODY + r'''
     } // CUDA_1D_KERNEL_LOOP
 } // RoIAlignBackward
 auto num_rois = rois_shape0;
@@ -254,23 +301,56 @@ auto height = input_shape2;
 auto width = input_shape3;
 auto aligned_height = grad_shape2;
 auto aligned_width = grad_shape3;
-auto output_size = num_rois * aligned_height * aligned_width * out_dim;
+auto pooled_dim = grad_shape1;
+auto output_size = num_rois * aligned_height * aligned_width * pooled_dim;
 cudaMemsetAsync(grad_input_p,0,grad_input->size);
-const int total_count = rois_shape0 * grad_shape2 * grad_shape3 * input_shape1;
 const int thread_per_block = 512;
-const int block_count = (total_count + thread_per_block - 1) / thread_per_block;
+const int block_count = (output_size + thread_per_block - 1) / thread_per_block;
 PSRoIAlignBackwardFeature<<<block_count, thread_per_block>>>(@ARGS,output_size,grad_p,num_rois,
 channels, height, width, aligned_height, aligned_width, grad_input_p, rois_p);
 ''', '', ''
 ]
 
+CPU_GRAD_SRC = [
+    r'''
+@alias(input,in0)
+@alias(rois,in1)
+@alias(grad_input,out0)
+// dout is only aliased in the header, which is not seen by the code on cpu
+@alias(grad,in3)
+const float spatial_scale = @in2(0);
+const float sampling_ratio = @in2(1);
+const int num_rois = rois_shape0;
+const int channels = input_shape1;
+const int height = input_shape2;
+const int width = input_shape3;
+const int aligned_height = grad_shape2;
+const int aligned_width = grad_shape3;
+const int pooled_dim = grad_shape1;
+const float* top_diff = grad_p;
+const float* bottom_rois = rois_p;
+float* bottom_diff = grad_input_p;
+memset(grad_input_p,0,grad_input->size);
+// each output bin of a roi pools from its own input channel, so bins are
+// split among threads and the rois are looped to avoid write conflicts
+const int bins_per_roi = pooled_dim * aligned_height * aligned_width;
+#pragma omp parallel for
+for (int bin = 0; bin < bins_per_roi; bin++)
+for (int roi = 0; roi < num_rois; roi++) {
+    const int index = roi * bins_per_roi + bin;
+''' + BACKWARD_BODY + r'''
+}
+''', '', ''
+]
+
 
 def psroi_align(input, rois, output_size, spatial_scale, sampling_ratio,
                 out_dim):
     output_size = _pair(output_size)
     options = jt.array([spatial_scale, sampling_ratio, out_dim])
-    output_shapes = (rois.shape[0], input.shape[1], output_size[0],
-                     output_size[1])
+    assert input.shape[1] == out_dim * output_size[0] * output_size[1], \
+        'input channels should be out_dim * output_size[0] * output_size[1]'
+    output_shapes = (rois.shape[0], out_dim, output_size[0], output_size[1])
     inputs = [input, rois, options]
     output_types = input.dtype
     if rois.shape[0] == 0:
@@ -279,6 +359,9 @@ def psroi_align(input, rois, output_size, spatial_scale, sampling_ratio,
         output_shapes,
         output_types,
         inputs,
+        cpu_header=CPU_HEADER,
+        cpu_src=CPU_SRC,
+        cpu_grad_src=CPU_GRAD_SRC,
         cuda_header=CUDA_HEADER,
         cuda_src=CUDA_SRC,
         cuda_grad_src=CUDA_GRAD_SRC)
@@ -308,10 +391,10 @@ class PSROIAlign(nn.Module):
 
 
 def test_psroi_align():
-    jt.flags.use_cuda = 1
+    jt.flags.use_cuda = jt.has_cuda
     psroialign = PSROIAlign(7, 1.0, sampling_ratio=0, out_dim=23)
 
-    feature = jt.rand((8, 512, 64, 64), dtype='float32')
+    feature = jt.rand((8, 23 * 7 * 7, 64, 64), dtype='float32')
     boxes = jt.array([[0, 1.2, 10, 3, 10], [3, 1, 67, 2, 34]])
     output = psroialign(feature, boxes)
     print(output.shape)
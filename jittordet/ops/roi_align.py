@@ -2,15 +2,12 @@ import jittor as jt
 from jittor import nn
 from jittor.misc import _pair
 
-__all__ = ['ROIAlign']
+__all__ = ['ROIAlign', 'multi_level_roi_align']
 
-CUDA_HEADER = r'''
-#include <cmath>
-#include <cstdio>
-#include <climits>
-#define CUDA_1D_KERNEL_LOOP(i, n) for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; i += blockDim.x * gridDim.x)
-using namespace std;
-__device__ float bilinear_interpolate(const float* bottom_data,
+# The kernel bodies are shared by the cuda kernels and the cpu loops, so both
+# devices compute the same formulas.
+HELPERS = r'''
+HOST_DEVICE float bilinear_interpolate(const float* bottom_data,
     const int height, const int width,
     float y, float x,
     const int index /* index for debug only*/) {
@@ -49,7 +46,7 @@ __device__ float bilinear_interpolate(const float* bottom_data,
   float val = (w1 * v1 + w2 * v2 + w3 * v3 + w4 * v4);
   return val;
 }
-__device__ void bilinear_interpolate_gradient(
+HOST_DEVICE void bilinear_interpolate_gradient(
     const int height, const int width,
     float y, float x,
     float & w1, float & w2, float & w3, float & w4,
@@ -90,16 +87,19 @@ __device__ void bilinear_interpolate_gradient(
   w1 = hy * hx, w2 = hy * lx, w3 = ly * hx, w4 = ly * lx;
   return;
 }
-__global__ void RoIAlignForward(const int nthreads, const float* bottom_data,
-    const int channels,const int height, const int width,const int pooled_height, const int pooled_width,
-    const float* bottom_rois, float* top_data,const float spatial_scale,const float  sampling_ratio) {
-  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+'''
+
+ROI_INDEX = r'''
     // (n, c, ph, pw) is an element in the pooled output
     int pw = index % pooled_width;
     int ph = (index / pooled_width) % pooled_height;
     int c = (index / pooled_width / pooled_height) % channels;
     int n = index / pooled_width / pooled_height / channels;
-    const float* offset_bottom_rois = bottom_rois + n * 5;
+'''
+
+# The pooling of a roi read from `offset_bottom_rois` on a feature map of
+# `height` x `width` scaled by `spatial_scale`.
+FORWARD_POOL = r'''
     int roi_batch_ind = offset_bottom_rois[0];
     // Do not using rounding; this implementation detail is critical
     auto roi_start_w = offset_bottom_rois[1] * spatial_scale;
@@ -136,18 +136,9 @@ __global__ void RoIAlignForward(const int nthreads, const float* bottom_data,
     }
     output_val /= count;
     top_data[index] = output_val;
-  }
-}
-__global__ void RoIAlignBackwardFeature(const int nthreads, const float* top_diff,const int num_rois,
-       const int channels, const int height, const int width,const int pooled_height, const int pooled_width,
-       float* bottom_diff,const float* bottom_rois,const float spatial_scale,const float  sampling_ratio) {
-  CUDA_1D_KERNEL_LOOP(index, nthreads) {
-    // (n, c, ph, pw) is an element in the pooled output
-    int pw = index % pooled_width;
-    int ph = (index / pooled_width) % pooled_height;
-    int c = (index / pooled_width / pooled_height) % channels;
-    int n = index / pooled_width / pooled_height / channels;
-    const float* offset_bottom_rois = bottom_rois + n * 5;
+'''
+
+BACKWARD_POOL = r'''
     int roi_batch_ind = offset_bottom_rois[0];
     // Do not using rounding; this implementation detail is critical
     float roi_start_w = offset_bottom_rois[1] * spatial_scale;
@@ -196,17 +187,193 @@ __global__ void RoIAlignBackwardFeature(const int nthreads, const float* top_dif
         float g4 = top_diff_this_bin * w4 / count;
         if (x_low >= 0 && x_high >= 0 && y_low >= 0 && y_high >= 0)
         {
-          atomicAdd(offset_bottom_diff + y_low * width + x_low, static_cast<float>(g1));
-          atomicAdd(offset_bottom_diff + y_low * width + x_high, static_cast<float>(g2));
-          atomicAdd(offset_bottom_diff + y_high * width + x_low, static_cast<float>(g3));
-          atomicAdd(offset_bottom_diff + y_high * width + x_high, static_cast<float>(g4));
+          ATOMIC_ADD(offset_bottom_diff + y_low * width + x_low, static_cast<float>(g1));
+          ATOMIC_ADD(offset_bottom_diff + y_low * width + x_high, static_cast<float>(g2));
+          ATOMIC_ADD(offset_bottom_diff + y_high * width + x_low, static_cast<float>(g3));
+          ATOMIC_ADD(offset_bottom_diff + y_high * width + x_high, static_cast<float>(g4));
         } // if
       } // ix
     } // iy
+'''
+
+FORWARD_BODY = ROI_INDEX + r'''
+    const float* offset_bottom_rois = bottom_rois + n * 5;
+''' + FORWARD_POOL
+
+BACKWARD_BODY = ROI_INDEX + r'''
+    const float* offset_bottom_rois = bottom_rois + n * 5;
+''' + BACKWARD_POOL
+
+CUDA_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <climits>
+#define CUDA_1D_KERNEL_LOOP(i, n) for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; i += blockDim.x * gridDim.x)
+#define HOST_DEVICE __device__
+#define ATOMIC_ADD atomicAdd
+using namespace std;
+''' + HELPERS + r'''
+__global__ void RoIAlignForward(const int nthreads, const float* bottom_data,
+    const int channels,const int height, const int width,const int pooled_height, const int pooled_width,
+    const float* bottom_rois, float* top_data,const float spatial_scale,const float  sampling_ratio) {
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + FORWARD_BODY + r'''
+  }
+}
+__global__ void RoIAlignBackwardFeature(const int nthreads, const float* top_diff,const int num_rois,
+       const int channels, const int height, const int width,const int pooled_height, const int pooled_width,
+       float* bottom_diff,const float* bottom_rois,const float spatial_scale,const float  sampling_ratio) {
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + BACKWARD_BODY + r'''
   } // CUDA_1D_KERNEL_LOOP
 } // RoIAlignBackward
 '''
 
+CPU_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <climits>
+#define HOST_DEVICE inline
+#define ATOMIC_ADD(addr, val) (*(addr) += (val))
+using namespace std;
+''' + HELPERS + r'''
+void RoIAlignForward(const int nthreads, const float* bottom_data,
+    const int channels,const int height, const int width,const int pooled_height, const int pooled_width,
+    const float* bottom_rois, float* top_data,const float spatial_scale,const float  sampling_ratio) {
+  #pragma omp parallel for
+  for (int index = 0; index < nthreads; index++) {
+''' + FORWARD_BODY + r'''
+  }
+}
+void RoIAlignBackwardFeature(const int nthreads, const float* top_diff,const int num_rois,
+       const int channels, const int height, const int width,const int pooled_height, const int pooled_width,
+       float* bottom_diff,const float* bottom_rois,const float spatial_scale,const float  sampling_ratio) {
+  // rois of an image scatter to the same feature map, so the channels are
+  // split among threads to avoid write conflicts
+  const int pooled_size = pooled_height * pooled_width;
+  #pragma omp parallel for
+  for (int c = 0; c < channels; c++)
+  for (int n = 0; n < num_rois; n++)
+  for (int k = 0; k < pooled_size; k++) {
+    const int index = (n * channels + c) * pooled_size + k;
+''' + BACKWARD_BODY + r'''
+  }
+} // RoIAlignBackward
+'''
+
+# All levels are passed in a struct by value, so a single launch pools each
+# roi from the level it is mapped to.
+MULTI_LEVEL_HELPERS = r'''
+#define MAX_ROI_LEVELS 8
+struct RoILevels {
+  int num_levels;
+  float finest_scale, roi_scale_factor;
+  // the features on forward and their gradients on backward
+  float* data[MAX_ROI_LEVELS];
+  int height[MAX_ROI_LEVELS], width[MAX_ROI_LEVELS];
+  float spatial_scale[MAX_ROI_LEVELS];
+};
+// the same as map_roi_levels and roi_rescale of SingleRoIExtractor
+HOST_DEVICE int map_roi_level(const float* bottom_roi, const RoILevels& levels,
+    float* roi) {
+  float scale = sqrtf((bottom_roi[3] - bottom_roi[1]) * (bottom_roi[4] - bottom_roi[2]));
+  float level = floorf(log2f(scale / levels.finest_scale + 1e-6f));
+  // nan of inverted rois goes to level 0 as well
+  if (!(level > 0)) level = 0;
+  if (level > levels.num_levels - 1) level = levels.num_levels - 1;
+  for (int i = 0; i < 5; i++) roi[i] = bottom_roi[i];
+  if (levels.roi_scale_factor != 1) {
+    float cx = (bottom_roi[1] + bottom_roi[3]) * 0.5f;
+    float cy = (bottom_roi[2] + bottom_roi[4]) * 0.5f;
+    float new_w = (bottom_roi[3] - bottom_roi[1]) * levels.roi_scale_factor;
+    float new_h = (bottom_roi[4] - bottom_roi[2]) * levels.roi_scale_factor;
+    roi[1] = cx - new_w * 0.5f;
+    roi[2] = cy - new_h * 0.5f;
+    roi[3] = cx + new_w * 0.5f;
+    roi[4] = cy + new_h * 0.5f;
+  }
+  return (int)level;
+}
+'''
+
+LEVEL_SELECT = r'''
+    float roi[5];
+    const int level = map_roi_level(bottom_rois + n * 5, levels, roi);
+    const float* offset_bottom_rois = roi;
+    const int height = levels.height[level];
+    const int width = levels.width[level];
+    const float spatial_scale = levels.spatial_scale[level];
+'''
+
+MULTI_LEVEL_FORWARD_BODY = ROI_INDEX + LEVEL_SELECT + r'''
+    const float* bottom_data = levels.data[level];
+''' + FORWARD_POOL
+
+MULTI_LEVEL_BACKWARD_BODY = ROI_INDEX + LEVEL_SELECT + r'''
+    float* bottom_diff = levels.data[level];
+''' + BACKWARD_POOL
+
+MULTI_LEVEL_CUDA_HEADER = CUDA_HEADER + MULTI_LEVEL_HELPERS + r'''
+__global__ void MultiLevelRoIAlignForward(const int nthreads, const RoILevels levels,
+    const int channels, const int pooled_height, const int pooled_width,
+    const float* bottom_rois, float* top_data, const float sampling_ratio) {
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + MULTI_LEVEL_FORWARD_BODY + r'''
+  }
+}
+__global__ void MultiLevelRoIAlignBackward(const int nthreads, const float* top_diff,
+    const RoILevels levels, const int channels, const int pooled_height,
+    const int pooled_width, const float* bottom_rois, const float sampling_ratio) {
+  CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + MULTI_LEVEL_BACKWARD_BODY + r'''
+  }
+}
+'''
+
+# The cpu loops map each roi once instead of for each output element.
+ROI_BIN = r'''
+      const int index = (n * channels + c) * pooled_size + k;
+      int pw = k % pooled_width;
+      int ph = k / pooled_width;
+'''
+
+MULTI_LEVEL_CPU_HEADER = CPU_HEADER + MULTI_LEVEL_HELPERS + r'''
+void MultiLevelRoIAlignForward(const int nthreads, const RoILevels& levels,
+    const int channels, const int pooled_height, const int pooled_width,
+    const float* bottom_rois, float* top_data, const float sampling_ratio) {
+  if (nthreads == 0) return;
+  const int pooled_size = pooled_height * pooled_width;
+  const int num_rois = nthreads / channels / pooled_size;
+  #pragma omp parallel for
+  for (int n = 0; n < num_rois; n++) {
+''' + LEVEL_SELECT + r'''
+    const float* bottom_data = levels.data[level];
+    for (int c = 0; c < channels; c++)
+    for (int k = 0; k < pooled_size; k++) {
+''' + ROI_BIN + FORWARD_POOL + r'''
+    }
+  }
+}
+void MultiLevelRoIAlignBackward(const int nthreads, const float* top_diff,
+    const RoILevels& levels, const int channels, const int pooled_height,
+    const int pooled_width, const float* bottom_rois, const float sampling_ratio) {
+  if (nthreads == 0) return;
+  // the channels are split among threads as RoIAlignBackwardFeature
+  const int pooled_size = pooled_height * pooled_width;
+  const int num_rois = nthreads / channels / pooled_size;
+  #pragma omp parallel for
+  for (int c = 0; c < channels; c++)
+  for (int n = 0; n < num_rois; n++) {
+''' + LEVEL_SELECT + r'''
+    float* bottom_diff = levels.data[level];
+    for (int k = 0; k < pooled_size; k++) {
+''' + ROI_BIN + BACKWARD_POOL + r'''
+    }
+  }
+}
+'''
+
 
 class _ROIAlign(jt.Function):
 
@@ -224,13 +391,7 @@ class _ROIAlign(jt.Function):
         output_shapes = (rois.shape[0], input.shape[1], output_size[0],
                          output_size[1])
         self.version = version
-        return jt.code(
-            output_shapes,
-            input.dtype, [input, rois],
-            cuda_header=f"""
-              #define ROI_ALIGN_VERSION {self.version}
-              {CUDA_HEADER}""",
-            cuda_src=f'''
+        src = f'''
               @alias(input,in0);
               @alias(rois,in1);
               @alias(output,out0);
@@ -243,6 +404,20 @@ class _ROIAlign(jt.Function):
               auto pooled_height = output_shape2;
               auto pooled_width = output_shape3;
               auto output_size = num_rois * pooled_height * pooled_width * channels;
+              '''
+        return jt.code(
+            output_shapes,
+            input.dtype, [input, rois],
+            cpu_header=f"""
+              #define ROI_ALIGN_VERSION {self.version}
+              {CPU_HEADER}""",
+            cpu_src=src + '''
+              RoIAlignForward(output_size,input_p,channels,height, width,pooled_height,pooled_width,rois_p,output_p,spatial_scale,sampling_ratio);
+              ''',
+            cuda_header=f"""
+              #define ROI_ALIGN_VERSION {self.version}
+              {CUDA_HEADER}""",
+            cuda_src=src + '''
               const int total_count = in1_shape0 * out0_shape2 * out0_shape3 * in0_shape1;
               const int thread_per_block = 512L;
               const int block_count = (total_count + thread_per_block - 1) / thread_per_block;
@@ -251,13 +426,7 @@ class _ROIAlign(jt.Function):
 
     def grad(self, output_grad):
         input, rois = self.input, self.rois
-        input_grad = jt.code(
-            input.shape,
-            input.dtype, [input, rois, output_grad],
-            cuda_header=f"""
-                        #define ROI_ALIGN_VERSION {self.version}
-                        {CUDA_HEADER}""",
-            cuda_src=f'''
+        src = f'''
                         @alias(input,in0)
                         @alias(rois,in1)
                         @alias(grad,in2)
@@ -271,6 +440,21 @@ class _ROIAlign(jt.Function):
                         auto pooled_height = grad_shape2;
                         auto pooled_width = grad_shape3;
                         auto output_size = num_rois * pooled_height * pooled_width * channels;
+                        '''
+        input_grad = jt.code(
+            input.shape,
+            input.dtype, [input, rois, output_grad],
+            cpu_header=f"""
+                        #define ROI_ALIGN_VERSION {self.version}
+                        {CPU_HEADER}""",
+            cpu_src=src + '''
+                        memset(grad_input_p,0,grad_input->size);
+                        RoIAlignBackwardFeature(output_size,grad_p,num_rois,channels,height,width,pooled_height,pooled_width,grad_input_p,rois_p,spatial_scale,sampling_ratio);
+                        ''',
+            cuda_header=f"""
+                        #define ROI_ALIGN_VERSION {self.version}
+                        {CUDA_HEADER}""",
+            cuda_src=src + '''
                         cudaMemsetAsync(grad_input_p,0,grad_input->size);
                         const int total_count = rois_shape0 * grad_shape2 * grad_shape3 * input_shape1;
                         const int thread_per_block = 512;
@@ -311,8 +495,145 @@ class ROIAlign(nn.Module):
         return tmpstr
 
 
+def _roi_levels_src(feats, spatial_scales, finest_scale, roi_scale_factor):
+    """Fill a ``RoILevels`` struct with the vars named in ``feats``."""
+    src = f'''
+        RoILevels levels;
+        levels.num_levels = {len(feats)};
+        levels.finest_scale = {finest_scale};
+        levels.roi_scale_factor = {roi_scale_factor};
+        '''
+    for i, (feat, scale) in enumerate(zip(feats, spatial_scales)):
+        src += f'''
+        levels.data[{i}] = (float*){feat}_p;
+        levels.height[{i}] = {feat}_shape2;
+        levels.width[{i}] = {feat}_shape3;
+        levels.spatial_scale[{i}] = {scale};
+        '''
+    return src
+
+
+class _MultiLevelROIAlign(jt.Function):
+
+    def execute(self, rois, output_size, spatial_scales, finest_scale,
+                roi_scale_factor, sampling_ratio, version, *feats):
+        assert 0 < len(feats) <= 8 and len(feats) == len(spatial_scales)
+        assert all(feat.shape[:2] == feats[0].shape[:2] for feat in feats)
+        self.rois = rois
+        self.feat_shapes = [feat.shape for feat in feats]
+        self.feat_dtypes = [feat.dtype for feat in feats]
+        self.args = (spatial_scales, finest_scale, roi_scale_factor)
+        self.sampling_ratio = sampling_ratio
+        self.version = version
+        output_shapes = (rois.shape[0], feats[0].shape[1], output_size[0],
+                         output_size[1])
+        src = _roi_levels_src([f'in{i + 1}'
+                               for i in range(len(feats))], *self.args) + f'''
+              @alias(rois,in0);
+              @alias(output,out0);
+              const float  sampling_ratio = {sampling_ratio};
+              auto channels = output_shape1;
+              auto pooled_height = output_shape2;
+              auto pooled_width = output_shape3;
+              auto output_size = rois_shape0 * pooled_height * pooled_width * channels;
+              '''
+        return jt.code(
+            output_shapes,
+            feats[0].dtype, [rois, *feats],
+            cpu_header=f"""
+              #define ROI_ALIGN_VERSION {version}
+              {MULTI_LEVEL_CPU_HEADER}""",
+            cpu_src=src + '''
+              MultiLevelRoIAlignForward(output_size,levels,channels,pooled_height,pooled_width,rois_p,output_p,sampling_ratio);
+              ''',
+            cuda_header=f"""
+              #define ROI_ALIGN_VERSION {version}
+              {MULTI_LEVEL_CUDA_HEADER}""",
+            cuda_src=src + '''
+              const int thread_per_block = 512;
+              const int block_count = (output_size + thread_per_block - 1) / thread_per_block;
+              if (output_size > 0)
+                MultiLevelRoIAlignForward<<<block_count, thread_per_block>>>(output_size,levels,channels,pooled_height,pooled_width,rois_p,output_p,sampling_ratio);
+              ''')
+
+    def grad(self, output_grad):
+        num_levels = len(self.feat_shapes)
+        outs = [f'out{i}' for i in range(num_levels)]
+        src = _roi_levels_src(outs, *self.args) + f'''
+                        @alias(rois,in0)
+                        @alias(grad,in1)
+                        const float  sampling_ratio = {self.sampling_ratio};
+                        auto channels = grad_shape1;
+                        auto pooled_height = grad_shape2;
+                        auto pooled_width = grad_shape3;
+                        auto output_size = rois_shape0 * pooled_height * pooled_width * channels;
+                        '''
+        feat_grads = jt.code(
+            self.feat_shapes,
+            self.feat_dtypes, [self.rois, output_grad],
+            cpu_header=f"""
+                        #define ROI_ALIGN_VERSION {self.version}
+                        {MULTI_LEVEL_CPU_HEADER}""",
+            cpu_src=src + ''.join(f'memset({out}_p,0,{out}->size);'
+                                  for out in outs) + '''
+                        MultiLevelRoIAlignBackward(output_size,grad_p,levels,channels,pooled_height,pooled_width,rois_p,sampling_ratio);
+                        ''',
+            cuda_header=f"""
+                        #define ROI_ALIGN_VERSION {self.version}
+                        {MULTI_LEVEL_CUDA_HEADER}""",
+            cuda_src=src + ''.join(f'cudaMemsetAsync({out}_p,0,{out}->size);'
+                                   for out in outs) + '''
+                        const int thread_per_block = 512;
+                        const int block_count = (output_size + thread_per_block - 1) / thread_per_block;
+                        if (output_size > 0)
+                          MultiLevelRoIAlignBackward<<<block_count, thread_per_block>>>(output_size,grad_p,levels,channels,pooled_height,pooled_width,rois_p,sampling_ratio);
+                        ''')
+        return (None, ) * 7 + tuple(feat_grads)
+
+
+def multi_level_roi_align(feats,
+                          rois,
+                          output_size,
+                          spatial_scales,
+                          finest_scale=56,
+                          roi_scale_factor=None,
+                          sampling_ratio=0,
+                          version=0):
+    """RoIAlign of rois mapped to multi-level features in a single launch.
+
+    Each roi is mapped to a level by its scale as
+    ``SingleRoIExtractor.map_roi_levels`` and optionally rescaled as
+    ``roi_rescale`` inside the kernel, which is the same as pooling the rois
+    of each level by ``roi_align`` and scattering them back.
+
+    Args:
+        feats (list[jt.Var]): Features of at most 8 levels with the same
+            batch size and channels.
+        rois (jt.Var): RoIs with shape (n, 5) where the first column is the
+            batch index.
+        output_size (int | tuple[int]): Size of the pooled features.
+        spatial_scales (list[float]): Spatial scale of each level.
+        finest_scale (int): Scale threshold of mapping to level 0.
+            Defaults to 56.
+        roi_scale_factor (float, optional): Scale factor of the rois after
+            they are mapped. Defaults to None.
+        sampling_ratio (int): Number of samples in each bin, 0 for adaptive
+            ones. Defaults to 0.
+        version (int): Version of ``ROIAlign``. Defaults to 0.
+
+    Returns:
+        jt.Var: Pooled features with shape (n, C, *output_size).
+    """
+    if roi_scale_factor is None:
+        roi_scale_factor = 1.
+    return _MultiLevelROIAlign.apply(rois, _pair(output_size),
+                                     tuple(spatial_scales), finest_scale,
+                                     roi_scale_factor, sampling_ratio, version,
+                                     *feats)
+
+
 def test_roialign():
-    jt.flags.use_cuda = 1
+    jt.flags.use_cuda = jt.has_cuda
     roi_align = ROIAlign((7, 7), 1 / 16.)
     feature = jt.randn((2, 1024, 64, 64))
     roi = jt.array([[0, 20, 120, 80, 195.5], [1, 23, 56, 200, 300.5]])
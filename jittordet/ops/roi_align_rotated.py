@@ -4,21 +4,11 @@ from jittor.misc import _pair
 
 __all__ = ['ROIAlign']
 
-CUDA_HEADER = r'''
-#include <cmath>
-#include <cstdio>
-#include <climits>
-#define CUDA_1D_KERNEL_LOOP(i, n)                            \
-  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; \
-       i += blockDim.x * gridDim.x)
-#define THREADS_PER_BLOCK 1024
-inline int GET_BLOCKS(const int N) {
-    int optimal_block_num = (N + THREADS_PER_BLOCK - 1) / THREADS_PER_BLOCK;
-    int max_block_num = 65000;
-    return min(optimal_block_num, max_block_num);
-}
+# The kernel bodies are shared by the cuda kernels and the cpu loops, so both
+# devices compute the same formulas.
+HELPERS = r'''
 template <typename scalar_t>
-__device__ scalar_t bilinear_interpolate(const scalar_t *bottom_data,
+HOST_DEVICE scalar_t bilinear_interpolate(const scalar_t *bottom_data,
                                          const int height, const int width,
                                          scalar_t y, scalar_t x) {
   // deal with cases that inverse elements are out of feature map boundary
@@ -57,14 +47,44 @@ __device__ scalar_t bilinear_interpolate(const scalar_t *bottom_data,
   return val;
 }
 template <typename scalar_t>
-__global__ void ROIAlignRotatedForward(const int nthreads, const scalar_t *bottom_data,
-                                const scalar_t *bottom_rois,
-                                const scalar_t spatial_scale,
-                                const int sample_num, const int channels,
-                                const int height, const int width,
-                                const int pooled_height, const int pooled_width,
-                                scalar_t *top_data) {
-    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+HOST_DEVICE void bilinear_interpolate_gradient(const int height, const int width,
+                                              scalar_t y, scalar_t x,
+                                              scalar_t &w1, scalar_t &w2,
+                                              scalar_t &w3, scalar_t &w4,
+                                              int &x_low, int &x_high,
+                                              int &y_low, int &y_high) {
+  // deal with cases that inverse elements are out of feature map boundary
+  if (y < -1.0 || y > height || x < -1.0 || x > width) {
+    w1 = w2 = w3 = w4 = 0.;
+    x_low = x_high = y_low = y_high = -1;
+    return;
+  }
+  if (y <= 0) y = 0;
+  if (x <= 0) x = 0;
+  y_low = (int)y;
+  x_low = (int)x;
+  if (y_low >= height - 1) {
+    y_high = y_low = height - 1;
+    y = (scalar_t)y_low;
+  } else {
+    y_high = y_low + 1;
+  }
+  if (x_low >= width - 1) {
+    x_high = x_low = width - 1;
+    x = (scalar_t)x_low;
+  } else {
+    x_high = x_low + 1;
+  }
+  scalar_t ly = y - y_low;
+  scalar_t lx = x - x_low;
+  scalar_t hy = 1. - ly;
+  scalar_t hx = 1. - lx;
+  w1 = hy * hx, w2 = hy * lx, w3 = ly * hx, w4 = ly * lx;
+  return;
+}
+'''
+
+FORWARD_BODY = r'''
     // (n, c, ph, pw) is an element in the pooled output
     int pw = index % pooled_width;
     int ph = (index / pooled_width) % pooled_height;
@@ -122,51 +142,9 @@ __global__ void ROIAlignRotatedForward(const int nthreads, const scalar_t *botto
     }
     output_val /= count;
     top_data[index] = output_val;
-    }
-}
-template <typename scalar_t>
-__device__ void bilinear_interpolate_gradient(const int height, const int width,
-                                              scalar_t y, scalar_t x,
-                                              scalar_t &w1, scalar_t &w2,
-                                              scalar_t &w3, scalar_t &w4,
-                                              int &x_low, int &x_high,
-                                              int &y_low, int &y_high) {
-  // deal with cases that inverse elements are out of feature map boundary
-  if (y < -1.0 || y > height || x < -1.0 || x > width) {
-    w1 = w2 = w3 = w4 = 0.;
-    x_low = x_high = y_low = y_high = -1;
-    return;
-  }
-  if (y <= 0) y = 0;
-  if (x <= 0) x = 0;
-  y_low = (int)y;
-  x_low = (int)x;
-  if (y_low >= height - 1) {
-    y_high = y_low = height - 1;
-    y = (scalar_t)y_low;
-  } else {
-    y_high = y_low + 1;
-  }
-  if (x_low >= width - 1) {
-    x_high = x_low = width - 1;
-    x = (scalar_t)x_low;
-  } else {
-    x_high = x_low + 1;
-  }
-  scalar_t ly = y - y_low;
-  scalar_t lx = x - x_low;
-  scalar_t hy = 1. - ly;
-  scalar_t hx = 1. - lx;
-  w1 = hy * hx, w2 = hy * lx, w3 = ly * hx, w4 = ly * lx;
-  return;
-}
-template <typename scalar_t>
-__global__ void ROIAlignBackward(
-    const int nthreads, const scalar_t *top_diff, const scalar_t *bottom_rois,
-    const scalar_t spatial_scale, const int sample_num, const int channels,
-    const int height, const int width, const int pooled_height,
-    const int pooled_width, scalar_t *bottom_diff) {
-    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+'''
+
+BACKWARD_BODY = r'''
     // (n, c, ph, pw) is an element in the pooled output
     int pw = index % pooled_width;
     int ph = (index / pooled_width) % pooled_height;
@@ -239,18 +217,94 @@ __global__ void ROIAlignBackward(
         scalar_t g3 = top_diff_this_bin * w3 / count;
         scalar_t g4 = top_diff_this_bin * w4 / count;
         if (x_low >= 0 && x_high >= 0 && y_low >= 0 && y_high >= 0) {
-          atomicAdd(
+          ATOMIC_ADD(
               offset_bottom_diff + y_low * width + x_low, g1);
-          atomicAdd(
+          ATOMIC_ADD(
               offset_bottom_diff + y_low * width + x_high, g2);
-          atomicAdd(
+          ATOMIC_ADD(
               offset_bottom_diff + y_high * width + x_low, g3);
-          atomicAdd(
+          ATOMIC_ADD(
               offset_bottom_diff + y_high * width + x_high, g4);
         }  // if
       }  // ix
     }  // iy
-  }  // CUDA_1D_KERNEL_LOOP
+'''
+
+CUDA_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <climits>
+#define CUDA_1D_KERNEL_LOOP(i, n)                            \
+  for (int i = blockIdx.x * blockDim.x + threadIdx.x; i < n; \
+       i += blockDim.x * gridDim.x)
+#define THREADS_PER_BLOCK 1024
+inline int GET_BLOCKS(const int N) {
+    int optimal_block_num = (N + THREADS_PER_BLOCK - 1) / THREADS_PER_BLOCK;
+    int max_block_num = 65000;
+    return min(optimal_block_num, max_block_num);
+}
+#define HOST_DEVICE __device__
+#define ATOMIC_ADD atomicAdd
+''' + HELPERS + r'''
+template <typename scalar_t>
+__global__ void ROIAlignRotatedForward(const int nthreads, const scalar_t *bottom_data,
+                                const scalar_t *bottom_rois,
+                                const scalar_t spatial_scale,
+                                const int sample_num, const int channels,
+                                const int height, const int width,
+                                const int pooled_height, const int pooled_width,
+                                scalar_t *top_data) {
+    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + FORWARD_BODY + r'''    }
+}
+template <typename scalar_t>
+__global__ void ROIAlignBackward(
+    const int nthreads, const scalar_t *top_diff, const scalar_t *bottom_rois,
+    const scalar_t spatial_scale, const int sample_num, const int channels,
+    const int height, const int width, const int pooled_height,
+    const int pooled_width, scalar_t *bottom_diff) {
+    CUDA_1D_KERNEL_LOOP(index, nthreads) {
+''' + BACKWARD_BODY + r'''  }  // CUDA_1D_KERNEL_LOOP
+}  // RoIAlignBackward
+'''
+
+CPU_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <climits>
+#define HOST_DEVICE inline
+#define ATOMIC_ADD(addr, val) (*(addr) += (val))
+using namespace std;
+''' + HELPERS + r'''
+template <typename scalar_t>
+void ROIAlignRotatedForward(const int nthreads, const scalar_t *bottom_data,
+                                const scalar_t *bottom_rois,
+                                const scalar_t spatial_scale,
+                                const int sample_num, const int channels,
+                                const int height, const int width,
+                                const int pooled_height, const int pooled_width,
+                                scalar_t *top_data) {
+    #pragma omp parallel for
+    for (int index = 0; index < nthreads; index++) {
+''' + FORWARD_BODY + r'''    }
+}
+template <typename scalar_t>
+void ROIAlignBackward(
+    const int nthreads, const scalar_t *top_diff, const scalar_t *bottom_rois,
+    const scalar_t spatial_scale, const int sample_num, const int channels,
+    const int height, const int width, const int pooled_height,
+    const int pooled_width, scalar_t *bottom_diff) {
+    // rois of an image scatter to the same feature map, so the channels
+    // are split among threads to avoid write conflicts
+    const int pooled_size = pooled_height * pooled_width;
+    const int num_rois = nthreads / channels / pooled_size;
+    #pragma omp parallel for
+    for (int c = 0; c < channels; c++)
+    for (int n = 0; n < num_rois; n++)
+    for (int k = 0; k < pooled_size; k++) {
+    const int index = (n * channels + c) * pooled_size + k;
+''' + BACKWARD_BODY + r'''  }  // CUDA_1D_KERNEL_LOOP
 }  // RoIAlignBackward
 '''
 
@@ -265,11 +319,7 @@ class _RotatedROIAlign(jt.Function):
         assert rois.shape[1] == 6
         output_shapes = (rois.shape[0], input.shape[1], output_size[0],
                          output_size[1])
-        return jt.code(
-            output_shapes,
-            input.dtype, [input, rois],
-            cuda_header=CUDA_HEADER,
-            cuda_src=f'''
+        src = f'''
                             @alias(input,in0);
                             @alias(rois,in1);
                             @alias(output,out0);
@@ -282,6 +332,19 @@ class _RotatedROIAlign(jt.Function):
                             auto pooled_height = output_shape2;
                             auto pooled_width = output_shape3;
                             auto output_size = num_rois * pooled_height * pooled_width * channels;
+                            '''
+        return jt.code(
+            output_shapes,
+            input.dtype, [input, rois],
+            cpu_header=CPU_HEADER,
+            cpu_src=src + '''
+                            ROIAlignRotatedForward(
+                                        output_size, input_p, rois_p, spatial_scale,
+                                        sampling_ratio, channels, height, width, pooled_height,
+                                        pooled_width, output_p);
+                            ''',
+            cuda_header=CUDA_HEADER,
+            cuda_src=src + '''
                             ROIAlignRotatedForward<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK>>> (
                                         output_size, input_p, rois_p, spatial_scale,
                                         sampling_ratio, channels, height, width, pooled_height,
@@ -290,11 +353,7 @@ class _RotatedROIAlign(jt.Function):
 
     def grad(self, output_grad):
         input, rois = self.input, self.rois
-        input_grad = jt.code(
-            input.shape,
-            input.dtype, [input, rois, output_grad],
-            cuda_header=CUDA_HEADER,
-            cuda_src=f'''
+        src = f'''
                             @alias(input,in0)
                             @alias(rois,in1)
                             @alias(grad,in2)
@@ -308,6 +367,20 @@ class _RotatedROIAlign(jt.Function):
                             auto pooled_height = grad_shape2;
                             auto pooled_width = grad_shape3;
                             auto output_size = num_rois * pooled_height * pooled_width * channels;
+                            '''
+        input_grad = jt.code(
+            input.shape,
+            input.dtype, [input, rois, output_grad],
+            cpu_header=CPU_HEADER,
+            cpu_src=src + '''
+                            memset(grad_input_p,0,grad_input->size);
+                            ROIAlignBackward(
+                                    output_size, grad_p, rois_p, spatial_scale, sampling_ratio,
+                                    channels, height, width, pooled_height, pooled_width,
+                                    grad_input_p);
+                            ''',
+            cuda_header=CUDA_HEADER,
+            cuda_src=src + '''
                             cudaMemsetAsync(grad_input_p,0,grad_input->size);
                              ROIAlignBackward<<<GET_BLOCKS(output_size), THREADS_PER_BLOCK>>>(
                                     output_size, grad_p, rois_p, spatial_scale, sampling_ratio,
@@ -342,7 +415,7 @@ class ROIAlignRotated(nn.Module):
 
 
 def test_roialign():
-    jt.flags.use_cuda = 1
+    jt.flags.use_cuda = jt.has_cuda
     roi_align = ROIAlignRotated((7, 7), 1 / 16.)
     feature = jt.randn((2, 1024, 64, 64))
     roi = jt.array([[0, 20, 120, 80, 195.5, 0.3], [1, 23, 56, 200, 300.5,
@@ -8,12 +8,22 @@ CUDA_HEADER = r'''
 #include <cmath>
 #include <cstdio>
 #include <climits>
+#define ATOMIC_ADD atomicAdd
 using namespace std;
 '''
 
-CUDA_SRC = r'''
-__global__ static void RoIPoolForwardKernel(@ARGS_DEF){
-    @PRECALC
+CPU_HEADER = r'''
+#include <cmath>
+#include <cstdio>
+#include <cstring>
+#include <climits>
+#define ATOMIC_ADD(addr, val) (*(addr) += (val))
+using namespace std;
+'''
+
+# The kernel bodies are shared by the cuda kernels and the cpu loops, so both
+# devices compute the same formulas.
+FORWARD_PRECALC = r'''
 @alias(input,in0);
 @alias(rois,in1);
 @alias(output,out0);
@@ -30,7 +40,9 @@ auto bottom_data =  input_p;
 auto bottom_rois = rois_p;
 auto top_data = output_p;
 auto argmax_data = argmax_p;
- for (int index = blockIdx.x * blockDim.x + threadIdx.x; index < nthreads; index += blockDim.x * gridDim.x) {
+'''
+
+FORWARD_BODY = r'''
     // (n, c, ph, pw) is an element in the pooled output
     int pw = index % pooled_width;
     int ph = (index / pooled_width) % pooled_height;
@@ -75,26 +87,12 @@ auto argmax_data = argmax_p;
     }
     top_data[index] = maxval;
     argmax_data[index] = maxidx;
-  }
-
-}
-cudaMemsetAsync(argmax_p,0,argmax->size);
-cudaMemsetAsync(output_p,0,output->size);
-const int total_count = in1_shape0 * out0_shape2 * out0_shape3 * in0_shape1;
-const int thread_per_block = 1024;
-const int block_count = (total_count + thread_per_block - 1) / thread_per_block;
-RoIPoolForwardKernel<<<block_count, thread_per_block>>>(@ARGS);
 '''
 
-CUDA_GRAD_SRC = [
-    r'''
-__global__ void RoIPoolBackwardKernel(@ARGS_DEF){
-    @PRECALC
+BACKWARD_PRECALC = r'''
     @alias(input,in0);
     @alias(rois,in1);
-    @alias(argmax,pout0)
     @alias(grad_input,out0);
-    @alias(grad,dout);
     const float spatial_scale = @in2(0);
     const int pooled_height = pout0_shape2;
     const int pooled_width = pout0_shape3;
@@ -107,7 +105,9 @@ __global__ void RoIPoolBackwardKernel(@ARGS_DEF){
     auto argmax_data = argmax_p;
     auto bottom_diff = grad_input_p;
     auto bottom_rois = rois_p;
-  for (int index = blockIdx.x * blockDim.x + threadIdx.x; index < nthreads; index += blockDim.x * gridDim.x){
+'''
+
+BACKWARD_BODY = r'''
     // (n, c, ph, pw) is an element in the pooled output
     int pw = index % pooled_width;
     int ph = (index / pooled_width) % pooled_height;
@@ -122,10 +122,45 @@ __global__ void RoIPoolBackwardKernel(@ARGS_DEF){
     auto offset_argmax_data = argmax_data + top_offset;
     int argmax = offset_argmax_data[ph * pooled_width + pw];
     if (argmax != -1) {
-      atomicAdd(
+      ATOMIC_ADD(
           offset_bottom_diff + argmax,
           offset_top_diff[ph * pooled_width + pw]);
     }
+'''
+
+CUDA_SRC = r'''
+__global__ static void RoIPoolForwardKernel(@ARGS_DEF){
+    @PRECALC
+''' + FORWARD_PRECALC + r'''
+ for (int index = blockIdx.x * blockDim.x + threadIdx.x; index < nthreads; index += blockDim.x * gridDim.x) {
+''' + FORWARD_BODY + r'''
+  }
+
+}
+cudaMemsetAsync(argmax_p,0,argmax->size);
+cudaMemsetAsync(output_p,0,output->size);
+const int total_count = in1_shape0 * out0_shape2 * out0_shape3 * in0_shape1;
+const int thread_per_block = 1024;
+const int block_count = (total_count + thread_per_block - 1) / thread_per_block;
+RoIPoolForwardKernel<<<block_count, thread_per_block>>>(@ARGS);
+'''
+
+CPU_SRC = FORWARD_PRECALC + r'''
+#pragma omp parallel for
+for (int index = 0; index < nthreads; index++) {
+''' + FORWARD_BODY + r'''
+}
+'''
+
+CUDA_GRAD_SRC = [
+    r'''
+__global__ void RoIPoolBackwardKernel(@ARGS_DEF){
+    @PRECALC
+    @alias(argmax,pout1)
+    @alias(grad,dout);
+''' + BACKWARD_PRECALC + r'''
+  for (int index = blockIdx.x * blockDim.x + threadIdx.x; index < nthreads; index += blockDim.x * gridDim.x){
+''' + BACKWARD_BODY + r'''
   }
 }
 cudaMemsetAsync(out0_p,0,out0->size);
@@ -138,6 +173,27 @@ RoIPoolBackwardKernel<<<block_count, thread_per_block>>>(@ARGS);
 '''
 ]
 
+CPU_GRAD_SRC = [
+    r'''
+// dout and pout1 are only aliased in the header, which is not seen by the
+// code on cpu
+@alias(argmax,in5)
+@alias(grad,in3)
+''' + BACKWARD_PRECALC + r'''
+memset(out0_p,0,out0->size);
+// rois of an image scatter to the same feature map, so the channels are
+// split among threads to avoid write conflicts
+const int pooled_size = pooled_height * pooled_width;
+#pragma omp parallel for
+for (int c = 0; c < channels; c++)
+for (int n = 0; n < num_rois; n++)
+for (int k = 0; k < pooled_size; k++) {
+    const int index = (n * channels + c) * pooled_size + k;
+''' + BACKWARD_BODY + r'''
+}
+''', '', ''
+]
+
 
 def roi_pool(input, rois, output_size, spatial_scale):
     output_size = _pair(output_size)
@@ -151,6 +207,9 @@ def roi_pool(input, rois, output_size, spatial_scale):
         output_shapes,
         output_types,
         inputs,
+        cpu_header=CPU_HEADER,
+        cpu_src=CPU_SRC,
+        cpu_grad_src=CPU_GRAD_SRC,
         cuda_header=CUDA_HEADER,
         cuda_src=CUDA_SRC,
         cuda_grad_src=CUDA_GRAD_SRC)
@@ -0,0 +1,175 @@
+import jittor as jt
+import numpy as np
+
+__all__ = ['segmented_topk', 'topk']
+
+CPU_HEADER = '''
+#include <algorithm>
+#include <cmath>
+#include <numeric>
+#include <vector>
+'''
+
+CPU_SRC = r'''
+    int k = out0_shape1;
+    #pragma omp parallel for
+    for (int s = 0; s < out0_shape0; s++) {
+        int64 begin = @in1(s), n = @in1(s + 1) - begin;
+        int64 m = std::min(n, (int64)k);
+        std::vector<int64> idx(n);
+        std::iota(idx.begin(), idx.end(), 0);
+        auto cmp = [&](int64 a, int64 b) {
+            float va = @in0(begin + a), vb = @in0(begin + b);
+            return va > vb || (va == vb && a < b);
+        };
+        if (m < n) std::nth_element(idx.begin(), idx.begin() + m, idx.end(),
+                                    cmp);
+        for (int i = 0; i < k; i++) {
+            @out0(s, i) = i < m ? @in0(begin + idx[i]) : -INFINITY;
+            @out1(s, i) = i < m ? idx[i] : -1;
+        }
+    }
+'''
+
+# Each block selects the top-k of a segment. The k-th largest key is found
+# by a radix select with 8-bit digits from the most significant one, then
+# keys larger than it and the first ones equal to it are written in the
+# order of indices by block-wide prefix sums.
+CUDA_SRC = r'''
+    __device__ __forceinline__ unsigned int float_key(float v) {
+        unsigned int u = __float_as_uint(v);
+        return (u & 0x80000000u) ? ~u : (u | 0x80000000u);
+    }
+
+    __global__ static void topk_kernel(@ARGS_DEF) {
+        @PRECALC
+        __shared__ int hist[256];
+        __shared__ int scan_gt[1024], scan_eq[1024];
+        __shared__ unsigned int prefix, mask;
+        __shared__ int remain, cnt_gt, cnt_eq;
+        int s = blockIdx.x, tid = threadIdx.x, tnum = blockDim.x;
+        int k = out0_shape1;
+        int64 begin = @in1(s), n = @in1(s + 1) - begin;
+        if (n <= k) {
+            for (int i = tid; i < k; i += tnum) {
+                @out0(s, i) = i < n ? @in0(begin + i) : -INFINITY;
+                @out1(s, i) = i < n ? i : -1;
+            }
+            return;
+        }
+        if (tid == 0) {
+            prefix = 0; mask = 0; remain = k;
+        }
+        for (int shift = 24; shift >= 0; shift -= 8) {
+            for (int i = tid; i < 256; i += tnum) hist[i] = 0;
+            __syncthreads();
+            for (int64 i = tid; i < n; i += tnum) {
+                unsigned int key = float_key(@in0(begin + i));
+                if ((key & mask) == prefix)
+                    atomicAdd(&hist[(key >> shift) & 255], 1);
+            }
+            __syncthreads();
+            if (tid == 0) {
+                int cum = 0;
+                for (int d = 255; d >= 0; d--) {
+                    if (cum + hist[d] >= remain) {
+                        prefix |= (unsigned int)d << shift;
+                        remain -= cum;
+                        break;
+                    }
+                    cum += hist[d];
+                }
+                mask |= 255u << shift;
+                cnt_gt = 0; cnt_eq = 0;
+            }
+            __syncthreads();
+        }
+        // prefix is the key of the k-th largest value, and `remain` values
+        // equal to it are selected
+        unsigned int kth = prefix;
+        int num_eq = remain, num_gt = k - remain;
+        for (int64 start = 0; start < n; start += tnum) {
+            int64 i = start + tid;
+            float v = i < n ? @in0(begin + i) : 0;
+            unsigned int key = float_key(v);
+            int gt = i < n && key > kth, eq = i < n && key == kth;
+            scan_gt[tid] = gt; scan_eq[tid] = eq;
+            __syncthreads();
+            for (int offset = 1; offset < tnum; offset <<= 1) {
+                int a = tid >= offset ? scan_gt[tid - offset] : 0;
+                int b = tid >= offset ? scan_eq[tid - offset] : 0;
+                __syncthreads();
+                scan_gt[tid] += a; scan_eq[tid] += b;
+                __syncthreads();
+            }
+            if (gt) {
+                int p = cnt_gt + scan_gt[tid] - 1;
+                @out0(s, p) = v; @out1(s, p) = i;
+            }
+            if (eq) {
+                int p = cnt_eq + scan_eq[tid] - 1;
+                if (p < num_eq) {
+                    @out0(s, num_gt + p) = v; @out1(s, num_gt + p) = i;
+                }
+            }
+            __syncthreads();
+            if (tid == tnum - 1) {
+                cnt_gt += scan_gt[tid]; cnt_eq += scan_eq[tid];
+            }
+            __syncthreads();
+        }
+    }
+    if (out0_shape0 > 0)
+        topk_kernel<<<out0_shape0, 1024>>>(@ARGS);
+'''
+
+
+def segmented_topk(scores, offsets, k):
+    """Select the top-k scores of each segment without sorting segments.
+
+    Different from sorting all scores and taking the first k ones, only the
+    k selected ones of each segment are sorted. Segments, e.g., the levels
+    of all images, are handled in a single launch.
+
+    Args:
+        scores (jt.Var): 1-D scores of concatenated segments.
+        offsets (list[int] | np.ndarray): Start of each segment in
+            ``scores`` followed by the total length, i.e., ``S + 1`` values
+            for ``S`` segments.
+        k (int): Number of scores to select from each segment.
+
+    Returns:
+        tuple[jt.Var]: The selected scores and their indices in their
+        segments, both with shape (S, k) and sorted by scores in descending
+        order. Segments shorter than ``k`` are padded with ``-inf`` and -1.
+    """
+    offsets = jt.array(np.asarray(offsets, dtype=np.int64))
+    num_segs = offsets.shape[0] - 1
+    out_shapes = [(num_segs, k), (num_segs, k)]
+    values, indices = jt.code(
+        out_shapes, [jt.float32, jt.int32], [scores.float32(), offsets],
+        cpu_header=CPU_HEADER,
+        cpu_src=CPU_SRC,
+        cuda_header='#include <cmath>',
+        cuda_src=CUDA_SRC)
+    order, values = jt.argsort(values, dim=1, descending=True)
+    return values, jt.gather(indices, 1, order)
+
+
+def topk(scores, k):
+    """Select the top-k scores along the last dimension.
+
+    Args:
+        scores (jt.Var): Scores with shape (..., N).
+        k (int): Number of scores to select, at most N ones are selected.
+
+    Returns:
+        tuple[jt.Var]: The selected scores and their indices with shape
+        (..., min(k, N)), sorted by scores in descending order.
+    """
+    *batch_shape, num = scores.shape
+    k = min(k, num)
+    num_rows = int(np.prod(batch_shape))
+    offsets = np.arange(num_rows + 1) * num
+    values, indices = segmented_topk(scores.reshape(-1), offsets, k)
+    return values.reshape(*batch_shape, k), indices.reshape(*batch_shape, k)
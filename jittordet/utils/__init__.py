@@ -1,8 +1,8 @@
 from .bbox_overlaps import bbox_overlaps
 from .bbox_transforms import bbox2distance, distance2bbox
 from .dist import reduce_mean
-from .image import (_scale_size, imflip, imnormalize, impad, impad_to_multiple,
-                    imrescale, imresize, rescale_size)
+from .image import (_scale_size, get_shape_bucket, imflip, imnormalize, impad,
+                    impad_to_multiple, imrescale, imresize, rescale_size)
 from .types import is_list_of, is_seq_of, is_tuple_of
 from .util_random import ensure_rng
 
@@ -10,5 +10,5 @@ __all__ = [
     '_scale_size', 'imresize', 'rescale_size', 'imrescale', 'imflip',
     'imnormalize', 'impad', 'impad_to_multiple', 'is_seq_of', 'is_list_of',
     'is_tuple_of', 'bbox_overlaps', 'ensure_rng', 'distance2bbox',
-    'bbox2distance', 'reduce_mean'
+    'bbox2distance', 'reduce_mean', 'get_shape_bucket'
 ]
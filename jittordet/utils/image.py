@@ -224,3 +224,21 @@ def impad_to_multiple(img: np.ndarray,
     pad_h = int(np.ceil(img.shape[0] / divisor)) * divisor
     pad_w = int(np.ceil(img.shape[1] / divisor)) * divisor
     return impad(img, shape=(pad_h, pad_w), pad_val=pad_val)
+
+
+def get_shape_bucket(shape: Tuple[int, int], buckets: np.ndarray) -> int:
+    """Get the index of the smallest bucket which can hold ``shape``.
+
+    Args:
+        shape (tuple[int]): (h, w) of a batch or an image.
+        buckets (np.ndarray): (h, w) of buckets with shape (K, 2).
+
+    Returns:
+        int: Index of the bucket, or -1 if no bucket is large enough.
+    """
+    fits = np.nonzero((buckets[:, 0] >= shape[0])
+                      & (buckets[:, 1] >= shape[1]))[0]
+    if fits.size == 0:
+        return -1
+    areas = buckets[fits, 0] * buckets[fits, 1]
+    return int(fits[np.argmin(areas)])
@@ -0,0 +1,123 @@
+import argparse
+import time
+
+import jittor as jt
+import numpy as np
+
+from jittordet.ops.nms import multiclass_nms
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark multiclass_nms against the per-class loop')
+    parser.add_argument(
+        '--num-classes',
+        type=int,
+        nargs='+',
+        default=[2, 20, 80],
+        help='numbers of foreground classes')
+    parser.add_argument(
+        '--num-boxes',
+        type=int,
+        nargs='+',
+        default=[100, 1000, 5000],
+        help='numbers of candidate boxes')
+    parser.add_argument(
+        '--score-thr', type=float, default=0.05, help='score threshold')
+    parser.add_argument(
+        '--iou-thr', type=float, default=0.5, help='NMS IoU threshold')
+    parser.add_argument(
+        '--max-per-img', type=int, default=100, help='max boxes to keep')
+    parser.add_argument(
+        '--repeat', type=int, default=10, help='timed runs of each case')
+    parser.add_argument(
+        '--disable-cuda',
+        action='store_true',
+        help='disable cuda and benchmark cpu kernels.')
+    return parser.parse_args()
+
+
+def loop_multiclass_nms(mlvl_bboxes, mlvl_scores, score_thr, nms, max_per_img):
+    """The previous implementation launching a NMS for each class."""
+    boxes, scores, labels = [], [], []
+    n_class = mlvl_scores.size(1)
+    if mlvl_bboxes.shape[1] > 4:
+        mlvl_bboxes = mlvl_bboxes.view(mlvl_bboxes.size(0), -1, 4)
+    else:
+        mlvl_bboxes = mlvl_bboxes.unsqueeze(1)
+        mlvl_bboxes = mlvl_bboxes.expand((mlvl_bboxes.size(0), n_class, 4))
+    for j in range(0, n_class - 1):
+        bbox_j = mlvl_bboxes[:, j, :]
+        score_j = mlvl_scores[:, j:j + 1]
+        mask = jt.where(score_j > score_thr)[0]
+        bbox_j = bbox_j[mask, :]
+        score_j = score_j[mask]
+        dets = jt.concat([bbox_j, score_j], dim=1)
+        keep = jt.nms(dets, nms['thresh'])
+        boxes.append(bbox_j[keep])
+        scores.append(score_j[keep])
+        labels.append(jt.ones_like(score_j[keep]).int32() * j)
+    boxes = jt.concat(boxes, dim=0)
+    scores = jt.concat(scores, dim=0)
+    index, _ = jt.argsort(scores, dim=0, descending=True)
+    index = index[:max_per_img, 0]
+    boxes = jt.concat([boxes, scores], dim=1)[index]
+    labels = jt.concat(labels, dim=0).squeeze(1)[index]
+    return boxes, labels
+
+
+def random_inputs(num_boxes, num_classes, rng):
+    xy = rng.uniform(0, 800, (num_boxes, num_classes, 2))
+    wh = rng.uniform(16, 256, (num_boxes, num_classes, 2))
+    bboxes = np.concatenate([xy, xy + wh], axis=-1).reshape(num_boxes, -1)
+    # about 30% of the scores are above 0.05 without ties
+    scores = rng.uniform(0, 1, (num_boxes, num_classes + 1))**8
+    return jt.array(bboxes.astype(np.float32)), jt.array(
+        scores.astype(np.float32))
+
+
+def benchmark(func, inputs, args):
+
+    def run():
+        dets, labels = func(*inputs, args.score_thr, dict(thresh=args.iou_thr),
+                            args.max_per_img)
+        jt.sync([dets, labels])
+        return dets, labels
+
+    outputs = run()  # compile the kernels
+    jt.sync_all(True)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        run()
+    jt.sync_all(True)
+    return outputs, (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    args = parse_args()
+    jt.flags.use_cuda = int(jt.has_cuda and not args.disable_cuda)
+    rng = np.random.default_rng(0)
+    print(f'{"classes":>8}{"boxes":>8}{"loop (ms)":>12}'
+          f'{"segmented (ms)":>16}{"speedup":>9}  same outputs')
+    for num_classes in args.num_classes:
+        for num_boxes in args.num_boxes:
+            inputs = random_inputs(num_boxes, num_classes, rng)
+            (ref_dets,
+             ref_labels), loop_time = benchmark(loop_multiclass_nms, inputs,
+                                                args)
+            (dets, labels), seg_time = benchmark(multiclass_nms, inputs, args)
+            # kept boxes are compared as sets since the order of boxes with
+            # equal scores is not defined
+            ref = np.concatenate(
+                [ref_dets.numpy(),
+                 ref_labels.numpy()[:, None]], axis=1)
+            out = np.concatenate(
+                [dets.numpy(), labels.numpy()[:, None]], axis=1)
+            same = ref.shape == out.shape and np.allclose(
+                np.unique(ref, axis=0), np.unique(out, axis=0))
+            print(f'{num_classes:>8}{num_boxes:>8}{loop_time:>12.2f}'
+                  f'{seg_time:>16.2f}{loop_time / seg_time:>8.1f}x  {same}')
+
+
+if __name__ == '__main__':
+    main()
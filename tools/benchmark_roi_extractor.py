@@ -0,0 +1,142 @@
+import argparse
+import time
+
+import jittor as jt
+import numpy as np
+
+from jittordet.models.roi_heads.roi_extractors import SingleRoIExtractor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the fused multi-level RoIAlign of '
+        'SingleRoIExtractor against the per-level loop')
+    parser.add_argument(
+        '--num-rois',
+        type=int,
+        nargs='+',
+        default=[512, 1000, 2000],
+        help='numbers of rois, 512 are sampled per image for training')
+    parser.add_argument(
+        '--channels', type=int, default=256, help='channels of the features')
+    parser.add_argument(
+        '--img-size',
+        type=int,
+        nargs=2,
+        default=[800, 1344],
+        help='height and width of the padded images')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='timed runs of each case')
+    parser.add_argument(
+        '--disable-cuda',
+        action='store_true',
+        help='disable cuda and benchmark cpu kernels.')
+    return parser.parse_args()
+
+
+def loop_roi_extractor(extractor, feats, rois, roi_scale_factor=None):
+    """The previous implementation launching a RoIAlign for each level."""
+    out_size = extractor.roi_layers[0].output_size
+    num_levels = len(feats)
+    roi_feats = jt.zeros(
+        rois.size(0), extractor.out_channels, *out_size, dtype=feats[0].dtype)
+    target_lvls = extractor.map_roi_levels(rois, num_levels)
+    if roi_scale_factor is not None:
+        rois = extractor.roi_rescale(rois, roi_scale_factor)
+    for i in range(num_levels):
+        inds = (target_lvls == i).nonzero().squeeze(1)
+        if inds.numel() > 0:
+            roi_feats[inds] = extractor.roi_layers[i](feats[i], rois[inds])
+    return roi_feats
+
+
+def build_extractor(channels, sampling_ratio=0, version=0):
+    return SingleRoIExtractor(
+        roi_layer=dict(
+            type='ROIAlign',
+            output_size=7,
+            sampling_ratio=sampling_ratio,
+            version=version),
+        out_channels=channels,
+        featmap_strides=[4, 8, 16, 32])
+
+
+def random_inputs(num_rois, num_imgs, channels, img_size, rng):
+    img_h, img_w = img_size
+    feats = [
+        jt.array(
+            rng.standard_normal((num_imgs, channels, img_h // s,
+                                 img_w // s)).astype(np.float32))
+        for s in (4, 8, 16, 32)
+    ]
+    # log-uniform sizes cover all the levels
+    xy = rng.uniform(-16, (img_w, img_h), (num_rois, 2))
+    wh = np.exp(rng.uniform(np.log(4), np.log(800), (num_rois, 2)))
+    inds = rng.integers(0, num_imgs, (num_rois, 1))
+    rois = np.concatenate([inds, xy, xy + wh], axis=1).astype(np.float32)
+    return feats, jt.array(rois)
+
+
+def check_extractor(rng):
+    feats, rois = random_inputs(200, 2, 8, (128, 160), rng)
+    results = []
+    for sampling_ratio in (0, 2):
+        for version in (0, 1):
+            for roi_scale_factor in (None, 1.5):
+                extractor = build_extractor(8, sampling_ratio, version)
+                outs = []
+                for func in (extractor, loop_roi_extractor):
+                    if func is extractor:
+                        out = extractor(feats, rois, roi_scale_factor)
+                    else:
+                        out = func(extractor, feats, rois, roi_scale_factor)
+                    out_grad = jt.array(
+                        np.random.default_rng(0).standard_normal(
+                            out.shape).astype(np.float32))
+                    grads = jt.grad((out * out_grad).sum(), feats)
+                    outs.append([out.numpy()] + [g.numpy() for g in grads])
+                same = all(np.allclose(a, b, atol=1e-5) for a, b in zip(*outs))
+                results.append(
+                    (f'sampling_ratio={sampling_ratio} version={version} '
+                     f'roi_scale_factor={roi_scale_factor}', same))
+    return results
+
+
+def benchmark(func, feats, rois, repeat):
+
+    def run():
+        out = func(feats, rois)
+        grads = jt.grad(out.sum(), feats)
+        jt.sync([out] + grads)
+
+    run()  # compile the kernels
+    jt.sync_all(True)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    jt.sync_all(True)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    args = parse_args()
+    jt.flags.use_cuda = int(jt.has_cuda and not args.disable_cuda)
+    rng = np.random.default_rng(0)
+    print('parity with the per-level loop')
+    for case, same in check_extractor(rng):
+        print(f'  {case}: {same}')
+
+    extractor = build_extractor(args.channels)
+    print(f'{"rois":>8}{"loop (ms)":>12}{"fused (ms)":>12}{"speedup":>9}')
+    for num_rois in args.num_rois:
+        feats, rois = random_inputs(num_rois, 2, args.channels, args.img_size,
+                                    rng)
+        loop_time = benchmark(lambda x, r: loop_roi_extractor(extractor, x, r),
+                              feats, rois, args.repeat)
+        fused_time = benchmark(extractor, feats, rois, args.repeat)
+        print(f'{num_rois:>8}{loop_time:>12.2f}{fused_time:>12.2f}'
+              f'{loop_time / fused_time:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
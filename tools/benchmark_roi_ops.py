@@ -0,0 +1,342 @@
+import argparse
+import math
+import time
+from functools import partial
+
+import jittor as jt
+import numpy as np
+
+from jittordet.ops.psroi_align import psroi_align
+from jittordet.ops.roi_align import roi_align
+from jittordet.ops.roi_align_rotated import roi_align as roi_align_rotated
+from jittordet.ops.roi_align_rotated_v1 import \
+    roi_align as roi_align_rotated_v1
+from jittordet.ops.roi_pool import roi_pool
+
+OPS = ['roi_align', 'roi_pool', 'psroi_align', 'roi_align_rotated']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check the cpu RoI ops against the cuda kernel formulas '
+        'and benchmark them')
+    parser.add_argument(
+        '--ops',
+        nargs='+',
+        default=OPS,
+        choices=OPS,
+        help='ops to check and benchmark')
+    parser.add_argument(
+        '--num-rois',
+        type=int,
+        nargs='+',
+        default=[100, 500, 1000],
+        help='numbers of rois, rpn keeps 1000 proposals per image')
+    parser.add_argument(
+        '--channels',
+        type=int,
+        nargs='+',
+        default=[256, 490],
+        help='channels of the features, psroi_align pools channels // 49 '
+        'score maps of 7x7 bins')
+    parser.add_argument(
+        '--feat-size',
+        type=int,
+        nargs=2,
+        default=[200, 336],
+        help='height and width of the features at stride 4')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='timed runs of each case')
+    parser.add_argument(
+        '--disable-cuda',
+        action='store_true',
+        help='disable cuda and benchmark cpu kernels.')
+    return parser.parse_args()
+
+
+def _bilinear_weights(y, x, height, width):
+    """Same as ``bilinear_interpolate_gradient`` of the kernels."""
+    if y < -1.0 or y > height or x < -1.0 or x > width:
+        return []
+    y, x = max(y, 0.), max(x, 0.)
+    y_low, x_low = int(y), int(x)
+    if y_low >= height - 1:
+        y_high = y_low = height - 1
+        y = float(y_low)
+    else:
+        y_high = y_low + 1
+    if x_low >= width - 1:
+        x_high = x_low = width - 1
+        x = float(x_low)
+    else:
+        x_high = x_low + 1
+    ly, lx = y - y_low, x - x_low
+    hy, hx = 1. - ly, 1. - lx
+    return [(y_low, x_low, hy * hx), (y_low, x_high, hy * lx),
+            (y_high, x_low, ly * hx), (y_high, x_high, ly * lx)]
+
+
+def _roi_align_samples(roi, out_size, spatial_scale, sampling_ratio, version,
+                       height, width):
+    """Yield ``(ph, pw, y, x, weight)`` of the bilinear samples of a roi."""
+    offset = 1 if version == 1 else 0
+    min_size = 0. if version == 1 else 1.
+    start_w, start_h = roi[1] * spatial_scale, roi[2] * spatial_scale
+    roi_w = max((roi[3] + offset) * spatial_scale - start_w, min_size)
+    roi_h = max((roi[4] + offset) * spatial_scale - start_h, min_size)
+    bin_h, bin_w = roi_h / out_size[0], roi_w / out_size[1]
+    if sampling_ratio > 0:
+        grid_h = grid_w = sampling_ratio
+    else:
+        grid_h = math.ceil(roi_h / out_size[0])
+        grid_w = math.ceil(roi_w / out_size[1])
+    count = grid_h * grid_w
+    for ph in range(out_size[0]):
+        for pw in range(out_size[1]):
+            for iy in range(grid_h):
+                y = start_h + ph * bin_h + (iy + .5) * bin_h / grid_h
+                for ix in range(grid_w):
+                    x = start_w + pw * bin_w + (ix + .5) * bin_w / grid_w
+                    for yy, xx, w in _bilinear_weights(y, x, height, width):
+                        yield ph, pw, yy, xx, w / count
+
+
+def numpy_roi_align(feats, rois, out_grad, out_size, spatial_scale,
+                    sampling_ratio, version):
+    """Reference forward and backward following the cuda kernels."""
+    height, width = feats.shape[2:]
+    output = np.zeros((len(rois), feats.shape[1]) + tuple(out_size))
+    feats_grad = np.zeros(feats.shape)
+    for n, roi in enumerate(rois):
+        b = int(roi[0])
+        for ph, pw, y, x, w in _roi_align_samples(roi, out_size, spatial_scale,
+                                                  sampling_ratio, version,
+                                                  height, width):
+            output[n, :, ph, pw] += w * feats[b, :, y, x]
+            feats_grad[b, :, y, x] += w * out_grad[n, :, ph, pw]
+    return output, feats_grad
+
+
+def numpy_roi_align_rotated(feats, rois, out_grad, out_size, spatial_scale,
+                            sampling_ratio, version):
+    """Reference forward and backward following the cuda kernels."""
+    height, width = feats.shape[2:]
+    output = np.zeros((len(rois), feats.shape[1]) + tuple(out_size))
+    feats_grad = np.zeros(feats.shape)
+    offset = 0.5 if version == 1 else 0.
+    for n, roi in enumerate(rois):
+        b = int(roi[0])
+        center_w = roi[1] * spatial_scale - offset
+        center_h = roi[2] * spatial_scale - offset
+        roi_w = max(roi[3] * spatial_scale, 1.)
+        roi_h = max(roi[4] * spatial_scale, 1.)
+        cos, sin = math.cos(roi[5]), math.sin(roi[5])
+        bin_h, bin_w = roi_h / out_size[0], roi_w / out_size[1]
+        if sampling_ratio > 0:
+            grid_h = grid_w = sampling_ratio
+        else:
+            grid_h = math.ceil(roi_h / out_size[0])
+            grid_w = math.ceil(roi_w / out_size[1])
+        count = max(grid_h * grid_w, 1)
+        for ph, pw, iy, ix in np.ndindex(*out_size, grid_h, grid_w):
+            yy = -roi_h / 2 + ph * bin_h + (iy + .5) * bin_h / grid_h
+            xx = -roi_w / 2 + pw * bin_w + (ix + .5) * bin_w / grid_w
+            # version 1 rotates the samples in the opposite direction
+            if version == 1:
+                x = xx * cos + yy * sin + center_w
+                y = yy * cos - xx * sin + center_h
+            else:
+                x = xx * cos - yy * sin + center_w
+                y = xx * sin + yy * cos + center_h
+            for yl, xl, w in _bilinear_weights(y, x, height, width):
+                output[n, :, ph, pw] += w / count * feats[b, :, yl, xl]
+                feats_grad[b, :, yl, xl] += w / count * out_grad[n, :, ph, pw]
+    return output, feats_grad
+
+
+def _c_round(x):
+    """Round half away from zero as ``round`` of C."""
+    return int(math.copysign(math.floor(abs(x) + 0.5), x))
+
+
+def numpy_roi_pool(feats, rois, out_grad, out_size, spatial_scale):
+    """Reference forward and backward following the cuda kernels."""
+    height, width = feats.shape[2:]
+    output = np.zeros((len(rois), feats.shape[1]) + tuple(out_size))
+    feats_grad = np.zeros(feats.shape)
+    for n, roi in enumerate(rois):
+        b = int(roi[0])
+        start_w, start_h, end_w, end_h = (
+            _c_round(v * spatial_scale) for v in roi[1:])
+        bin_h = max(end_h - start_h + 1, 1) / out_size[0]
+        bin_w = max(end_w - start_w + 1, 1) / out_size[1]
+        for ph in range(out_size[0]):
+            for pw in range(out_size[1]):
+                h0 = min(max(math.floor(ph * bin_h) + start_h, 0), height)
+                h1 = min(max(math.ceil((ph + 1) * bin_h) + start_h, 0), height)
+                w0 = min(max(math.floor(pw * bin_w) + start_w, 0), width)
+                w1 = min(max(math.ceil((pw + 1) * bin_w) + start_w, 0), width)
+                if h1 <= h0 or w1 <= w0:
+                    continue
+                region = feats[b, :, h0:h1, w0:w1].reshape(len(output[n]), -1)
+                argmax = region.argmax(axis=1)
+                output[n, :, ph, pw] = region.max(axis=1)
+                ys, xs = np.divmod(argmax, w1 - w0)
+                feats_grad[b, np.arange(len(argmax)), ys + h0,
+                           xs + w0] += out_grad[n, :, ph, pw]
+    return output, feats_grad
+
+
+def numpy_psroi_align(feats, rois, out_grad, out_size, spatial_scale,
+                      sampling_ratio, out_dim):
+    """Reference forward and backward following the cuda kernels."""
+    height, width = feats.shape[2:]
+    output = np.zeros((len(rois), out_dim) + tuple(out_size))
+    feats_grad = np.zeros(feats.shape)
+    bins = out_size[0] * out_size[1]
+    for n, roi in enumerate(rois):
+        b = int(roi[0])
+        # the samples are the same as those of RoIAlign of version 0, but
+        # each bin is pooled from its own group of channels
+        for ph, pw, y, x, w in _roi_align_samples(roi, out_size, spatial_scale,
+                                                  sampling_ratio, 0, height,
+                                                  width):
+            chans = np.arange(out_dim) * bins + ph * out_size[1] + pw
+            output[n, :, ph, pw] += w * feats[b, chans, y, x]
+            feats_grad[b, chans, y, x] += w * out_grad[n, :, ph, pw]
+    return output, feats_grad
+
+
+def random_rois(num_rois, num_imgs, img_shape, max_size, rng):
+    img_h, img_w = img_shape
+    xy = rng.uniform(-16, (img_w, img_h), (num_rois, 2))
+    wh = rng.uniform(0, max_size, (num_rois, 2))
+    inds = rng.integers(0, num_imgs, (num_rois, 1))
+    return np.concatenate([inds, xy, xy + wh], axis=1).astype(np.float32)
+
+
+def random_rotated_rois(num_rois, num_imgs, img_shape, max_size, rng):
+    rois = random_rois(num_rois, num_imgs, img_shape, max_size, rng)
+    centers = (rois[:, 1:3] + rois[:, 3:5]) / 2
+    sizes = rois[:, 3:5] - rois[:, 1:3]
+    thetas = rng.uniform(-np.pi, np.pi, (num_rois, 1))
+    return np.concatenate([rois[:, :1], centers, sizes, thetas],
+                          axis=1).astype(np.float32)
+
+
+def _check(func, ref_func, feats, rois, out_shape, rng):
+    out_grad = rng.standard_normal(out_shape).astype(np.float32)
+    ref_out, ref_grad = ref_func(feats, rois, out_grad)
+    x = jt.array(feats)
+    out = func(x, jt.array(rois))
+    grad = jt.grad((out * jt.array(out_grad)).sum(), x)
+    return np.allclose(
+        out.numpy(), ref_out, atol=1e-5) and np.allclose(
+            grad.numpy(), ref_grad, atol=1e-5)
+
+
+def check_ops(ops, rng):
+    feats = rng.standard_normal((2, 2 * 35, 13, 17)).astype(np.float32)
+    rois = random_rois(16, 2, (52, 68), 34, rng)
+    # tiny and inverted boxes exercise the minimum roi sizes
+    rois[:2, 3:] = rois[:2, 1:3] + np.float32(0.5)
+    rois[2, 3:] = rois[2, 1:3] - np.float32(0.5)
+    out_size, spatial_scale = (7, 5), 0.25
+    results = []
+    for sampling_ratio in (0, 2):
+        if 'roi_align' in ops:
+            for version in (0, 1):
+                args = (out_size, spatial_scale, sampling_ratio, version)
+                same = _check(lambda x, r: roi_align(x, r, *args),
+                              lambda x, r, g: numpy_roi_align(x, r, g, *args),
+                              feats, rois,
+                              (len(rois), feats.shape[1]) + out_size, rng)
+                results.append((f'roi_align version={version} '
+                                f'sampling_ratio={sampling_ratio}', same))
+        if 'roi_align_rotated' in ops:
+            rotated_rois = random_rotated_rois(16, 2, (52, 68), 34, rng)
+            args = (out_size, spatial_scale, sampling_ratio)
+            funcs = (roi_align_rotated, roi_align_rotated_v1)
+            for version, func in enumerate(funcs):
+                same = _check(
+                    lambda x, r: func(x, r, *args),
+                    lambda x, r, g: numpy_roi_align_rotated(
+                        x, r, g, *args, version), feats, rotated_rois,
+                    (len(rotated_rois), feats.shape[1]) + out_size, rng)
+                results.append((f'roi_align_rotated version={version} '
+                                f'sampling_ratio={sampling_ratio}', same))
+        if 'psroi_align' in ops:
+            args = (out_size, spatial_scale, sampling_ratio, 2)
+            same = _check(lambda x, r: psroi_align(x, r, *args),
+                          lambda x, r, g: numpy_psroi_align(x, r, g, *args),
+                          feats, rois, (len(rois), 2) + out_size, rng)
+            results.append(
+                (f'psroi_align sampling_ratio={sampling_ratio}', same))
+    if 'roi_pool' in ops:
+        args = (out_size, spatial_scale)
+        same = _check(lambda x, r: roi_pool(x, r, *args),
+                      lambda x, r, g: numpy_roi_pool(x, r, g, *args), feats,
+                      rois, (len(rois), feats.shape[1]) + out_size, rng)
+        results.append(('roi_pool', same))
+    return results
+
+
+def benchmark(func, inputs, repeat):
+    feats = inputs[0]
+
+    def run():
+        out = func(*inputs)
+        grad = jt.grad(out.sum(), feats)
+        jt.sync([out, grad])
+
+    run()  # compile the kernels
+    jt.sync_all(True)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    jt.sync_all(True)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    args = parse_args()
+    jt.flags.use_cuda = int(jt.has_cuda and not args.disable_cuda)
+    rng = np.random.default_rng(0)
+    print('parity with the kernel formulas')
+    for case, same in check_ops(args.ops, rng):
+        print(f'  {case}: {same}')
+
+    height, width = args.feat_size
+    print(f'{"op":>18}{"channels":>10}{"rois":>8}{"fwd+bwd (ms)":>14}')
+    for op in args.ops:
+        for channels in args.channels:
+            if op == 'psroi_align':
+                out_dim = max(channels // 49, 1)
+                channels = out_dim * 49
+                func = partial(psroi_align, out_dim=out_dim)
+                op_args = ((7, 7), 0.25, 0)
+            elif op == 'roi_pool':
+                func, op_args = roi_pool, ((7, 7), 0.25)
+            elif op == 'roi_align_rotated':
+                func, op_args = roi_align_rotated, ((7, 7), 0.25, 0)
+            else:
+                func, op_args = roi_align, ((7, 7), 0.25, 0, 0)
+            feats = jt.array(
+                rng.standard_normal(
+                    (2, channels, height, width)).astype(np.float32))
+            for num_rois in args.num_rois:
+                # rois smaller than 112 are mapped to the level of stride 4
+                # by SingleRoIExtractor
+                make_rois = (
+                    random_rotated_rois
+                    if op == 'roi_align_rotated' else random_rois)
+                rois = jt.array(
+                    make_rois(num_rois, 2, (height * 4, width * 4), 112, rng))
+                cost = benchmark(func, (feats, rois) + op_args, args.repeat)
+                print(f'{op:>18}{channels:>10}{num_rois:>8}{cost:>14.2f}')
+            del feats
+            jt.gc()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import time
+
+import jittor as jt
+import numpy as np
+
+from jittordet.models.layers import Scattering2D
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Check Scattering2D against kymatio and benchmark it')
+    parser.add_argument(
+        '--shapes',
+        type=int,
+        nargs='+',
+        default=[32, 40, 64, 64, 96, 128],
+        help='pairs of input heights and widths')
+    parser.add_argument(
+        '--J', type=int, default=2, help='log-2 of the scattering scale')
+    parser.add_argument(
+        '--L', type=int, default=8, help='number of wavelet angles')
+    parser.add_argument(
+        '--batch-size', type=int, default=2, help='batch size of inputs')
+    parser.add_argument(
+        '--channels', type=int, default=3, help='channels of inputs')
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='timed runs of each case')
+    parser.add_argument(
+        '--disable-cuda',
+        action='store_true',
+        help='disable cuda and benchmark cpu kernels.')
+    return parser.parse_args()
+
+
+def get_reference(J, shape, L):
+    """The numpy frontend of kymatio, None if it is not installed."""
+    try:
+        from kymatio.numpy import Scattering2D as KymatioScattering2D
+    except ImportError:
+        return None
+    return KymatioScattering2D(J=J, shape=shape, L=L)
+
+
+def benchmark(func, inputs, repeat):
+
+    def run():
+        out = func(inputs)
+        if isinstance(out, jt.Var):
+            out.sync()
+        return out
+
+    run()  # compile the kernels
+    jt.sync_all(True)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    jt.sync_all(True)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    args = parse_args()
+    assert len(args.shapes) % 2 == 0, 'shapes should be pairs of (h, w)'
+    jt.flags.use_cuda = int(jt.has_cuda and not args.disable_cuda)
+    rng = np.random.default_rng(0)
+    shapes = list(zip(args.shapes[::2], args.shapes[1::2]))
+    if get_reference(args.J, shapes[0], args.L) is None:
+        print('kymatio is not installed, parity is not checked')
+    print(f'{"shape":>12}{"jittor (ms)":>13}{"kymatio (ms)":>14}'
+          f'{"max abs diff":>14}')
+    for shape in shapes:
+        x = rng.standard_normal((args.batch_size, args.channels) +
+                                shape).astype(np.float32)
+        scattering = Scattering2D(J=args.J, shape=shape, L=args.L)
+        out = scattering(jt.array(x)).numpy()
+        cost = benchmark(scattering, jt.array(x), args.repeat)
+        reference = get_reference(args.J, shape, args.L)
+        if reference is None:
+            ref_cost, diff = '-', '-'
+        else:
+            ref_out = reference(x)
+            assert ref_out.shape == out.shape, \
+                f'{ref_out.shape} != {out.shape}'
+            diff = f'{np.abs(ref_out - out).max():.2e}'
+            ref_cost = f'{benchmark(reference, x, args.repeat):.2f}'
+        print(f'{str(shape):>12}{cost:>13.2f}{ref_cost:>14}{diff:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+
+from jittordet.datasets.image_shards import ImageShardWriter
+from jittordet.engine import DATASETS, load_cfg
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack the images of a dataset into shards')
+    parser.add_argument('config', help='config file path')
+    parser.add_argument('out_dir', help='the dir to save shards')
+    parser.add_argument(
+        '--splits',
+        nargs='+',
+        default=['train_dataset'],
+        help='dataset keys in the config whose images will be packed')
+    parser.add_argument(
+        '--shard-size',
+        type=int,
+        default=1024,
+        help='max size of one shard in MB')
+    return parser.parse_args()
+
+
+def strip_transforms(dataset_cfg):
+    """Disable the transforms of every leaf dataset in ``dataset_cfg``.
+
+    Wrapper datasets such as ``ConcatDataset`` do not accept ``transforms``,
+    so the key is only set on the datasets they wrap.
+    """
+    if 'datasets' in dataset_cfg:
+        for sub_cfg in dataset_cfg['datasets']:
+            strip_transforms(sub_cfg)
+    else:
+        dataset_cfg['transforms'] = None
+
+
+def main():
+    args = parse_args()
+    cfg = load_cfg(args.config)
+
+    img_paths = []
+    for split in args.splits:
+        dataset_cfg = cfg[split]
+        # shards are built from the raw data list, and the transforms are
+        # not built since ``LoadImageFromShard`` needs the shards to exist
+        dataset_cfg.pop('batch_sampler', None)
+        strip_transforms(dataset_cfg)
+        dataset = DATASETS.build(dataset_cfg)
+        img_paths.extend(data['img_path'] for data in dataset.data_list)
+
+    # images shared by several splits are packed only once
+    img_paths = list(dict.fromkeys(img_paths))
+    with ImageShardWriter(args.out_dir, args.shard_size << 20) as writer:
+        for i, img_path in enumerate(img_paths):
+            writer.write(img_path)
+            if (i + 1) % 1000 == 0 or i + 1 == len(img_paths):
+                print(f'[{i + 1}/{len(img_paths)}] images packed')
+    print(f'{len(writer.shard_files)} shards are saved to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
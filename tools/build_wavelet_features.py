@@ -0,0 +1,122 @@
+import argparse
+
+import jittor as jt
+
+from jittordet.datasets.feature_store import FeatureStoreWriter
+from jittordet.engine import DATASETS, MODELS, load_cfg
+from jittordet.models.layers import Scattering2D
+from jittordet.utils import imflip
+
+# transforms that are placed after the geometric ones in the pipeline
+SKIPPED_TRANSFORMS = ('RandomFlip', 'LoadWaveletFeatures', 'PackDetInputs')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Precompute the wavelet features of MSFA')
+    parser.add_argument('config', help='config file path')
+    parser.add_argument('out_dir', help='the dir to save features')
+    parser.add_argument(
+        '--splits',
+        nargs='+',
+        default=['train_dataset'],
+        help='dataset keys in the config whose features will be computed')
+    parser.add_argument(
+        '--batch-size', type=int, default=8, help='images per batch')
+    return parser.parse_args()
+
+
+def get_flip_directions(transforms):
+    """Get all flip directions of ``RandomFlip`` in a pipeline, None means
+    non-flip."""
+    directions = [None]
+    for transform in transforms:
+        if transform['type'] == 'RandomFlip':
+            direction = transform.get('direction', 'horizontal')
+            if isinstance(direction, str):
+                direction = [direction]
+            directions.extend(d for d in direction if d not in directions)
+    return directions
+
+
+def build_dataset(dataset_cfg):
+    dataset_cfg = dataset_cfg.copy()
+    # features are computed in order, before random flipping
+    dataset_cfg.pop('batch_sampler', None)
+    dataset_cfg['transforms'] = [
+        t for t in dataset_cfg['transforms']
+        if t['type'] not in SKIPPED_TRANSFORMS
+    ]
+    return DATASETS.build(dataset_cfg)
+
+
+def main():
+    args = parse_args()
+    cfg = load_cfg(args.config)
+    jt.flags.use_cuda = jt.has_cuda
+
+    input_size = tuple(cfg.model.backbone.get('input_size', (800, 800)))
+    preprocessor = MODELS.build(cfg.model.preprocessor)
+    scattering = Scattering2D(J=2, shape=input_size)
+    feat_shape = (81, input_size[0] // 4, input_size[1] // 4)
+
+    splits = []
+    for split in args.splits:
+        dataset = build_dataset(cfg[split])
+        directions = get_flip_directions(cfg[split]['transforms'])
+        splits.append((dataset, directions))
+
+    # images shared by several splits are computed only once
+    img_paths = dict()
+    for dataset, directions in splits:
+        for data_info in dataset.data_list:
+            img_paths.setdefault(data_info['img_path'], len(directions))
+    num_imgs, num_items = len(img_paths), sum(img_paths.values())
+
+    def flush(batch, writer):
+        data = dict(inputs=[jt.array(img) for _, _, img in batch])
+        with jt.no_grad():
+            inputs = preprocessor(data)['inputs']
+            assert tuple(inputs.shape[-2:]) == input_size, (
+                f'inputs are padded to {tuple(inputs.shape[-2:])}, but '
+                f'MSFA is built with input_size {input_size}')
+            if inputs.shape[1] != 1:
+                inputs = inputs.mean(1, keepdims=True)
+            feats = scattering(inputs).squeeze(1).float16().numpy()
+        for (img_path, direction, _), feat in zip(batch, feats):
+            writer.write(img_path, feat, direction)
+        batch.clear()
+
+    meta = dict(img_shape=list(input_size), J=2, L=8, config=args.config)
+    seen = set()
+    with FeatureStoreWriter(
+            args.out_dir, num_items, feat_shape, meta=meta) as writer:
+        batch = []
+        for dataset, directions in splits:
+            for idx in range(len(dataset.data_list)):
+                img_path = dataset.data_list[idx]['img_path']
+                if img_path in seen:
+                    continue
+                seen.add(img_path)
+                results = dataset.prepare_data(idx)
+                img = results['img']
+                if img.ndim < 3:
+                    img = img[..., None]
+                for direction in directions:
+                    flipped = img if direction is None else imflip(
+                        img, direction)
+                    if flipped.ndim < 3:
+                        flipped = flipped[..., None]
+                    flipped = flipped.transpose(2, 0, 1).copy()
+                    batch.append((img_path, direction, flipped))
+                if len(batch) >= args.batch_size:
+                    flush(batch, writer)
+                if len(seen) % 1000 == 0 or len(seen) == num_imgs:
+                    print(f'[{len(seen)}/{num_imgs}] images processed')
+        if len(batch) > 0:
+            flush(batch, writer)
+    print(f'{num_items} features are saved to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import copy
+
+from build_shards import strip_transforms
+
+TRANSFORMS = [dict(type='LoadImageFromShard'), dict(type='PackDetInputs')]
+
+
+def check_single_dataset():
+    dataset_cfg = dict(
+        type='VocDataset', batch_size=2, transforms=copy.deepcopy(TRANSFORMS))
+    strip_transforms(dataset_cfg)
+    assert dataset_cfg['transforms'] is None
+
+
+def check_concat_dataset():
+    dataset_cfg = dict(
+        type='ConcatDataset',
+        batch_size=2,
+        datasets=[
+            dict(type='VocDataset', transforms=copy.deepcopy(TRANSFORMS)),
+            dict(type='VocDataset', transforms=copy.deepcopy(TRANSFORMS))
+        ])
+    strip_transforms(dataset_cfg)
+    # ConcatDataset passes unknown kwargs to jittor's Dataset
+    assert 'transforms' not in dataset_cfg
+    for sub_cfg in dataset_cfg['datasets']:
+        assert sub_cfg['transforms'] is None
+
+
+def main():
+    check_single_dataset()
+    check_concat_dataset()
+    print('strip_transforms is checked on single and concat datasets')
+
+
+if __name__ == '__main__':
+    main()
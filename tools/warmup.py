@@ -0,0 +1,73 @@
+import argparse
+import os
+import os.path as osp
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Precompile the kernels of a detector')
+    parser.add_argument('config', help='config file path')
+    parser.add_argument(
+        '--checkpoint',
+        help='checkpoint to load from, kernels are compiled with initial '
+        'weights if it is not set')
+    parser.add_argument(
+        '--cache-dir',
+        help='the JITTOR_HOME to persist compiled kernels, start workers '
+        'with the same JITTOR_HOME to reuse them')
+    parser.add_argument(
+        '--phases',
+        nargs='+',
+        default=['train', 'test'],
+        choices=['train', 'val', 'test'],
+        help='phases whose kernels will be compiled')
+    parser.add_argument(
+        '--shapes',
+        nargs='+',
+        help='batch shapes like 800x1333, defaults to warmup.shapes in the '
+        'config or batch_shape_buckets of the preprocessor')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        nargs='+',
+        help='batch sizes, defaults to the ones of datasets')
+    parser.add_argument('--work-dir', help='the dir to save logs')
+    parser.add_argument(
+        '--disable-cuda',
+        action='store_true',
+        help='disable cuda and compile cpu kernels.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.cache_dir is not None:
+        # jittor locates its kernel cache by JITTOR_HOME when it is imported
+        os.environ['JITTOR_HOME'] = osp.abspath(args.cache_dir)
+    from jittordet.engine import Runner, load_cfg
+
+    cfg = load_cfg(args.config)
+    cfg.load_from = args.checkpoint
+    if args.work_dir is not None:
+        cfg.work_dir = args.work_dir
+    elif cfg.get('work_dir', None) is None:
+        # use config filename as default work_dir if cfg.work_dir is None
+        cfg.work_dir = osp.join('./work_dirs',
+                                osp.splitext(osp.basename(args.config))[0])
+    warmup = dict(cfg.get('warmup', None) or {})
+    if args.shapes is not None:
+        warmup['shapes'] = [
+            tuple(int(x) for x in shape.split('x')) for shape in args.shapes
+        ]
+    if args.batch_size is not None:
+        warmup['batch_size'] = args.batch_size
+    cfg.warmup = warmup
+    # set disable cuda
+    cfg.disable_cuda = args.disable_cuda
+
+    runner = Runner.from_cfg(cfg)
+    runner.warmup(args.phases)
+
+
+if __name__ == '__main__':
+    main()